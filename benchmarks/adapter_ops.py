@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of the basic adapter operations, in operations per second. Runs on SQLite by default,
+set BENCH_DATABASE_URL to a MySQL database to compare both adapters on the same workload.
+"""
+import time
+import random
+import asyncio
+
+from benchmarks.common import connect, report
+from core.database import get_db
+
+COUNT = 2000
+
+
+async def ops_per_second(f, count=COUNT):
+	start = time.perf_counter()
+	for i in range(count):
+		await f(i)
+	return int(count / (time.perf_counter() - start))
+
+
+async def main():
+	await connect()
+	db = get_db()  # the adapter itself, past the query cache of the db proxy
+	rnd = random.Random(1)
+
+	async def insert(i):
+		await db.insert('qc_players', dict(channel_id=1, user_id=i, nick=f"player{i}", rating=rnd.randint(800, 2500)))
+
+	async def select_one(i):
+		await db.select_one(('rating', 'deviation'), 'qc_players', where=dict(channel_id=1, user_id=rnd.randrange(COUNT)))
+
+	async def update(i):
+		await db.update('qc_players', dict(rating=rnd.randint(800, 2500)), keys=dict(channel_id=1, user_id=i))
+
+	async def insert_many(i):
+		await db.insert_many('qc_players', (
+			dict(channel_id=2, user_id=i * 100 + j, nick=f"player{j}") for j in range(100)
+		), on_dublicate='ignore')
+
+	async def concurrent_select(i):
+		await asyncio.gather(*(select_one(i) for j in range(10)))
+
+	rows = [
+		('insert', await ops_per_second(insert)),
+		('select_one by key', await ops_per_second(select_one)),
+		('update by key', await ops_per_second(update)),
+		('insert_many of 100 rows', await ops_per_second(insert_many, COUNT // 10)),
+		('10 concurrent select_one', await ops_per_second(concurrent_select, COUNT // 10)),
+		('select of a channel', await ops_per_second(
+			lambda i: db.select(('user_id', 'rating'), 'qc_players', where=dict(channel_id=1)), COUNT // 10
+		)),
+	]
+	report(f"{type(db).__module__} adapter, operations per second", ('operation', 'ops/s'), rows)
+	await db.close()
+
+
+if __name__ == '__main__':
+	asyncio.run(main())
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Shared setup of the benchmark scripts, run them from the repository root: python -m benchmarks.<name>
+They run on a throwaway SQLite database, set BENCH_DATABASE_URL to an empty MySQL database to run them there.
+"""
+import os
+import time
+import tempfile
+import statistics
+
+os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL') or 'sqlite://' + os.path.join(
+	tempfile.mkdtemp(prefix='pubobot-bench-'), 'bench.db'
+)
+os.environ.setdefault('DC_BOT_TOKEN', 'benchmark')  # the benchmarks never connect to discord
+os.environ.setdefault('DB_SLOW_QUERY_MS', '0')
+
+
+def measure(f, *args, repeat=5):
+	""" Median seconds of f(*args) """
+	samples = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		f(*args)
+		samples.append(time.perf_counter() - start)
+	return statistics.median(samples)
+
+
+async def ameasure(f, *args, repeat=5):
+	""" Median seconds of await f(*args) """
+	samples = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		await f(*args)
+		samples.append(time.perf_counter() - start)
+	return statistics.median(samples)
+
+
+async def connect():
+	""" Connect to the benchmark database and create the bot tables """
+	from core.database import db, journal
+	from bot.stats import stats
+
+	await db.connect()
+	journal.register_table()
+	stats.register_tables()
+	await db.reconcile_tables()
+	return db
+
+
+def report(title, header, rows):
+	""" Print the rows as an aligned table """
+	rows = [[f"{v:.3f}" if isinstance(v, float) else str(v) for v in row] for row in rows]
+	widths = [max(len(str(h)), *(len(row[i]) for row in rows)) for i, h in enumerate(header)]
+	print(f"\n{title}")
+	print("  ".join((str(h).rjust(w) for h, w in zip(header, widths))))
+	for row in rows:
+		print("  ".join((v.rjust(w) for v, w in zip(row, widths))))
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Latency of the interactive queries of the user commands while the weekly rating decay of a large channel
+runs on the background pool, against the same queries on an idle database.
+"""
+import time
+import random
+import asyncio
+import statistics
+
+from benchmarks.common import connect, report
+from core.database import get_db
+from bot.stats.rating import FlatRating
+
+CHANNEL_SIZE = 50000
+RANKS = [dict(rank=f"R{i}", rating=i * 200, role=None) for i in range(14)]
+
+
+async def interactive_latencies(stop, samples):
+	""" Keyed player lookups as /rank and /add do, until stop is set """
+	db, rnd = get_db(), random.Random(2)
+	while not stop.is_set():
+		start = time.perf_counter()
+		await db.select_one(
+			('rating', 'deviation'), 'qc_players', where=dict(channel_id=1, user_id=rnd.randrange(CHANNEL_SIZE))
+		)
+		samples.append((time.perf_counter() - start) * 1000)
+		await asyncio.sleep(0.001)
+
+
+def row(name, samples, duration=None):
+	samples = sorted(samples)
+	return (
+		name, len(samples), statistics.median(samples), samples[int(len(samples) * 0.95)], samples[-1],
+		duration if duration is not None else '-'
+	)
+
+
+async def main():
+	db = await connect()
+	rnd = random.Random(1)
+	week_ago = int(time.time()) - 8 * 24 * 3600
+	await db.insert_many('qc_players', (
+		dict(
+			channel_id=1, user_id=user_id, nick=f"player{user_id}",
+			rating=rnd.randint(800, 2500), deviation=rnd.randint(60, 300)
+		) for user_id in range(CHANNEL_SIZE)
+	))
+	await db.insert_many('qc_rating_history', (
+		dict(
+			channel_id=1, user_id=user_id, at=week_ago - rnd.randint(0, 30 * 24 * 3600), rating_before=1500,
+			rating_change=0, deviation_before=100, deviation_change=0, match_id=user_id, reason='6v6'
+		) for user_id in range(CHANNEL_SIZE)
+	))
+
+	stop, idle = asyncio.Event(), []
+	task = asyncio.create_task(interactive_latencies(stop, idle))
+	await asyncio.sleep(2)
+	stop.set()
+	await task
+
+	stop, busy = asyncio.Event(), []
+	task = asyncio.create_task(interactive_latencies(stop, busy))
+	start = time.perf_counter()
+	await FlatRating(channel_id=1).apply_decay(10, 5, RANKS)
+	duration = time.perf_counter() - start
+	stop.set()
+	await task
+
+	report(
+		f"Keyed player lookups, ms, while the decay of a {CHANNEL_SIZE} player channel runs on the background pool",
+		('', 'queries', 'p50', 'p95', 'max', 'decay s'), [row('idle', idle), row('during decay', busy, duration)]
+	)
+	print("Pools:", get_db().pool_info(), get_db().background.pool_info())
+	await db.close()
+
+
+if __name__ == '__main__':
+	asyncio.run(main())
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Latency of BaseRating.get_players() for a 12 player match against the channel size: the full channel
+scan it used to do, the keyed lookup with a cold RatingStore and the lookup served by the store.
+"""
+import random
+import asyncio
+
+from benchmarks.common import ameasure, connect, report
+from core.database import get_db
+from bot.stats.rating import FlatRating
+
+SIZES = (1000, 10000, 50000)
+COLUMNS = ('user_id', 'rating', 'deviation', 'channel_id', 'wins', 'losses', 'draws', 'streak')
+
+
+async def full_scan(channel_id, user_ids):
+	""" The former get_players() lookup, the whole channel is selected and scanned per player """
+	data = await get_db().select(COLUMNS, 'qc_players', where={'channel_id': channel_id})
+	return [next((p for p in data if p['user_id'] == user_id), None) for user_id in user_ids]
+
+
+async def main():
+	db = await connect()
+	rnd = random.Random(1)
+	rows = []
+	for channel_id, size in enumerate(SIZES, start=1):
+		await db.insert_many('qc_players', (
+			dict(
+				channel_id=channel_id, user_id=user_id, nick=f"player{user_id}",
+				rating=rnd.randint(800, 2500), deviation=rnd.randint(60, 300)
+			) for user_id in range(size)
+		))
+		rating = FlatRating(channel_id=channel_id)
+		user_ids = rnd.sample(range(size), 12)
+
+		async def cold():
+			rating.store.clear()
+			await rating.get_players(user_ids)
+
+		rows.append((
+			size,
+			await ameasure(full_scan, channel_id, user_ids) * 1000,
+			await ameasure(cold) * 1000,
+			await ameasure(rating.get_players, user_ids) * 1000
+		))
+	report("get_players() of a 12 player match, ms", ('channel size', 'full scan', 'keyed', 'cached'), rows)
+	await db.close()
+
+
+if __name__ == '__main__':
+	asyncio.run(main())
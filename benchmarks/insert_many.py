@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Writing back the ratings of a whole channel, as snap_ratings() and apply_decay() do: REPLACE of the full
+rows via executemany against the chunked multi-row upsert of the changed columns.
+"""
+import random
+import asyncio
+
+from benchmarks.common import ameasure, connect, report
+
+CHANNEL_SIZE = 50000
+CHUNK_SIZES = (100, 500, 2000)
+
+
+async def main():
+	db = await connect()
+	rnd = random.Random(1)
+	await db.insert_many('qc_players', (
+		dict(
+			channel_id=1, user_id=user_id, nick=f"player{user_id}",
+			rating=rnd.randint(800, 2500), deviation=rnd.randint(60, 300), wins=rnd.randint(0, 500)
+		) for user_id in range(CHANNEL_SIZE)
+	))
+	players = await db.select(('*', ), 'qc_players', where=dict(channel_id=1))
+
+	async def replace():
+		await db.insert_many('qc_players', (
+			dict(p, rating=p['rating'] - 1, deviation=p['deviation'] + 1) for p in players
+		), on_dublicate='replace')
+
+	def upsert(chunk_size):
+		async def f():
+			await db.insert_many('qc_players', (
+				dict(channel_id=1, user_id=p['user_id'], rating=p['rating'] - 1, deviation=p['deviation'] + 1)
+				for p in players
+			), on_dublicate='update', update_columns=('rating', 'deviation'), chunk_size=chunk_size)
+		return f
+
+	rows = [('replace', await ameasure(replace, repeat=3) * 1000)]
+	for chunk_size in CHUNK_SIZES:
+		rows.append((f"upsert, {chunk_size} rows per statement", await ameasure(upsert(chunk_size), repeat=3) * 1000))
+	report(f"Rating write back of a {CHANNEL_SIZE} player channel, ms", ('', 'total'), rows)
+	await db.close()
+
+
+if __name__ == '__main__':
+	asyncio.run(main())
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+""" Throughput of rate_many() against sequential rate() calls of the rating systems, in matches per second """
+import io
+import random
+from contextlib import redirect_stdout
+
+from benchmarks.common import measure, report
+from bot.stats.rating import FlatRating, Glicko2Rating, TrueSkillRating, Quidditch6v6Rating
+
+
+def random_matches(count, team_size=5):
+	rnd = random.Random(1)
+	matches = []
+	for i in range(count):
+		players = [
+			dict(
+				user_id=user_id, channel_id=1, rating=rnd.randint(500, 2800), deviation=rnd.randint(40, 350),
+				wins=rnd.randint(0, 50), losses=rnd.randint(0, 50), draws=0, streak=rnd.randint(-8, 8)
+			) for user_id in rnd.sample(range(10**6), team_size * 2)
+		]
+		matches.append(dict(winners=players[:team_size], losers=players[team_size:], draw=rnd.random() < 0.1))
+	return matches
+
+
+def main(count=5000):
+	matches = random_matches(count)
+	rows = []
+	for cls in (FlatRating, Glicko2Rating, TrueSkillRating, Quidditch6v6Rating):
+		system = cls(channel_id=1)
+		with redirect_stdout(io.StringIO()):  # Glicko2Rating.rate() prints the scores
+			sequential = measure(lambda: [system.rate(**m) for m in matches], repeat=5)
+		batched = measure(system.rate_many, matches, repeat=5)
+		rows.append((cls.__name__, int(count / sequential), int(count / batched), sequential / batched))
+	report(f"{count} matches of 5v5, matches per second", ('system', 'rate()', 'rate_many()', 'speedup'), rows)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of QueueChannel.rating_rank() when rendering a draft and a leaderboard: the former lookup that
+resolved and sorted the ranks table per call against the compiled bisect index.
+"""
+import random
+from types import SimpleNamespace
+
+import bot
+from benchmarks.common import measure, report
+from bot.queue_channel import QueueChannel
+
+RENDERS = (('draft of 12', 12), ('leaderboard page of 10', 10), ('leaderboard of 10000', 10000))
+
+
+def legacy_rating_rank(qc, rating):
+	""" The former rating_rank(), the ranks table was resolved and sorted on every call """
+	if rating is None:
+		return {'rank': '〈?〉', 'rating': 0, 'role': None}
+	if qc.cfg.rating_channel:
+		ranks = (bot.queue_channels.get(qc.cfg.rating_channel.id) or qc).cfg.ranks
+	else:
+		ranks = qc.cfg.ranks
+	if ranks and any(isinstance(r.get('rank'), str) and r['rank'].startswith(':') and r['rank'].endswith(':') for r in ranks):
+		ranks = qc.default_ranks
+	below = sorted((rank for rank in ranks if rank['rating'] <= rating), key=lambda r: r['rating'], reverse=True)
+	if not len(below):
+		return {'rank': '〈?〉', 'rating': 0, 'role': None}
+	return below[0]
+
+
+def queue_channel(channel_id, ranks, rating_channel=None):
+	qc = QueueChannel.__new__(QueueChannel)
+	qc.id = channel_id
+	qc.cfg = SimpleNamespace(ranks=ranks, rating_channel=rating_channel)
+	qc._rank_index = None
+	return qc
+
+
+def main():
+	rnd = random.Random(1)
+	ranks = [dict(rank=f"<:R{i}:{i}>", rating=i * 100, role=None) for i in range(25)]
+	host = queue_channel(1, ranks)
+	bot.queue_channels = {host.id: host}
+	channels = (
+		('own ranks', queue_channel(2, ranks)),
+		('rating channel ranks', queue_channel(3, [], rating_channel=SimpleNamespace(id=host.id)))
+	)
+	rows = []
+	for name, qc in channels:
+		for render, count in RENDERS:
+			ratings = [rnd.randint(0, 2800) for i in range(count)]
+			repeat = max(5, 10000 // count)
+			before = measure(lambda: [legacy_rating_rank(qc, r) for r in ratings], repeat=repeat)
+			after = measure(lambda: [qc.rating_rank(r) for r in ratings], repeat=repeat)
+			rows.append((name, render, before * 1000, after * 1000, before / after))
+	report(
+		f"rating_rank() over a {len(ranks)} ranks table, ms per render",
+		('ranks', 'render', 'sorted scan', 'bisect index', 'speedup'), rows
+	)
+
+
+if __name__ == '__main__':
+	main()
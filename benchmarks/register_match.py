@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Database round trips and latency of registering a ranked 6v6 match: the former per player autocommit
+statements against the batched register_match_ranked() transaction.
+"""
+import time
+import random
+import asyncio
+
+import bot
+from benchmarks.common import connect, report
+from core.database import get_db
+from core.utils import get_nick
+from bot.stats import stats
+from bot.stats.rating import FlatRating
+
+CHANNEL_SIZE = 10000
+MATCHES = 50
+
+
+class Player:
+
+	def __init__(self, user_id):
+		self.id = user_id
+		self.name = f"player{user_id}"
+		self.nick = None
+
+
+class Team(list):
+
+	def __init__(self, name, players):
+		super().__init__(players)
+		self.name = name
+
+
+class QueueChannel:
+
+	def __init__(self, channel_id):
+		self.id = channel_id
+		self.rating = FlatRating(channel_id=channel_id)
+
+	async def update_rating_roles(self, *players):
+		pass
+
+
+class Queue:
+
+	def __init__(self, name):
+		self.name = name
+		self.cfg = type('QueueConfig', (), dict(p_key=1))
+
+
+class Match:
+
+	def __init__(self, match_id, qc, players, winner):
+		self.id = match_id
+		self.qc = qc
+		self.queue = Queue('6v6')
+		self.players = players
+		self.teams = (Team('Alpha', players[:6]), Team('Beta', players[6:]))
+		self.captains = [players[0], players[6]]
+		self.winner = winner
+		self.scores = (1, 0) if winner == 0 else (0, 1) if winner == 1 else (0, 0)
+		self.maps = ['dm6']
+
+	async def print_rating_results(self, ctx, before, after):
+		pass
+
+
+async def register_legacy(m):
+	""" The statements the former register_match_ranked() issued, one autocommit query each """
+	db, now = get_db(), int(time.time())
+	await db.insert('qc_matches', dict(
+		match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
+		alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
+		at=now, ranked=1, winner=m.winner,
+		alpha_score=m.scores[0], beta_score=m.scores[1], maps="\n".join(m.maps)
+	))
+	for channel_id in {m.qc.id, m.qc.rating.channel_id}:
+		await db.insert_many('qc_players', (
+			dict(channel_id=channel_id, user_id=p.id, nick=get_nick(p)) for p in m.players
+		), on_dublicate="ignore")
+
+	m.qc.rating.store.clear()  # every lookup went to the database
+	before = [await m.qc.rating.get_players((p.id for p in team)) for team in m.teams]
+	m.qc.rating.store.clear()
+	ratings = [await m.qc.rating.get_players((p.id for p in team)) for team in m.teams]
+	after = m.qc.rating.rate(winners=ratings[0], losers=ratings[1], draw=m.winner is None)
+	before = {p['user_id']: p for p in (*before[0], *before[1])}
+	after = {p['user_id']: p for p in (*after[0], *after[1])}
+
+	for p in m.players:
+		data = after[p.id]
+		await db.update('qc_players', dict(
+			nick=get_nick(p), **{k: data[k] for k in stats.RATING_COLUMNS}, last_ranked_match_at=now
+		), keys=dict(channel_id=m.qc.rating.channel_id, user_id=p.id))
+		await db.insert('qc_player_matches', dict(
+			match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=get_nick(p),
+			team=0 if p in m.teams[0] else 1, is_captain=1 if p in m.captains else 0
+		))
+		await db.insert('qc_rating_history', dict(
+			channel_id=m.qc.rating.channel_id, user_id=p.id, at=now,
+			rating_before=before[p.id]['rating'], rating_change=data['rating'] - before[p.id]['rating'],
+			deviation_before=before[p.id]['deviation'], deviation_change=data['deviation'] - before[p.id]['deviation'],
+			match_id=m.id, reason=m.queue.name
+		))
+
+
+async def register_batched(m):
+	m.qc.rating.store.clear()  # a cold store, same as the legacy lookups
+	await stats.register_match_ranked(None, m)
+
+
+async def run(f, matches):
+	""" Return the queries per match and the median latency in ms """
+	query_stats = get_db().query_stats
+	query_stats.reset()
+	samples = []
+	for m in matches:
+		start = time.perf_counter()
+		await f(m)
+		samples.append(time.perf_counter() - start)
+	queries = sum((t['calls'] for t in query_stats.templates.values()))
+	return queries / len(matches), sorted(samples)[len(samples) // 2] * 1000
+
+
+async def main():
+	db = await connect()
+	rnd = random.Random(1)
+	qc = QueueChannel(1)
+	await db.insert_many('qc_players', (
+		dict(
+			channel_id=qc.id, user_id=user_id, nick=f"player{user_id}",
+			rating=rnd.randint(800, 2500), deviation=rnd.randint(60, 300)
+		) for user_id in range(CHANNEL_SIZE)
+	))
+
+	def matches(first_id):
+		return [
+			Match(match_id, qc, [Player(user_id) for user_id in rnd.sample(range(CHANNEL_SIZE), 12)], rnd.choice((0, 1, None)))
+			for match_id in range(first_id, first_id + MATCHES)
+		]
+
+	rows = [
+		('per player statements', *await run(register_legacy, matches(1))),
+		('register_match_ranked()', *await run(register_batched, matches(MATCHES + 1)))
+	]
+	report(
+		f"Registering {MATCHES} ranked 6v6 matches on a {CHANNEL_SIZE} player channel",
+		('', 'queries per match', 'median ms'), rows
+	)
+	await db.close()
+
+
+if __name__ == '__main__':
+	bot.sub_tracking = getattr(bot, 'sub_tracking', {})
+	asyncio.run(main())
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Per call cost of the SQL text builders of both adapters, memoized against rebuilt on every call,
+under a command storm replaying the query shapes of the bot in random order.
+"""
+import random
+
+from benchmarks.common import measure, report
+from core.DBAdapters import mysql, sqlite
+
+CALLS = 100000
+PLAYER_COLUMNS = ('user_id', 'nick', 'rating', 'deviation', 'wins', 'losses', 'draws', 'streak')
+
+# (builder, args) of the statements a burst of !add, !who, !lb, !rank and match commands issue
+SHAPES = (
+	('select', (PLAYER_COLUMNS, 'qc_players', ('channel_id', 'user_id'), None, False, None)),
+	('select', (PLAYER_COLUMNS, 'qc_players', ('channel_id', ), 'rating', False, 10)),
+	('select', (('user_id', 'rank', 'role'), 'qc_players', ('channel_id', ), None, False, None)),
+	('select', (('match_id', 'at', 'winner'), 'qc_matches', ('channel_id', ), 'match_id', False, 1)),
+	('select', (('channel_id', 'data'), 'qc_configs', ('channel_id', ), None, False, None)),
+	('select', (('user_id', 'reason', 'at'), 'noadds', ('channel_id', 'user_id'), 'at', True, None)),
+	('insert', (('match_id', 'channel_id', 'user_id', 'nick', 'team'), 'qc_player_matches', 'ignore')),
+	('insert', (('channel_id', 'user_id', 'nick'), 'qc_players', 'ignore', None, 12)),
+	('insert', (PLAYER_COLUMNS + ('channel_id', ), 'qc_players', 'update', ('rating', 'deviation'), 12)),
+	('update', ('qc_players', ('nick', 'rating', 'deviation'), ('channel_id', 'user_id'))),
+	('update', ('qc_configs', ('data', ), ('channel_id', ))),
+	('delete', ('noadds', ('channel_id', 'user_id'))),
+)
+
+
+def builders(queries, prefix):
+	return {op: getattr(queries, f"_{prefix}_{op}") for op in ('select', 'insert', 'update', 'delete')}
+
+
+def main():
+	rnd = random.Random(1)
+	storm = [rnd.choice(SHAPES) for i in range(CALLS)]
+	rows = []
+	for name, queries, prefix in (('mysql', mysql.Queries, 'mysql'), ('sqlite', sqlite.Queries, 'sqlite')):
+		cached = builders(queries, prefix)
+		rebuilt = {op: f.__wrapped__ for op, f in cached.items()}
+		calls = [(cached[op], rebuilt[op], args) for op, args in storm]
+		before = measure(lambda: [f(*args) for c, f, args in calls])
+		after = measure(lambda: [f(*args) for f, c, args in calls])
+		rows.append((name, before / CALLS * 10**6, after / CALLS * 10**6, before / after))
+	report(
+		f"SQL text of {CALLS} calls over {len(SHAPES)} query shapes, microseconds per call",
+		('adapter', 'rebuilt', 'memoized', 'speedup'), rows
+	)
+	print("\nCache (hits, misses, size):", sqlite.Queries.sql_cache_info())
+
+
+if __name__ == '__main__':
+	main()
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from .main import update_qc_lang, update_rating_system, save_state_async
+from .main import update_qc_lang, update_qc_lb, update_rating_system, update_qc_ranks, save_state_async
 from .main import load_state, enable_channel, disable_channel
 from .main import remove_players, expire_auto_ready, initialize_factories
 
@@ -11,6 +11,8 @@ from .match.match import Match
 from .expire import expire
 from .stats import stats
 from .stats.noadds import noadds
+from .stats.players import players
+from .stats.profiles import profiles
 from .scheduler import scheduler
 from .exceptions import Exceptions as Exc
 from .context import Context, SlashContext, SystemContext
@@ -329,8 +329,16 @@ async def season_end(ctx):
 	"""Archive current season ratings and reset for a new season."""
 	ctx.check_perms(ctx.Perms.ADMIN)
 
-	# Archive season data
-	summary = await bot.stats.archive_season(ctx.qc.rating.channel_id)
+	# Archive season data and reset ratings, W/L/D, and streak (but preserve history) at once
+	async with db.background.transaction() as tx:
+		summary = await bot.stats.archive_season(ctx.qc.rating.channel_id, tx=tx)
+		await ctx.qc.rating.reset(tx=tx)
+		await tx.update(
+			'qc_players',
+			dict(wins=0, losses=0, draws=0, streak=0),
+			keys=dict(channel_id=ctx.qc.rating.channel_id)
+		)
+		tx.on_commit(ctx.qc.rating.store.update_all, wins=0, losses=0, draws=0, streak=0)
 
 	# Build summary embed before reset
 	embed = Embed(
@@ -349,13 +357,5 @@ async def season_end(ctx):
 			podium.append(f"{medals[i]} **{nick}** — {rank} {p['rating']}  ({wl})")
 		embed.add_field(name="Top 12 (20+ games)", value="\n".join(podium), inline=False)
 
-	# Reset ratings, W/L/D, and streak (but preserve history)
-	await ctx.qc.rating.reset()
-	await db.update(
-		'qc_players',
-		dict(wins=0, losses=0, draws=0, streak=0),
-		keys=dict(channel_id=ctx.qc.rating.channel_id)
-	)
-
 	embed.set_footer(text="Ratings and stats have been reset. A new season begins now!")
 	await ctx.reply(embed=embed)
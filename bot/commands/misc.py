@@ -5,7 +5,7 @@ from datetime import timedelta
 from random import randint
 
 from core.utils import seconds_to_str, find
-from core.database import db
+from core.database import db, writer as db_writer
 from core.config import cfg
 
 import bot
@@ -53,7 +53,7 @@ async def default_expire(ctx, duration: timedelta = None, afk: bool = None, clea
 			return ctx.qc.gt("Your default expire time is {time}.".format(time=seconds_to_str(seconds)))
 
 	if duration is None and afk is None and clear is None:
-		data = await db.select_one(['expire'], 'players', where={'user_id': ctx.author.id})
+		data = await bot.players.get(ctx.author.id)
 		seconds = None if not data else data['expire']
 		await ctx.reply(_expire_to_reply(seconds))
 		return
@@ -68,10 +68,7 @@ async def default_expire(ctx, duration: timedelta = None, afk: bool = None, clea
 	if afk:
 		seconds = 0
 
-	try:
-		await db.insert('players', {'user_id': ctx.author.id, 'expire': seconds})
-	except db.errors.IntegrityError:
-		await db.update('players', {'expire': seconds}, keys={'user_id': ctx.author.id})
+	db_writer.upsert('players', {'expire': seconds}, keys={'user_id': ctx.author.id})
 	await ctx.success(_expire_to_reply(seconds))
 
 
@@ -85,13 +82,9 @@ async def allow_offline(ctx):
 
 
 async def switch_dms(ctx):
-	data = await db.select_one(('allow_dm',), 'players', where={'user_id': ctx.author.id})
-	if data:
-		allow_dm = 1 if data['allow_dm'] == 0 else 0
-		await db.update('players', {'allow_dm': allow_dm}, keys={'user_id': ctx.author.id})
-	else:
-		allow_dm = 0
-		await db.insert('players', {'allow_dm': allow_dm, 'user_id': ctx.author.id})
+	data = await bot.players.get(ctx.author.id)
+	allow_dm = 1 if data and data['allow_dm'] == 0 else 0
+	db_writer.upsert('players', {'allow_dm': allow_dm}, keys={'user_id': ctx.author.id})
 
 	if allow_dm:
 		await ctx.success(ctx.qc.gt("Your DM notifications is now turned on."))
@@ -98,22 +98,13 @@ async def rank(ctx, player: Member = None):
 		raise bot.Exc.SyntaxError(ctx.qc.gt("Specified user not found."))
 
 	# Get player's direct data
-	p = await db.select_one(
-		['user_id', 'rating', 'deviation', 'channel_id', 'wins', 'losses', 'draws', 'is_hidden', 'streak'],
-		'qc_players',
-		where={'channel_id': ctx.qc.rating.channel_id, 'user_id': target.id}
-	)
+	p = (await ctx.qc.rating.store.get((target.id, ))).get(target.id)
 	
 	if p:
 		# Calculate rank placement only if player is not hidden
 		place = "?"
 		if p['rating'] is not None and not p['is_hidden']:
-			ranked_players = await db.select(
-				['rating'],
-				'qc_players',
-				where={'channel_id': ctx.qc.rating.channel_id, 'is_hidden': 0}
-			)
-			place = sum(1 for x in ranked_players if x['rating'] is not None and x['rating'] > p['rating']) + 1
+			place = await ctx.qc.rating.store.index.place(p['rating'])
 		
 		embed = Embed(title=f"__{get_nick(target)}__", colour=Colour(0x7289DA))
 		embed.add_field(name="№", value=f"**{place}**", inline=True)
@@ -136,13 +127,8 @@ async def rank(ctx, player: Member = None):
 			embed.set_thumbnail(url=target.display_avatar.url)
 
 		# Rating graph (last 20 rating changes as a sparkline)
-		history = await db.select(
-			('rating_before', 'rating_change'),
-			'qc_rating_history',
-			where=dict(user_id=target.id, channel_id=ctx.qc.rating.channel_id),
-			order_by='id', limit=20
-		)
-		history = list(reversed(history))
+		changes = await bot.profiles.rating_history(ctx.qc.rating.channel_id, target.id)
+		history = list(reversed(changes))
 		if len(history) >= 2:
 			ratings = [h['rating_before'] for h in history]
 			ratings.append(history[-1]['rating_before'] + history[-1]['rating_change'])
@@ -155,11 +141,7 @@ async def rank(ctx, player: Member = None):
 
 
 		# Last changes
-		changes = await db.select(
-			('at', 'rating_change', 'match_id', 'reason'),
-			'qc_rating_history', where=dict(user_id=target.id, channel_id=ctx.qc.rating.channel_id),
-			order_by='id', limit=5
-		)
+		changes = changes[:5]
 		if len(changes):
 			embed.add_field(
 				name=ctx.qc.gt("Last changes:"),
@@ -190,89 +172,49 @@ def _rating_sparkline(ratings):
 	return " ".join(BARS[s] for s in scaled)
 
 
-async def leaderboard(ctx, page: int = 1):
-	page = (page or 1) - 1
+LB_PAGE_SIZE = 12
 
-	data = await ctx.qc.get_lb()
-	pages = ceil(len(await ctx.qc.get_lb())/12)
-	data = data[page * 12:(page + 1) * 12]
-	if not len(data):
-		raise bot.Exc.NotFoundError(ctx.qc.gt("Leaderboard is empty."))
 
-	if ctx.qc.cfg.emoji_ranks:  # display as embed message
-		embed = Embed(title=f"Leaderboard - page {page+1} of {pages}", colour=Colour(0x7289DA))
-		# Format with uniform monospace columns
-		table_lines = []
-		for n in range(len(data)):
-			row = data[n]
-			num = str((page*12)+n+1).rjust(2)
-			# Strip emojis from nickname - keep only ASCII + basic punctuation
-			nick_clean = re.sub(r'[^\x00-\x7F()\[\]-]', '', row['nick'].strip())[:20].ljust(20)
-			wl = f"{row['wins']}-{row['losses']}".rjust(5)
-			total_games = row['wins'] + row['losses']
-			wr = f"({round(row['wins'] / total_games * 100)}%)".rjust(6) if total_games > 0 else "  (0%)"
-			rating = str(row['rating']).rjust(4)
-			rank = ctx.qc.rating_rank(row['rating'])['rank']
-			table_lines.append(f"`{num} {nick_clean} {wl} {wr}`  {rank} {rating}")
-		
-		# Add header for left columns only
-		table_lines.insert(0, f"`{'No':>2} {'Nickname':<20} {'W-L':>5} {'WR':>6}`")
-		
-		embed.add_field(
-			name="—",
-			value="\n".join(table_lines),
-			inline=False
-		)
-		await ctx.reply(embed=embed)
-		return
+def _lb_embed_line(qc):
+	""" Leaderboard row renderer for the embed display """
+	def render(position, row):
+		num = str(position + 1).rjust(2)
+		# Strip emojis from nickname - keep only ASCII + basic punctuation
+		nick_clean = re.sub(r'[^\x00-\x7F()\[\]-]', '', row['nick'].strip())[:20].ljust(20)
+		wl = f"{row['wins']}-{row['losses']}".rjust(5)
+		total_games = row['wins'] + row['losses']
+		wr = f"({round(row['wins'] / total_games * 100)}%)".rjust(6) if total_games > 0 else "  (0%)"
+		rating = str(row['rating']).rjust(4)
+		rank = qc.rating_rank(row['rating'])['rank']
+		return f"`{num} {nick_clean} {wl} {wr}`  {rank} {rating}"
+	return render
 
-	# display as md table
-	await ctx.reply(
-		discord_table(
-			["№", "Nickname", "W-L", "WR", "Rating"],
-			[[
-				(page * 12) + (n + 1),
-				data[n]['nick'].strip()[:15],
-				"{0}-{1}".format(
-					data[n]['wins'],
-					data[n]['losses']
-				),
-				"({0}%)".format(round(data[n]['wins'] / max(1, data[n]['wins'] + data[n]['losses']) * 100)),
-				str(data[n]['rating']) + ctx.qc.rating_rank(data[n]['rating'])['rank']
-			] for n in range(len(data))]
-		)
-	)
 
+def _lb_table_row(qc):
+	""" Leaderboard row renderer for the md table display """
+	def render(position, row):
+		return [
+			position + 1,
+			row['nick'].strip()[:15],
+			"{0}-{1}".format(row['wins'], row['losses']),
+			"({0}%)".format(round(row['wins'] / max(1, row['wins'] + row['losses']) * 100)),
+			str(row['rating']) + qc.rating_rank(row['rating'])['rank']
+		]
+	return render
 
-async def season_leaderboard(ctx, page: int = 1):
-	"""Show top 12 players with minimum 20 games played"""
-	page = (page or 1) - 1
 
-	data = await ctx.qc.get_season_lb()
-	pages = ceil(len(await ctx.qc.get_season_lb())/12)
-	data = data[page * 12:(page + 1) * 12]
-	if not len(data):
-		raise bot.Exc.NotFoundError(ctx.qc.gt("Leaderboard is empty."))
+async def _reply_lb(ctx, view, page, title):
+	page = (page or 1) - 1
+	pages = view.pages(LB_PAGE_SIZE)
 
 	if ctx.qc.cfg.emoji_ranks:  # display as embed message
-		embed = Embed(title=f"Season Leaderboard (20+ games) - page {page+1} of {pages}", colour=Colour(0x7289DA))
-		# Format with uniform monospace columns
-		table_lines = []
-		for n in range(len(data)):
-			row = data[n]
-			num = str((page*12)+n+1).rjust(2)
-			# Strip emojis from nickname - keep only ASCII + basic punctuation
-			nick_clean = re.sub(r'[^\x00-\x7F()\[\]-]', '', row['nick'].strip())[:20].ljust(20)
-			wl = f"{row['wins']}-{row['losses']}".rjust(5)
-			total_games = row['wins'] + row['losses']
-			wr = f"({round(row['wins'] / total_games * 100)}%)".rjust(6) if total_games > 0 else "  (0%)"
-			rating = str(row['rating']).rjust(4)
-			rank = ctx.qc.rating_rank(row['rating'])['rank']
-			table_lines.append(f"`{num} {nick_clean} {wl} {wr}`  {rank} {rating}")
-		
-		# Add header for left columns only
-		table_lines.insert(0, f"`{'No':>2} {'Nickname':<20} {'W-L':>5} {'WR':>6}`")
-		
+		data = view.page(page, LB_PAGE_SIZE, _lb_embed_line(ctx.qc), style='embed')
+		if not len(data):
+			raise bot.Exc.NotFoundError(ctx.qc.gt("Leaderboard is empty."))
+		embed = Embed(title=f"{title} - page {page+1} of {pages}", colour=Colour(0x7289DA))
+		# Format with uniform monospace columns, add header for left columns only
+		table_lines = [f"`{'No':>2} {'Nickname':<20} {'W-L':>5} {'WR':>6}`"]
+		table_lines += [line for position, row, line in data]
 		embed.add_field(
 			name="—",
 			value="\n".join(table_lines),
@@ -282,23 +224,26 @@ async def season_leaderboard(ctx, page: int = 1):
 		return
 
 	# display as md table
+	data = view.page(page, LB_PAGE_SIZE, _lb_table_row(ctx.qc), style='table')
+	if not len(data):
+		raise bot.Exc.NotFoundError(ctx.qc.gt("Leaderboard is empty."))
 	await ctx.reply(
 		discord_table(
 			["№", "Nickname", "W-L", "WR", "Rating"],
-			[[
-				(page * 12) + (n + 1),
-				data[n]['nick'].strip()[:15],
-				"{0}-{1}".format(
-					data[n]['wins'],
-					data[n]['losses']
-				),
-				"({0}%)".format(round(data[n]['wins'] / max(1, data[n]['wins'] + data[n]['losses']) * 100)),
-				str(data[n]['rating']) + ctx.qc.rating_rank(data[n]['rating'])['rank']
-			] for n in range(len(data))]
+			[line for position, row, line in data]
 		)
 	)
 
 
+async def leaderboard(ctx, page: int = 1):
+	await _reply_lb(ctx, await ctx.qc.lb_view(), page, "Leaderboard")
+
+
+async def season_leaderboard(ctx, page: int = 1):
+	"""Show top 12 players with minimum 20 games played"""
+	await _reply_lb(ctx, await ctx.qc.lb_view(season=True), page, "Season Leaderboard (20+ games)")
+
+
 ROLE_NAMES = {
 	'chaser': 'Chaser',
 	'seeker': 'Seeker',
@@ -327,8 +272,8 @@ async def leaderboard_by_role(ctx, role_name: str, page: int = 1):
 		if role_key in member_roles:
 			filtered.append(row)
 
-	pages = max(1, ceil(len(filtered) / 12))
-	page_data = filtered[page * 12:(page + 1) * 12]
+	pages = max(1, ceil(len(filtered) / LB_PAGE_SIZE))
+	page_data = filtered[page * LB_PAGE_SIZE:(page + 1) * LB_PAGE_SIZE]
 	if not page_data:
 		raise bot.Exc.NotFoundError(ctx.qc.gt("Leaderboard is empty."))
 
@@ -336,16 +281,8 @@ async def leaderboard_by_role(ctx, role_name: str, page: int = 1):
 		title=f"{display_name} Leaderboard - page {page+1} of {pages}",
 		colour=Colour(0x7289DA)
 	)
-	table_lines = []
-	for n, row in enumerate(page_data):
-		num = str((page * 12) + n + 1).rjust(2)
-		nick_clean = re.sub(r'[^\x00-\x7F()\[\]-]', '', row['nick'].strip())[:20].ljust(20)
-		wl = f"{row['wins']}-{row['losses']}".rjust(5)
-		total_games = row['wins'] + row['losses']
-		wr = f"({round(row['wins'] / total_games * 100)}%)".rjust(6) if total_games > 0 else "  (0%)"
-		rating = str(row['rating']).rjust(4)
-		rank = ctx.qc.rating_rank(row['rating'])['rank']
-		table_lines.append(f"`{num} {nick_clean} {wl} {wr}`  {rank} {rating}")
+	render = _lb_embed_line(ctx.qc)
+	table_lines = [render(page * LB_PAGE_SIZE + n, row) for n, row in enumerate(page_data)]
 
 	table_lines.insert(0, f"`{'No':>2} {'Nickname':<20} {'W-L':>5} {'WR':>6}`")
 	embed.add_field(name="—", value="\n".join(table_lines), inline=False)
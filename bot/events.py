@@ -1,9 +1,13 @@
 import traceback
+import datetime
 from nextcord import ChannelType, Activity, ActivityType, Embed, Color
 
 from core.client import dc
 from core.console import log
 from core.config import cfg
+from core.database import db, cache as db_cache, writer as db_writer, journal as db_journal, reads as db_reads
+from core.utils import split_big_text
+from bot.stats.rating_store import stores as rating_stores
 import bot
 
 
@@ -31,6 +35,16 @@ async def on_think(frame_time):
 	await bot.stats.jobs.think(frame_time)
 	await bot.expire_auto_ready(frame_time)
 	await bot.scheduler.think(frame_time)
+	await db_writer.think(frame_time)
+	await db_journal.think(frame_time)
+	await db_reads.think(frame_time)
+
+
+@dc.event
+async def on_exit():
+	await db_writer.flush()
+	db_journal.close()
+	await db_reads.close()
 
 
 async def handle_owner_dm(message):
@@ -148,6 +162,86 @@ async def _handle_owner_dm(message):
 		except Exception as e:
 			await message.channel.send(f"Error reading channel: {e}")
 
+	elif cmd == "!ratingstore":
+		# !ratingstore [channel_id] — show rating store counters or diff a store against the database
+		parts = text.split()
+		if len(parts) < 2:
+			lines = [
+				f"`{s.channel_id}` — {len(s.rows)} rows, {s.hits} hits, {s.misses} misses, "
+				f"{s.loader.batches} fetches ({s.loader.saved} saved by batching), "
+				f"index {'loaded' if s.index.loaded else 'not loaded'} ({s.index.loads} loads, {s.index.rebuilds} rebuilds), "
+				f"leaderboard {'not loaded' if s.leaderboard.age is None else f'{s.leaderboard.age}s old'} "
+				f"({s.leaderboard.loads} loads, {s.leaderboard.updates} updates)"
+				for s in rating_stores.values()
+			]
+			await message.channel.send("\n".join(lines) or "Rating stores are empty.")
+			return
+		try:
+			store = rating_stores.get(parse_id(parts[1]))
+		except ValueError:
+			await message.channel.send("Invalid channel ID.")
+			return
+		if not store:
+			await message.channel.send("Rating store not found.")
+			return
+		diff = await store.check()
+		if not len(diff):
+			await message.channel.send(f"Rating store `{store.channel_id}` is consistent ({len(store.rows)} rows).")
+			return
+		lines = [f"Rating store `{store.channel_id}` has {len(diff)} mismatching rows:"]
+		lines += [f"`{user_id}` cached: {cached} | stored: {stored}" for user_id, cached, stored in diff]
+		for chunk in split_big_text("\n".join(lines), delimiter="\n"):
+			await message.channel.send(chunk)
+
+	elif cmd == "!dbstats":
+		# !dbstats [count|dump|reset] — show the slowest query templates, dump them to a file or reset the counters
+		parts = text.split()
+		arg = parts[1].lower() if len(parts) > 1 else "10"
+		if arg == "dump":
+			path = db.query_stats.dump(datetime.datetime.now().strftime("logs/db_stats_%Y-%m-%d-%H:%M:%S.json"))
+			await message.channel.send(f"Query stats are saved to `{path}`.")
+			return
+		elif arg == "reset":
+			db.query_stats.reset()
+			await message.channel.send("Query stats are reset.")
+			return
+		elif not arg.isdigit():
+			await message.channel.send("Usage: `!dbstats [count|dump|reset]`")
+			return
+		summary = db.query_stats.summary(limit=int(arg))
+		if not len(summary):
+			await message.channel.send("No queries recorded yet.")
+			return
+		lines = [f"**Top {len(summary)} query templates by total time:**"]
+		lines += [
+			"Pool: " + ", ".join((f"{k} `{round(v, 1) if isinstance(v, float) else v}`" for k, v in info.items()))
+			for info in (db.pool_info(), db.background.pool_info(), *([db_reads.replica.pool_info()] if db_reads.connected else []))
+		]
+		lines.append("Read replica: " + ", ".join((f"{k} `{v}`" for k, v in db_reads.summary().items())))
+		lines.append("Select cache: " + ", ".join((
+			f"{k} `{round(v, 3) if isinstance(v, float) else v}`" for k, v in db_cache.summary().items()
+		)))
+		lines.append("Write-behind: " + ", ".join((
+			f"{k} `{round(v, 1) if isinstance(v, float) else v}`" for k, v in db_writer.summary().items()
+		)))
+		lines.append("Journal: " + ", ".join((f"{k} `{v}`" for k, v in db_journal.summary().items())))
+		lines.append(
+			f"Players loader: `{bot.players.loader.requests}` keys in `{bot.players.loader.batches}` queries"
+		)
+		lines.append("Profiles: " + ", ".join((
+			f"{k} `{round(v, 3) if isinstance(v, float) else v}`" for k, v in bot.profiles.summary().items()
+		)))
+		lines.append("SQL text cache (hits/misses/size): " + ", ".join((
+			f"{name} `{hits}/{misses}/{size}`" for name, (hits, misses, size) in db.sql_cache_info().items()
+		)))
+		lines += [
+			"`{calls}x` total `{total:.0f}ms` p50/p95/p99 `{p50:.1f}/{p95:.1f}/{p99:.1f}ms` rows `{rows}`{errors}\n`` {sql} ``".format(
+				**q, sql=q['template'][:300], errors=f" errors `{q['errors']}`" if q['errors'] else ""
+			) for q in summary
+		]
+		for chunk in split_big_text("\n".join(lines), delimiter="\n"):
+			await message.channel.send(chunk)
+
 	elif cmd == "!ownerhelp":
 		await message.channel.send(
 			"**Owner DM Commands:**\n"
@@ -156,6 +250,8 @@ async def _handle_owner_dm(message):
 			"`!reply <channel_id> <message_id> <message>` — reply to a message\n"
 			"`!dm <user_id> <message>` — DM a user\n"
 			"`!recent <channel_id> [count]` — show recent messages (max 20)\n"
+			"`!ratingstore [channel_id]` — show rating store counters or check a store against the database\n"
+			"`!dbstats [count|dump|reset]` — show the slowest query templates, dump them to a file or reset them\n"
 			"`!ownerhelp` — show this help"
 		)
 	else:
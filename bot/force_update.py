@@ -1,11 +1,16 @@
 import asyncio
 import bot
+from core.client import dc
+from core.database import db
 
 async def force_update_all_rating_roles():
     for qc in bot.queue_channels.values():
-        members = await qc.rating.get_players()
-        guild = qc.guild
-        member_objs = [guild.get_member(p['user_id']) for p in members if guild.get_member(p['user_id'])]
-        if member_objs:
-            await qc.update_rating_roles(*member_objs)
+        if (guild := dc.get_guild(qc.guild_id)) is None:
+            continue
+        async for members in db.background.stream_batches(
+            "SELECT `user_id` FROM `qc_players` WHERE `channel_id`=%s", (qc.rating.channel_id, )
+        ):
+            member_objs = [m for m in (guild.get_member(p['user_id']) for p in members) if m]
+            if member_objs:
+                await qc.update_rating_roles(*member_objs)
         await asyncio.sleep(1)
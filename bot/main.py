@@ -4,7 +4,7 @@ import json
 from nextcord import Interaction
 
 from core.console import log
-from core.database import db
+from core.database import db, journal as db_journal
 from core.config import cfg
 from core.utils import error_embed, ok_embed, get
 
@@ -38,6 +38,7 @@ async def disable_channel(message):
 			await queue.cfg.delete()
 		await qc.cfg.delete()
 		bot.queue_channels.pop(message.channel.id)
+		update_qc_ranks(qc.cfg)  # channels rating on this one fall back to their own ranks
 		await message.channel.send(embed=ok_embed("The bot has been disabled."))
 	else:
 		await message.channel.send(embed=error_embed("The bot is not enabled on this channel."))
@@ -47,12 +48,23 @@ def update_qc_lang(qc_cfg):
 	bot.queue_channels[qc_cfg.p_key].update_lang()
 
 
+def update_qc_lb(qc_cfg):
+	bot.queue_channels[qc_cfg.p_key].update_lb()
+
+
 def update_rating_system(qc_cfg):
 	bot.queue_channels[qc_cfg.p_key].update_rating_system()
 
 
-async def save_state_async():
-	"""Async version of save_state that properly awaits database operations"""
+def update_qc_ranks(qc_cfg):
+	""" Recompile rank lookups of the channel and of the channels using it as their rating host """
+	for qc in bot.queue_channels.values():
+		if qc.id == qc_cfg.p_key or (qc.cfg.rating_channel and qc.cfg.rating_channel.id == qc_cfg.p_key):
+			qc.update_ranks()
+
+
+async def save_state_async(conn=db):
+	"""Async version of save_state that properly awaits database operations, conn may be db.background"""
 	log.info("Saving state to database (async)...")
 	queues = []
 	for qc in bot.queue_channels.values():
@@ -66,10 +78,10 @@ async def save_state_async():
 
 	try:
 		# Clear old state
-		await db.delete('bot_state', where={'id': 'queue_state'})
+		await conn.delete('bot_state', where={'id': 'queue_state'})
 		
 		# Save new state
-		await db.insert('bot_state', dict(
+		await conn.insert('bot_state', dict(
 			id='queue_state',
 			data=json.dumps(dict(
 				queues=queues, 
@@ -192,15 +204,16 @@ async def initialize_factories():
 		""")
 		log.info("  ✓ Bot state table ready")
 		
-		# Initialize stats tables
-		log.info("  Initializing stats tables...")
-		await bot.stats.ensure_tables()
-		log.info("  ✓ Stats tables initialized")
-		
-		# Initialize noadds tables
-		log.info("  Initializing noadds tables...")
-		await bot.noadds.ensure_tables()
-		log.info("  ✓ Noadds tables initialized")
+		# Reconcile stats, noadds and factory tables in a single pass
+		log.info("  Reconciling database schema...")
+		bot.stats.register_tables()
+		bot.noadds.register_tables()
+		db_journal.register_table()
+		bot.QueueChannel.cfg_factory.table.register()
+		bot.PickupQueue.cfg_factory.table.register()
+		changed = await db.reconcile_tables()
+		await bot.stats.migrate_tables(changed)
+		log.info("  ✓ Database schema reconciled")
 		
 		# Initialize QueueChannel factory
 		log.info("  Initializing QueueChannel factory...")
@@ -163,7 +163,8 @@ class Match:
 
 		# Create the Match object
 		ratings = {p['user_id']: p['rating'] for p in await qc.rating.get_players((p.id for p in data['players']))}
-		match_id = await bot.stats.next_match()
+		# keep the id of the restored match
+		match_id = data['match_id'] if data.get('match_id') is not None else await bot.stats.next_match()
 		match = cls(match_id, queue, qc, data['players'], ratings, **data['cfg'])
 
 		# Set state data
@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from time import time
+from bisect import bisect_right
 import re
 import asyncio
 from enum import Enum
@@ -8,10 +8,10 @@ from nextcord import Forbidden
 from core.cfg_factory import FactoryTable, CfgFactory, Variables, VariableTable
 from core.locales import locales
 from core.utils import join_and, seconds_to_str, get_nick
-from core.database import db
 
 import bot
 from bot.stats.rating import FlatRating, Glicko2Rating, TrueSkillRating, Quidditch6v6Rating
+from bot.stats.leaderboard import LeaderboardView
 
 MAX_EXPIRE_TIME = 12*60*60
 MAX_PROMOTION_DELAY = 12*60*60
@@ -265,12 +265,14 @@ class QueueChannel:
 				"lb_min_matches",
 				display="Leaderboard min matches",
 				section="Leaderboard",
+				on_change=bot.update_qc_lb,
 				description="Set a minimum amount of played matches required for a player to be shown in the !leaderboard."
 			),
 			Variables.DurationVar(
 				"lb_last_match_limit",
 				display="Leaderboard last match limit",
 				section="Leaderboard",
+				on_change=bot.update_qc_lb,
 				description="Hide players from the leaderboard that hasn't played a single match for specified duration.",
 				default=None,
 				verify=lambda d: 0 < d <= 311040000,  # 10 years max
@@ -293,7 +295,7 @@ class QueueChannel:
 				default=True
 			),
 			VariableTable(
-				'ranks', display="Rating ranks", section="Leaderboard",
+				'ranks', display="Rating ranks", section="Leaderboard", on_change=bot.update_qc_ranks,
 				variables=[
 					Variables.StrVar("rank", default="〈E〉"),
 					Variables.IntVar("rating", default=1200, description="The rank will be given on this rating or higher."),
@@ -347,6 +349,8 @@ class QueueChannel:
 		)
 		self.queues = []
 		self.last_promote = 0
+		self._rank_index = None  # (sorted thresholds, ranks in the same order, ranks table), see _compile_ranks()
+		self._lb_views = dict()  # {season: LeaderboardView}, see lb_view()
 
 	async def update_info(self, text_channel):
 		self.cfg.cfg_info['channel_name'] = text_channel.name
@@ -358,7 +362,17 @@ class QueueChannel:
 	def update_lang(self):
 		self.gt = locales[self.cfg.lang]
 
+	def update_ranks(self):
+		""" Recompile the rank lookup on next use """
+		self._rank_index = None
+		self.update_lb()  # rendered leaderboard rows show the ranks
+
+	def update_lb(self):
+		""" Rebuild the leaderboard views on next use """
+		self._lb_views = dict()
+
 	def update_rating_system(self):
+		self.update_ranks()
 		self.rating = self.rating_names[self.cfg.rating_system](
 			channel_id=(self.cfg.rating_channel or self).id,
 			init_rp=self.cfg.rating_initial,
@@ -376,32 +390,42 @@ class QueueChannel:
 		if self.id == self.rating.channel_id and (self.cfg.rating_decay or self.cfg.rating_deviation_decay):
 			await self.rating.apply_decay(self.cfg.rating_decay or 0, self.cfg.rating_deviation_decay or 0, self._ranks_table)
 
-	@property
-	def _ranks_table(self):
-		# Hardcoded defaults to use if database ranks are corrupted
-		default_ranks = [
-			dict(rank="<:CHAD:1471923932558000270>", rating=0, role=None),
-			dict(rank="<:WOOD:1471609879142600748>", rating=800, role=None),
-			dict(rank="<:IRON:1471610220269666435>", rating=1000, role=None),
-			dict(rank="<:BRNZ:1471610239299223644>", rating=1200, role=None),
-			dict(rank="<:SILV:1471610253559988429>", rating=1400, role=None),
-			dict(rank="<:GOLD:1471610519696707585>", rating=1600, role=None),
-			dict(rank="<:DIAM:1471610536604209272>", rating=1800, role=None),
-			dict(rank="<:CHMP:1471610553897324595>", rating=2000, role=None),
-			dict(rank="<:STAR:1471610576697426194>", rating=2200, role=None)
-		]
-		
+	# Hardcoded defaults to use if database ranks are corrupted
+	default_ranks = [
+		dict(rank="<:CHAD:1471923932558000270>", rating=0, role=None),
+		dict(rank="<:WOOD:1471609879142600748>", rating=800, role=None),
+		dict(rank="<:IRON:1471610220269666435>", rating=1000, role=None),
+		dict(rank="<:BRNZ:1471610239299223644>", rating=1200, role=None),
+		dict(rank="<:SILV:1471610253559988429>", rating=1400, role=None),
+		dict(rank="<:GOLD:1471610519696707585>", rating=1600, role=None),
+		dict(rank="<:DIAM:1471610536604209272>", rating=1800, role=None),
+		dict(rank="<:CHMP:1471610553897324595>", rating=2000, role=None),
+		dict(rank="<:STAR:1471610576697426194>", rating=2200, role=None)
+	]
+
+	def _compile_ranks(self):
+		""" Resolve the ranks table and sort it by rating for bisect, cached until ranks or rating_channel change """
+		if self._rank_index is not None:
+			return self._rank_index
+
 		# Get ranks from config or rating channel config
-		if self.cfg.rating_channel:
-			ranks = (bot.queue_channels.get(self.cfg.rating_channel.id) or self).cfg.ranks
-		else:
-			ranks = self.cfg.ranks
-		
+		host = bot.queue_channels.get(self.cfg.rating_channel.id) if self.cfg.rating_channel else self
+		ranks = (host or self).cfg.ranks
+
 		# Check if any ranks are corrupted (e.g., ":SILV:" instead of "<:SILV:ID>")
 		if ranks and any(isinstance(r.get('rank'), str) and r['rank'].startswith(':') and r['rank'].endswith(':') for r in ranks):
-			return default_ranks
-		
-		return ranks
+			ranks = self.default_ranks
+
+		# on equal ratings the first rank of the table wins, put it last for bisect_right
+		ordered = [r for i, r in sorted(enumerate(ranks), key=lambda x: (x[1]['rating'], -x[0]))]
+		index = ([r['rating'] for r in ordered], ordered, ranks)
+		if host is not None:  # the rating channel may be not loaded yet
+			self._rank_index = index
+		return index
+
+	@property
+	def _ranks_table(self):
+		return self._compile_ranks()[2]
 
 	async def new_queue(self, ctx, name, size, kind):
 		kind.validate_name(name)
@@ -483,52 +507,38 @@ class QueueChannel:
 	def rating_rank(self, rating):
 		if rating is None:
 			return {'rank': '〈?〉', 'rating': 0, 'role': None}
-		table = self._ranks_table
-		below = sorted(
-			(rank for rank in table if rank['rating'] <= rating),
-			key=lambda r: r['rating'], reverse=True
-		)
-		if not len(below):
+		thresholds, ordered, _ = self._compile_ranks()
+		if not (i := bisect_right(thresholds, rating)):
 			return {'rank': '〈?〉', 'rating': 0, 'role': None}
-		return below[0]
+		return ordered[i - 1]
+
+	async def lb_view(self, season=False):
+		""" Leaderboard of the channel filtered by its settings, season leaderboard has a fixed 20 games minimum """
+		rows, version = await self.rating.store.leaderboard.get()
+		view = self._lb_views.get(season)
+		if view is None or not view.valid(version):
+			view = LeaderboardView(
+				rows, version,
+				min_matches=20 if season else self.cfg.lb_min_matches,
+				last_match_limit=self.cfg.lb_last_match_limit
+			)
+			if version is not None:
+				self._lb_views[season] = view
+		return view
 
 	async def get_lb(self):
-		now = int(time())
-		data = await db.select(
-			['user_id', 'nick', 'rating', 'deviation', 'wins', 'losses', 'draws', 'streak', 'is_hidden', 'last_ranked_match_at'],
-			'qc_players',
-			where={'channel_id': self.rating.channel_id}, order_by="rating"
-		)
-		return [
-			i for i in data
-			if i['rating'] is not None
-			and not i['is_hidden']
-			and (not self.cfg.lb_last_match_limit or ((i['last_ranked_match_at'] or 0) + self.cfg.lb_last_match_limit > now))
-			and not (self.cfg.lb_min_matches and self.cfg.lb_min_matches > sum((i['wins'], i['losses'], i['draws'])))
-		]
+		return (await self.lb_view()).rows
 
 	async def get_season_lb(self):
 		"""Get leaderboard with strict 20 games minimum requirement"""
-		now = int(time())
-		data = await db.select(
-			['user_id', 'nick', 'rating', 'deviation', 'wins', 'losses', 'draws', 'streak', 'is_hidden', 'last_ranked_match_at'],
-			'qc_players',
-			where={'channel_id': self.rating.channel_id}, order_by="rating"
-		)
-		return [
-			i for i in data
-			if i['rating'] is not None
-			and not i['is_hidden']
-			and sum((i['wins'], i['losses'], i['draws'])) >= 20  # Fixed 20 game minimum
-			and (not self.cfg.lb_last_match_limit or ((i['last_ranked_match_at'] or 0) + self.cfg.lb_last_match_limit > now))
-		]
+		return (await self.lb_view(season=True)).rows
 
 	async def update_rating_roles(self, *members):
 		asyncio.create_task(self._update_rating_roles(*members))
 
 	async def update_expire(self, member):
 		""" update expire timer on !add command """
-		personal_expire = await db.select_one(['expire'], 'players', where={'user_id': member.id})
+		personal_expire = await bot.players.get(member.id)
 		personal_expire = personal_expire.get('expire') if personal_expire else None
 		if personal_expire not in [0, None]:
 			bot.expire.set(self, member, personal_expire)
@@ -578,8 +588,9 @@ class QueueChannel:
 		await bot.remove_players(*members, reason="pickup started", calling_priority=calling_priority)
 
 	async def _dm_members(self, members, *args, **kwargs):
+		prefs = await bot.players.get_many((m.id for m in members))
 		for m in members:
-			if not m.bot and not await db.select_one(("user_id", ), "players", where={'user_id': m.id, 'allow_dm': 0}):
+			if not m.bot and (prefs[m.id] or {}).get('allow_dm') != 0:
 				try:
 					await m.send(*args, **kwargs)
 				except Forbidden:
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 
 from core.console import log
 from core.cfg_factory import FactoryTable, CfgFactory, Variables, VariableTable
@@ -544,12 +545,10 @@ class PickupQueue:
 				await self.start(ctx)
 				self.queue = list(old_players)
 			else:
-				for p in ready:
-					await self.qc.update_expire(p)
+				await asyncio.gather(*(self.qc.update_expire(p) for p in ready))
 		else:
 			self.queue = list(ready) + old_players
-			for p in ready:
-				await self.qc.update_expire(p)
+			await asyncio.gather(*(self.qc.update_expire(p) for p in ready))
 
 		await ctx.notice(self.qc.topic)
 		if self not in bot.active_queues and self.length:
@@ -5,6 +5,7 @@ from datetime import datetime
 from nextcord import Embed, Color
 from core.client import dc
 from core.console import log
+from core.database import db
 from . import main as bot_main
 import bot
 
@@ -69,7 +70,8 @@ class Scheduler:
 		while True:
 			try:
 				await asyncio.sleep(60)
-				await bot_main.save_state_async()
+				# a periodic job, it runs on the background pool and leaves the user commands their connections
+				await bot_main.save_state_async(db.background)
 			except Exception as e:
 				log.error(f"Error in state save loop: {e}")
 				await asyncio.sleep(60)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from math import ceil, inf
+from time import time
+
+from core.config import cfg
+from core.database import db
+
+
+class Leaderboard:
+	"""
+	Snapshot of the rated and hidden qc_players rows of a rating channel, the visible rows are kept
+	sorted by rating. Loaded on first use and kept up to date by the RatingStore write-through calls,
+	reloaded when a write can not be applied in place or the snapshot is older than LB_SNAPSHOT_MAX_AGE.
+	"""
+
+	columns = ('user_id', 'nick', 'rating', 'deviation', 'wins', 'losses', 'draws', 'streak', 'is_hidden', 'last_ranked_match_at')
+
+	def __init__(self, channel_id):
+		self.channel_id = channel_id
+		self.players = None  # {user_id: row} or None if not loaded
+		self.rows = []  # visible rows sorted by rating
+		self.version = 0  # bumped on every change of the snapshot
+		self.loaded_at = 0
+		self.loads = 0
+		self.updates = 0
+		self._sorted = False
+		self._loading = None  # load task in progress
+		self._epoch = 0
+
+	async def _load(self):
+		epoch = self._epoch
+		players = dict()
+		async for rows in db.stream_batches(
+			"SELECT {} FROM `qc_players` WHERE `channel_id`=%s AND (`rating` IS NOT NULL OR `is_hidden`=1)".format(
+				", ".join((f"`{c}`" for c in self.columns))
+			),
+			(self.channel_id, )
+		):
+			players.update(((row['user_id'], row) for row in rows))
+		self.loads += 1
+		if epoch == self._epoch:
+			self.players, self._sorted = players, False
+			self.loaded_at = int(time())
+			self.version += 1
+		return players
+
+	async def get(self):
+		""" Return (visible rows sorted by rating, snapshot version or None if the rows were not cached) """
+		if self.players is None or self.loaded_at + cfg.LB_SNAPSHOT_MAX_AGE <= time():
+			if self._loading is None:
+				self._loading = asyncio.ensure_future(self._load())
+			task = self._loading
+			try:
+				players = await asyncio.shield(task)
+			finally:
+				if self._loading is task and task.done():
+					self._loading = None
+			if self.players is not players:  # changed while loading, serve the result without caching it
+				return self._visible(players), None
+
+		if not self._sorted:
+			self.rows = self._visible(self.players)
+			self._sorted = True
+		return self.rows, self.version
+
+	@staticmethod
+	def _visible(players):
+		return sorted(
+			(row for row in players.values() if row['rating'] is not None and not row['is_hidden']),
+			key=lambda row: row['rating'], reverse=True
+		)
+
+	def _changed(self):
+		self._sorted = False
+		self.version += 1
+		self.updates += 1
+
+	def update(self, user_id, **fields):
+		""" Write-through a qc_players row change """
+		fields = {k: v for k, v in fields.items() if k in self.columns}
+		if not len(fields):
+			return
+		if self._loading is not None:
+			self._epoch += 1
+		if self.players is None:
+			return
+
+		if (row := self.players.get(user_id)) is not None:
+			row.update(fields)
+		elif all((c in fields for c in self.columns if c not in ('user_id', 'is_hidden'))):
+			# players out of the snapshot are neither rated nor hidden
+			self.players[user_id] = dict(fields, user_id=user_id, is_hidden=0)
+		elif fields.get('rating') is not None:
+			self.invalidate()  # a new rated player, the row can not be completed from memory
+			return
+		else:
+			return
+		self._changed()
+
+	def update_all(self, **fields):
+		""" Write-through a change applied to every row of the channel """
+		fields = {k: v for k, v in fields.items() if k in self.columns}
+		if not len(fields):
+			return
+		if self._loading is not None:
+			self._epoch += 1
+		if self.players is None:
+			return
+		for row in self.players.values():
+			row.update(fields)
+		self._changed()
+
+	def invalidate(self):
+		""" Drop the snapshot, it will be reloaded on next request """
+		self.players, self.rows, self._sorted = None, [], False
+		self.version += 1
+		self._epoch += 1
+
+	@property
+	def age(self):
+		return int(time()) - self.loaded_at if self.players is not None else None
+
+
+class LeaderboardView:
+	"""
+	Leaderboard rows of a queue channel filtered by its settings, row strings are rendered once on first display.
+	Valid until the snapshot version changes or the first of the players falls out of the last match limit.
+	"""
+
+	def __init__(self, rows, version, min_matches=None, last_match_limit=None):
+		self.version = version
+		self.built_at = int(time())
+		self.expires_at = inf
+		self.rows = []
+		self._lines = dict()  # {(style, position): rendered row}
+
+		for row in rows:
+			if min_matches and min_matches > sum((row['wins'], row['losses'], row['draws'])):
+				continue
+			if last_match_limit:
+				expires_at = (row['last_ranked_match_at'] or 0) + last_match_limit
+				if expires_at <= self.built_at:
+					continue
+				self.expires_at = min(self.expires_at, expires_at)
+			self.rows.append(row)
+
+	def valid(self, version):
+		return self.version is not None and self.version == version and time() < self.expires_at
+
+	def pages(self, page_size):
+		return ceil(len(self.rows) / page_size)
+
+	def page(self, page, page_size, render, style=None):
+		""" List of (position, row, render(position, row)) of the 0-based page, rendered rows are reused """
+		results = []
+		if page < 0:
+			return results
+		for position in range(page * page_size, min((page + 1) * page_size, len(self.rows))):
+			if (line := self._lines.get((style, position))) is None:
+				line = self._lines[(style, position)] = render(position, self.rows[position])
+			results.append((position, self.rows[position], line))
+		return results
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 import time
 from random import choice
-from core.database import db
+from core.database import db, journal as db_journal
 from core.utils import get_nick
 
 # Database table definitions deferred to initialization to avoid blocking at import
@@ -12,10 +12,10 @@ class NoAdds:
 		self.next_tick = 0
 
 	@staticmethod
-	async def ensure_tables():
-		"""Initialize database tables for noadds module"""
-		
-		await db.ensure_table(dict(
+	def register_tables():
+		"""Register database tables for noadds module, they are created by db.reconcile_tables()"""
+
+		db.register_table(dict(
 			tname="noadds",
 			columns=[
 				dict(cname="id", ctype=db.types.int, autoincrement=True),
@@ -29,10 +29,14 @@ class NoAdds:
 				dict(cname="by", ctype=db.types.str),
 				dict(cname="released_by", ctype=db.types.str)
 			],
-			primary_keys=["id"]
+			primary_keys=["id"],
+			indexes=[
+				dict(iname="guild_user_active", columns=["guild_id", "user_id", "is_active"]),
+				dict(iname="active_at", columns=["is_active", "at", "duration"])
+			]
 		))
 
-		await db.ensure_table(dict(
+		db.register_table(dict(
 			tname="qc_phrases",
 			columns=[
 				dict(cname="channel_id", ctype=db.types.int),
@@ -66,33 +70,29 @@ class NoAdds:
 
 	@staticmethod
 	async def noadd(ctx, member, duration, moderator, reason=None):
-		await db.update(
-			'noadds',
-			dict(is_active=0, released_by="another noadd"),
-			keys=dict(guild_id=ctx.channel.guild.id, user_id=member.id, is_active=1)
+		await db_journal.apply(
+			('update', 'noadds', dict(is_active=0, released_by="another noadd"),
+				dict(guild_id=ctx.channel.guild.id, user_id=member.id, is_active=1)),
+			('insert', 'noadds', dict(
+				guild_id=ctx.channel.guild.id,
+				user_id=member.id,
+				name=get_nick(member),
+				at=int(time.time()),
+				duration=duration,
+				reason=reason,
+				by=get_nick(moderator)
+			))
 		)
-		await db.insert('noadds', dict(
-			guild_id=ctx.channel.guild.id,
-			user_id=member.id,
-			name=get_nick(member),
-			at=int(time.time()),
-			duration=duration,
-			reason=reason,
-			by=get_nick(moderator)
-		))
 
 	@staticmethod
 	async def forgive(ctx, member, moderator):
-		noadd_id = await db.select_one(
-			['id'], 'noadds', where=dict(guild_id=ctx.channel.guild.id, user_id=member.id, is_active=1)
-		)
-		if not noadd_id:
-			return False
-		await db.update(
-			'noadds',
-			dict(is_active=0, released_by=get_nick(moderator)),
-			keys=noadd_id
-		)
+		keys = dict(guild_id=ctx.channel.guild.id, user_id=member.id, is_active=1)
+		try:
+			if not await db.select_one(['id'], 'noadds', where=keys):
+				return False
+		except db.errors.OperationalError:
+			pass  # can't check while the database is unreachable, journal the release anyway
+		await db_journal.apply(('update', 'noadds', dict(is_active=0, released_by=get_nick(moderator)), keys))
 		return True
 
 	@staticmethod
@@ -101,7 +101,7 @@ class NoAdds:
 
 	async def think(self, frame_time):
 		if frame_time > self.next_tick:
-			await db.execute("UPDATE `noadds` SET is_active=0, released_by='time' WHERE (`at`+`duration`)<%s", (frame_time, ))
+			await db.background.execute("UPDATE `noadds` SET is_active=0, released_by='time' WHERE `is_active`=1 AND (`at`+`duration`)<%s", (frame_time, ))
 			self.next_tick = frame_time + 60
 
 
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from core.database import db, writer as db_writer
+from core.utils import iter_to_dict, BatchLoader
+
+
+class Players:
+	""" Batched lookups of the personal settings stored in the players table, including the queued writes """
+
+	columns = ('user_id', 'expire', 'allow_dm')
+
+	def __init__(self):
+		self.loader = BatchLoader(self._fetch)
+
+	async def _fetch(self, user_ids):
+		rows = await db.fetchall(
+			"SELECT {} FROM `players` WHERE `user_id` IN ({})".format(
+				", ".join((f"`{c}`" for c in self.columns)), ", ".join(['%s'] * len(user_ids))
+			),
+			user_ids
+		)
+		return iter_to_dict(rows, key='user_id')
+
+	def _overlay(self, user_id, row):
+		if (queued := db_writer.get('players', {'user_id': user_id})) is None:
+			return row
+		return dict(row or dict.fromkeys(self.columns), user_id=user_id, **queued)
+
+	async def get(self, user_id):
+		""" Return the players row of the user or None """
+		return self._overlay(user_id, await self.loader.load(user_id))
+
+	async def get_many(self, user_ids):
+		""" Return {user_id: row or None} """
+		return {
+			user_id: self._overlay(user_id, row) for user_id, row in (await self.loader.load_many(user_ids)).items()
+		}
+
+
+players = Players()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+from core.config import cfg
+from core.database import db
+
+
+class Profiles:
+	"""
+	Player profiles read model: the recent qc_rating_history rows of the players and their match counts
+	per queue. A profile part is loaded by a single keyed query on first request and kept up to date by
+	the code writing the tables, so it is read from the primary. Least recently used entries are evicted
+	above max_size.
+	"""
+
+	history_size = 20  # rating changes kept per player, enough for the !rank graph
+
+	def __init__(self, max_size):
+		self.max_size = max_size
+		self.history = OrderedDict()  # {(rating channel_id, user_id): [history rows, newest first]}
+		self.matches = OrderedDict()  # {(channel_id, user_id): {queue_name: count}}
+		self.hits = 0
+		self.misses = 0
+		self._fetching = 0
+		self._epoch = 0  # bumped on writes, a fetch started before a write is not cached
+
+	def _get(self, cache, key):
+		if (value := cache.get(key)) is not None:
+			cache.move_to_end(key)
+			self.hits += 1
+		else:
+			self.misses += 1
+		return value
+
+	def _put(self, cache, key, value):
+		cache[key] = value
+		while len(cache) > self.max_size:
+			cache.popitem(last=False)
+
+	async def _fetch(self, cache, key, coro):
+		epoch = self._epoch
+		self._fetching += 1
+		try:
+			value = await coro
+		finally:
+			self._fetching -= 1
+		if epoch == self._epoch:
+			self._put(cache, key, value)
+		return value
+
+	def _written(self):
+		if self._fetching:
+			self._epoch += 1
+
+	async def rating_history(self, channel_id, user_id, limit=None):
+		""" Last rating changes of the player, newest first """
+		key = (channel_id, user_id)
+		if (rows := self._get(self.history, key)) is None:
+			rows = await self._fetch(self.history, key, self._fetch_history(channel_id, user_id))
+		return rows[:limit]
+
+	async def match_counts(self, channel_id, user_id):
+		""" Return {'total': count, 'queues': [{'queue_name', 'count'}]} of the player matches, most played first """
+		key = (channel_id, user_id)
+		if (counts := self._get(self.matches, key)) is None:
+			counts = await self._fetch(self.matches, key, self._fetch_counts(channel_id, user_id))
+		queues = sorted(
+			(dict(queue_name=name, count=count) for name, count in counts.items()),
+			key=lambda q: q['count'], reverse=True
+		)
+		return dict(total=sum((q['count'] for q in queues)), queues=queues)
+
+	async def _fetch_history(self, channel_id, user_id):
+		return list(await db.select(
+			('at', 'rating_before', 'rating_change', 'match_id', 'reason'), 'qc_rating_history',
+			where=dict(user_id=user_id, channel_id=channel_id), order_by='id', limit=self.history_size
+		))
+
+	@staticmethod
+	async def _fetch_counts(channel_id, user_id):
+		data = await db.fetchall(
+			"SELECT `queue_name`, COUNT(*) as count FROM `qc_player_matches` AS pm " +
+			"JOIN `qc_matches` AS m ON pm.match_id=m.match_id " +
+			"WHERE pm.channel_id=%s AND user_id=%s " +
+			"GROUP BY m.queue_name",
+			(channel_id, user_id)
+		)
+		return {row['queue_name']: row['count'] for row in data}
+
+	def add_history(self, rows):
+		""" Write-through inserted qc_rating_history rows """
+		self._written()
+		for row in rows:
+			if (cached := self.history.get((row['channel_id'], row['user_id']))) is not None:
+				cached.insert(0, {k: row.get(k) for k in ('at', 'rating_before', 'rating_change', 'match_id', 'reason')})
+				del cached[self.history_size:]
+
+	def add_match(self, channel_id, queue_name, user_ids):
+		""" Write-through a registered match """
+		self._written()
+		for user_id in user_ids:
+			if (counts := self.matches.get((channel_id, user_id))) is not None:
+				counts[queue_name] = counts.get(queue_name, 0) + 1
+
+	def drop(self, channel_id, *user_ids):
+		""" Forget the profiles of given players changed outside of the write-through calls """
+		self._written()
+		for user_id in user_ids:
+			self.history.pop((channel_id, user_id), None)
+			self.matches.pop((channel_id, user_id), None)
+
+	def drop_channel(self, channel_id):
+		self._written()
+		for cache in (self.history, self.matches):
+			for key in [k for k in cache.keys() if k[0] == channel_id]:
+				cache.pop(key)
+
+	def summary(self):
+		return dict(
+			history=len(self.history), matches=len(self.matches), hits=self.hits, misses=self.misses,
+			hit_rate=self.hits / max(1, self.hits + self.misses)
+		)
+
+
+profiles = Profiles(cfg.PROFILES_CACHE_SIZE)
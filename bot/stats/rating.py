@@ -2,16 +2,21 @@
 import glicko2
 import trueskill
 import time
+import numpy as np
 
 from core.database import db
-from core.utils import find, get_nick
+from core.utils import get_nick
 
 from bot.stats import stats
+from bot.stats.rating_store import get_store
+from bot.stats.profiles import profiles
+from bot.stats.rating_batch import Batch, glicko2_changes, trueskill_changes
 
 
 class BaseRating:
 
 	table = "qc_players"
+	player_columns = ('user_id', 'rating', 'deviation', 'channel_id', 'wins', 'losses', 'draws', 'streak')
 
 	def __init__(
 			self, channel_id, init_rp=1500, init_deviation=300, min_deviation=None, scale=100,
@@ -61,15 +66,21 @@ class BaseRating:
 		p['deviation'] = max(self.min_deviation, round(p['deviation'] + d_change))
 		return p
 
+	def rate_many(self, matches):
+		"""
+		Rate a batch of independent matches, each given as a dict of rate() arguments, returns the list of rate() results.
+		Overridden with the numpy kernels by the systems that are faster that way.
+		"""
+		return [self.rate(**m) for m in matches]
+
 	async def get_players(self, user_ids):
 		""" Return rating or initial rating for each member """
-		data = await db.select(
-			['user_id', 'rating', 'deviation', 'channel_id', 'wins', 'losses', 'draws', 'streak'], self.table,
-			where={'channel_id': self.channel_id}
-		)
+		user_ids = list(user_ids)
+		data = await self.store.get(user_ids)
 		results = []
 		for user_id in user_ids:
-			if d := find(lambda p: p['user_id'] == user_id, data):
+			if d := data.get(user_id):
+				d = {k: d[k] for k in self.player_columns}
 				if d['rating'] is None:
 					d['rating'] = self.init_rp
 					d['deviation'] = self.init_deviation
@@ -78,16 +89,17 @@ class BaseRating:
 			else:
 				d = dict(
 					channel_id=self.channel_id, user_id=user_id, rating=self.init_rp,
-					deviation=self.init_deviation, wins=0, losses=0, draws=0
+					deviation=self.init_deviation, wins=0, losses=0, draws=0, streak=0
 				)
 			results.append(d)
 		return results
 
+	@property
+	def store(self):
+		return get_store(self.channel_id)
+
 	async def set_rating(self, member, rating=None, deviation=None, penality=0, reason=None):
-		old = await db.select_one(
-			('rating', 'deviation'), self.table,
-			where=dict(channel_id=self.channel_id, user_id=member.id)
-		)
+		old = (await self.store.get((member.id, ))).get(member.id)
 
 		if not old:
 			rating = max(1, rating - penality if rating else self.init_rp - penality)
@@ -99,6 +111,10 @@ class BaseRating:
 				),
 				on_dublicate='replace'
 			)
+			self.store.update(
+				member.id, rating=rating, deviation=deviation or self.init_deviation,
+				wins=0, losses=0, draws=0, streak=0
+			)
 			old = dict(rating=self.init_rp, deviation=self.init_deviation)
 		else:
 			rating = max(1, rating - penality if rating else old['rating'] - penality)
@@ -109,108 +125,126 @@ class BaseRating:
 					dict(rating=rating, deviation=deviation or old['deviation']),
 					keys=dict(channel_id=self.channel_id, user_id=member.id)
 				)
+			self.store.update(member.id, rating=rating, deviation=deviation or old['deviation'])
 
-		await db.insert(
-			"qc_rating_history",
-			dict(
-				channel_id=self.channel_id, user_id=member.id, at=int(time.time()), rating_before=old['rating'],
-				deviation_before=old['deviation'], rating_change=rating-old['rating'],
-				deviation_change=deviation-old['deviation'] if deviation else 0,
-				match_id=None, reason=reason
-			),
-			on_dublicate='ignore'
+		history = dict(
+			channel_id=self.channel_id, user_id=member.id, at=int(time.time()), rating_before=old['rating'],
+			deviation_before=old['deviation'], rating_change=rating-old['rating'],
+			deviation_change=deviation-old['deviation'] if deviation else 0,
+			match_id=None, reason=reason
 		)
+		await db.insert("qc_rating_history", history, on_dublicate='ignore')
+		profiles.add_history((history, ))
 
 	async def hide_player(self, user_id, hide=True):
 		await db.update(self.table, dict(is_hidden=hide), keys=dict(channel_id=self.channel_id, user_id=user_id))
+		self.store.update(user_id, is_hidden=hide)
 
 	async def snap_ratings(self, ranks_table):
 		ranks = [i['rating'] for i in ranks_table if i['rating'] != 0]
 		lowest = min(ranks)
-		data = await db.select(('*',), self.table, where=dict(channel_id=self.channel_id))
-		history = []
-		now = int(time.time())
-		for p in (p for p in data if p['rating'] is not None):
-			new_rating = max([i for i in ranks if i <= p['rating']] + [lowest])
-			history.append(dict(
-				user_id=p['user_id'],
-				channel_id=self.channel_id,
-				at=now,
-				rating_before=p['rating'],
-				rating_change=new_rating - p['rating'],
-				deviation_before=p['deviation'],
-				deviation_change=0,
-				match_id=None,
-				reason="ratings snap"
-			))
-			p['rating'] = new_rating
-		await db.insert_many(self.table, data, on_dublicate='replace')
-		await db.insert_many('qc_rating_history', history)
-
-	async def apply_decay(self, rating, deviation, ranks_table):
-		""" Apply weekly rating and deviation decay """
-		now = int(time.time())
-		ranks = [i['rating'] for i in ranks_table if i['rating'] != 0]
-		data = await stats.last_games(self.channel_id)
-		history = []
-		to_update = []
-		for p in data:
-			if None in (p['rating'], p['deviation'], p['at']):
-				continue
-
-			new_deviation = min((self.init_deviation, p['deviation'] + deviation))
-
-			min_rating = max([i for i in ranks if i <= p['rating']]+[0])
-			if min_rating != 0 and p['at'] < (now-(60*60*24*7)):
-				new_rating = max((min_rating, p['rating']-rating))
-			else:
-				new_rating = p['rating']
-
-			if new_rating != p['rating'] or new_deviation != p['deviation']:
-				history.append(dict(
-					user_id=p['user_id'],
-					channel_id=self.channel_id,
-					at=now,
-					rating_before=p['rating'],
-					rating_change=new_rating-p['rating'],
-					deviation_before=p['deviation'],
-					deviation_change=new_deviation-p['deviation'],
-					match_id=None,
-					reason="inactivity rating decay"
-				))
-				p.pop('at')
-				p['deviation'] = new_deviation
-				p['rating'] = new_rating
-				to_update.append(p)
-
-		if len(history):
-			await db.insert_many('qc_rating_history', history)
-			await db.insert_many(self.table, to_update, on_dublicate='replace')
-
-	async def reset(self):
-		data = await db.select(('user_id', 'rating', 'deviation'), self.table, where=dict(channel_id=self.channel_id))
-		history = []
 		now = int(time.time())
-
-		for p in data:
-			if p['rating'] is not None and (p['rating'] != self.init_rp or p['deviation'] != self.init_deviation):
+		async for data in db.background.stream_batches(
+			f"SELECT `user_id`, `rating`, `deviation` FROM `{self.table}` WHERE `channel_id`=%s AND `rating` IS NOT NULL",
+			(self.channel_id, )
+		):
+			history = []
+			to_update = []
+			for p in data:
+				new_rating = max([i for i in ranks if i <= p['rating']] + [lowest])
+				if new_rating != p['rating']:
+					to_update.append(dict(channel_id=self.channel_id, user_id=p['user_id'], rating=new_rating))
 				history.append(dict(
 					user_id=p['user_id'],
 					channel_id=self.channel_id,
 					at=now,
 					rating_before=p['rating'],
-					rating_change=self.init_rp-p['rating'],
+					rating_change=new_rating - p['rating'],
 					deviation_before=p['deviation'],
-					deviation_change=self.init_deviation-p['deviation'],
+					deviation_change=0,
 					match_id=None,
-					reason="ratings reset"
+					reason="ratings snap"
 				))
+			await db.background.insert_many(self.table, to_update, on_dublicate='update', update_columns=('rating', ))
+			await db.background.insert_many('qc_rating_history', history)
+			profiles.add_history(history)
+			for p in to_update:
+				self.store.update(p['user_id'], rating=p['rating'])
 
-		await db.update(
-			self.table, dict(rating=None, deviation=None), keys=dict(channel_id=self.channel_id)
-		)
-		if len(history):
-			await db.insert_many('qc_rating_history', history)
+	async def apply_decay(self, rating, deviation, ranks_table):
+		""" Apply weekly rating and deviation decay """
+		now = int(time.time())
+		ranks = [i['rating'] for i in ranks_table if i['rating'] != 0]
+		async for data in stats.last_games(self.channel_id):
+			history = []
+			to_update = []
+			for p in data:
+				if None in (p['rating'], p['deviation'], p['at']):
+					continue
+
+				new_deviation = min((self.init_deviation, p['deviation'] + deviation))
+
+				min_rating = max([i for i in ranks if i <= p['rating']]+[0])
+				if min_rating != 0 and p['at'] < (now-(60*60*24*7)):
+					new_rating = max((min_rating, p['rating']-rating))
+				else:
+					new_rating = p['rating']
+
+				if new_rating != p['rating'] or new_deviation != p['deviation']:
+					history.append(dict(
+						user_id=p['user_id'],
+						channel_id=self.channel_id,
+						at=now,
+						rating_before=p['rating'],
+						rating_change=new_rating-p['rating'],
+						deviation_before=p['deviation'],
+						deviation_change=new_deviation-p['deviation'],
+						match_id=None,
+						reason="inactivity rating decay"
+					))
+					to_update.append(dict(
+						channel_id=self.channel_id, user_id=p['user_id'], rating=new_rating, deviation=new_deviation
+					))
+
+			if len(history):
+				await db.background.insert_many('qc_rating_history', history)
+				profiles.add_history(history)
+				await db.background.insert_many(
+					self.table, to_update, on_dublicate='update', update_columns=('rating', 'deviation')
+				)
+				for p in to_update:
+					self.store.update(p['user_id'], rating=p['rating'], deviation=p['deviation'])
+
+	async def reset(self, tx=None):
+		async with (tx or db).transaction() as tx:
+			now = int(time.time())
+			# the ratings are read on the connection of the transaction, the history is written in batches
+			async for data in tx.stream_batches(
+				f"SELECT `user_id`, `rating`, `deviation` FROM `{self.table}` WHERE `channel_id`=%s AND `rating` IS NOT NULL",
+				(self.channel_id, )
+			):
+				history = [
+					dict(
+						user_id=p['user_id'],
+						channel_id=self.channel_id,
+						at=now,
+						rating_before=p['rating'],
+						rating_change=self.init_rp-p['rating'],
+						deviation_before=p['deviation'],
+						deviation_change=self.init_deviation-p['deviation'],
+						match_id=None,
+						reason="ratings reset"
+					)
+					for p in data if p['rating'] != self.init_rp or p['deviation'] != self.init_deviation
+				]
+				if len(history):
+					await tx.insert_many('qc_rating_history', history)
+					tx.on_commit(profiles.add_history, history)
+
+			await tx.update(
+				self.table, dict(rating=None, deviation=None), keys=dict(channel_id=self.channel_id)
+			)
+			tx.on_commit(self.store.update_all, rating=None, deviation=None)
 
 
 class FlatRating(BaseRating):
@@ -278,6 +312,12 @@ class Glicko2Rating(BaseRating):
 
 		return [r1, r2]
 
+	def rate_many(self, matches):
+		batch = Batch(matches)
+		with np.errstate(all='ignore'):
+			changes = glicko2_changes(batch)
+		return batch.scale_changes(self, *changes)
+
 
 class TrueSkillRating(BaseRating):
 
@@ -308,6 +348,14 @@ class TrueSkillRating(BaseRating):
 
 		return [r1, r2]
 
+	def rate_many(self, matches):
+		if self.ts.backend is not None:  # the kernel replicates the builtin math backend only
+			return super().rate_many(matches)
+		batch = Batch(matches)
+		with np.errstate(all='ignore'):
+			changes = trueskill_changes(batch, self.ts)
+		return batch.scale_changes(self, *changes)
+
 
 class Quidditch6v6Rating(BaseRating):
 	"""
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+
+# glicko2.Player constants
+GLICKO2_SCALE = 173.7178
+GLICKO2_TAU = 0.5
+GLICKO2_VOL = 0.06
+GLICKO2_EPS = 0.000001
+
+
+class Batch:
+	"""
+	Players of a batch of independent matches flattened into arrays in the order the rate() loops visit them,
+	winners of a match first. Teams are indexed as match * 2 + side, side 0 for the winners and 1 for the losers.
+	"""
+
+	columns = ('rating', 'deviation', 'wins', 'losses', 'draws', 'streak')
+
+	def __init__(self, matches):
+		self.matches = matches
+		self.players = []
+		team_size = []  # by team index
+		for m in matches:
+			for team in (m['winners'], m['losers']):
+				self.players.extend(team)
+				team_size.append(len(team))
+
+		self.team_size = np.array(team_size, dtype=np.intp)
+		self.team = np.repeat(np.arange(len(team_size), dtype=np.intp), self.team_size)
+		self.match, self.side = self.team // 2, self.team % 2
+		match_size = self.team_size[0::2] + self.team_size[1::2]
+		self.seq = np.arange(len(self.players), dtype=np.intp) - (np.cumsum(match_size) - match_size)[self.match]
+		self.opponents = self.match * 2 + (1 - self.side)
+		self.draw = np.array([bool(m.get('draw')) for m in matches], dtype=bool)[self.match]
+		self.score = np.where(self.draw, 0, np.where(self.side == 0, 1, -1))
+		for c in self.columns:
+			setattr(self, c, np.array([p[c] for p in self.players], dtype=np.float64))
+
+	def team_sum(self, values):
+		""" Sums of per player values by team """
+		return np.bincount(self.team, weights=values, minlength=len(self.matches) * 2)
+
+	def scale_changes(self, rating, r_change, d_change, fallback):
+		"""
+		Vectorized BaseRating._scale_changes() of all the players, returns the rate() results of the matches.
+		The matches flagged in fallback are rated by rate() itself.
+		"""
+		streak, score = self.streak, self.score
+		loss, draw, win = score == -1, score == 0, score == 1
+		streak = np.select(
+			[loss, win], [np.where(streak >= 0, -1, streak - 1), np.where(streak <= 0, 1, streak + 1)], 0
+		)
+
+		r = np.empty_like(r_change)
+		r[loss] = rating._scale_loss(r_change[loss]) * rating.scale
+		r[draw] = rating._scale_draw(r_change[draw]) * rating.scale
+		r[win] = rating._scale_win(r_change[win]) * rating.scale
+		if rating.ls_boost:
+			boost = loss & (streak < -2)
+			r[boost] = r[boost] * (np.minimum(np.abs(streak[boost]), 6) / 2)
+		if rating.ws_boost:
+			boost = win & (streak > 2)
+			r[boost] = r[boost] * (np.minimum(streak[boost], 6) / 2)
+
+		new = [
+			np.maximum(0, np.round(self.rating + r)),
+			np.maximum(rating.min_deviation, np.round(self.deviation + d_change)),
+			self.wins + win, self.losses + loss, self.draws + draw, streak
+		]
+		new = zip(*(v.astype(np.int64).tolist() for v in new))
+
+		results = [[[], []] for i in range(len(self.matches))]
+		for p, match, side, skip, (rating_, deviation, wins, losses, draws, streak) in zip(
+			self.players, self.match.tolist(), self.side.tolist(), fallback[self.match].tolist(), new
+		):
+			if not skip:
+				results[match][side].append(dict(
+					p, rating=rating_, deviation=deviation, wins=wins, losses=losses, draws=draws, streak=streak
+				))
+		for match in np.flatnonzero(fallback).tolist():
+			results[match] = rating.rate(**self.matches[match])
+		return results
+
+
+def glicko2_changes(batch):
+	"""
+	Rating and deviation changes of glicko2.Player.update_player() of every player with the own team average
+	rating against the opponent team average, as done by Glicko2Rating.rate(). The rate() loops share a single
+	Player object, so the volatility is carried over from a player to the next one within a match.
+	"""
+	fallback = np.zeros(len(batch.matches), dtype=bool)
+	size = batch.team_size
+	fallback[(size[0::2] == 0) | (size[1::2] == 0)] = True  # rate() fails on the empty team averages
+	size = np.maximum(size, 1)
+	avg_rating = np.trunc(batch.team_sum(batch.rating) / size)
+	avg_deviation = np.trunc(batch.team_sum(batch.deviation) / size)
+
+	outcome = np.where(batch.draw, 0.5, np.where(batch.side == 0, 1.0, 0.0))
+	mu = (avg_rating[batch.team] - 1500) / GLICKO2_SCALE
+	phi = batch.deviation / GLICKO2_SCALE
+	mu_o = (avg_rating[batch.opponents] - 1500) / GLICKO2_SCALE
+	phi_o = avg_deviation[batch.opponents] / GLICKO2_SCALE
+
+	g = 1 / np.sqrt(1 + 3 * phi_o ** 2 / math.pi ** 2)
+	e = 1 / (1 + np.exp(-1 * g * (mu - mu_o)))
+	v = 1 / (g ** 2 * e * (1 - e))
+	delta = v * (g * (outcome - e))
+
+	vol = np.empty_like(mu)
+	prev = np.full(len(batch.matches), GLICKO2_VOL)
+	for n in range(int(batch.seq.max(initial=-1)) + 1):
+		idx = np.flatnonzero(batch.seq == n)
+		vol[idx] = prev[batch.match[idx]] = _glicko2_volatility(
+			prev[batch.match[idx]], delta[idx], v[idx], phi[idx], mu[idx]
+		)
+
+	phi = np.sqrt(phi ** 2 + vol ** 2)
+	phi = 1 / np.sqrt((1 / phi ** 2) + (1 / v))
+	mu = mu + phi ** 2 * (g * (outcome - e))
+	r_change = (mu * GLICKO2_SCALE + 1500) - avg_rating[batch.team]
+	d_change = phi * GLICKO2_SCALE - batch.deviation
+	return r_change, d_change, fallback
+
+
+def _glicko2_volatility(vol, delta, v, phi, mu):
+	""" glicko2.Player._newVol() iterations, vectorized """
+	a = np.log(vol ** 2)
+	tau = GLICKO2_TAU
+
+	def f(x, i):
+		ex = np.exp(x)
+		num1 = ex * (delta[i] ** 2 - mu[i] ** 2 - v[i] - ex)
+		denom1 = 2 * ((mu[i] ** 2 + v[i] + ex) ** 2)
+		return (num1 / denom1) - ((x - a[i]) / (tau ** 2))
+
+	A = a.copy()
+	B = np.empty_like(a)
+	above = delta ** 2 > phi ** 2 + v
+	B[above] = np.log(delta[above] ** 2 - phi[above] ** 2 - v[above])
+	k = np.ones_like(a)
+	pending = np.flatnonzero(~above)
+	while len(pending := pending[f(a[pending] - k[pending] * math.sqrt(tau ** 2), pending) < 0]):
+		k[pending] += 1
+	B[~above] = a[~above] - k[~above] * math.sqrt(tau ** 2)
+
+	all_idx = np.arange(len(a))
+	fA, fB = f(A, all_idx), f(B, all_idx)
+	active = np.flatnonzero(np.abs(B - A) > GLICKO2_EPS)
+	while len(active):
+		C = A[active] + ((A[active] - B[active]) * fA[active]) / (fB[active] - fA[active])
+		fC = f(C, active)
+		swap = fC * fB[active] < 0
+		A[active] = np.where(swap, B[active], A[active])
+		fA[active] = np.where(swap, fB[active], fA[active] / 2.0)
+		B[active], fB[active] = C, fC
+		active = active[np.abs(B[active] - A[active]) > GLICKO2_EPS]
+	return np.exp(A / 2)
+
+
+def _erfc(x):
+	""" trueskill.backends.erfc(), vectorized """
+	z = np.abs(x)
+	t = 1. / (1. + z / 2.)
+	r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (
+		0.37409196 + t * (0.09678418 + t * (-0.18628806 + t * (
+			0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+				-0.82215223 + t * 0.17087277
+			)))
+		)))
+	)))
+	return np.where(x < 0, 2. - r, r)
+
+
+def _cdf(x):
+	return 0.5 * _erfc(-x / math.sqrt(2))
+
+
+def _pdf(x):
+	return 1 / math.sqrt(2 * math.pi) * np.exp(-(x ** 2 / 2))
+
+
+def trueskill_changes(batch, env):
+	"""
+	Mean and sigma changes of trueskill.TrueSkill.rate() of two teams in the closed form of its factor graph,
+	which converges in a single pass for two teams. Matches the builtin math backend of the environment.
+	"""
+	fallback = np.zeros(len(batch.matches), dtype=bool)
+	size = batch.team_size
+	fallback[(size[0::2] == 0) | (size[1::2] == 0)] = True
+
+	sigma2 = batch.deviation ** 2 + env.tau ** 2
+	team_mu = batch.team_sum(batch.rating)
+	team_var = batch.team_sum(sigma2 + env.beta ** 2)
+	c2 = team_var[0::2] + team_var[1::2]
+	c = np.sqrt(c2)
+	total = size[0::2] + size[1::2]
+	margins = {n: env.ppf((env.draw_probability + 1) / 2.) * math.sqrt(n) * env.beta for n in np.unique(total).tolist()}
+	draw_margin = np.array([margins[n] for n in total.tolist()], dtype=np.float64)
+
+	t, eps = (team_mu[0::2] - team_mu[1::2]) / c, draw_margin / c
+	draw = np.zeros(len(batch.matches), dtype=bool)
+	draw[batch.match] = batch.draw
+
+	# v_win() and w_win()
+	x = t - eps
+	denom = _cdf(x)
+	v_win = np.where(denom != 0, _pdf(x) / np.where(denom != 0, denom, 1), -x)
+	w_win = v_win * (v_win + x)
+
+	# v_draw() and w_draw()
+	abs_t = np.abs(t)
+	a, b = eps - abs_t, -eps - abs_t
+	denom = _cdf(a) - _cdf(b)
+	safe = np.where(denom != 0, denom, 1)
+	v_abs = np.where(denom != 0, (_pdf(b) - _pdf(a)) / safe, a)
+	v_draw = v_abs * np.where(t < 0, -1, 1)
+	w_draw = v_abs ** 2 + (a * _pdf(a) - b * _pdf(b)) / safe
+
+	v = np.where(draw, v_draw, v_win)
+	w = np.where(draw, w_draw, w_win)
+	# rate() raises FloatingPointError on these, leave them to it
+	fallback |= np.where(draw, denom == 0, ~((0 < w_win) & (w_win < 1)))
+
+	sign = np.where(batch.side == 0, 1, -1)
+	mu = batch.rating + sign * sigma2 / c[batch.match] * v[batch.match]
+	sigma = np.sqrt(sigma2 * (1 - sigma2 / c2[batch.match] * w[batch.match]))
+	return mu - batch.rating, sigma - batch.deviation, fallback
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from bisect import bisect_left, bisect_right, insort
+from core.database import db
+
+
+class Fenwick:
+	"""
+	Binary indexed tree counting integer values in the range [lo, lo+size),
+	the few values out of the range are counted in a sorted list instead.
+	"""
+
+	def __init__(self, lo, size):
+		self.lo = lo
+		self.size = size
+		self.tree = [0] * (self.size + 1)
+		self.outliers = []  # sorted values out of the range
+		self.total = 0
+
+	def covers(self, value):
+		return self.lo <= value < self.lo + self.size
+
+	def add(self, value, delta):
+		self.total += delta
+		if not self.covers(value):
+			for i in range(abs(delta)):
+				if delta > 0:
+					insort(self.outliers, value)
+				else:
+					del self.outliers[bisect_left(self.outliers, value)]
+			return
+		i = value - self.lo + 1
+		while i <= self.size:
+			self.tree[i] += delta
+			i += i & -i
+
+	def count_le(self, value):
+		""" Number of values <= value """
+		i = min(value - self.lo + 1, self.size)
+		count = bisect_right(self.outliers, value)
+		while i > 0:
+			count += self.tree[i]
+			i -= i & -i
+		return count
+
+
+class RatingIndex:
+	"""
+	Order statistics of the visible ratings of a rating channel, answering the place of a rating
+	in O(log n). Loaded from qc_players on first use and kept up to date by the RatingStore write-through calls.
+	"""
+
+	margin = 1000  # spare rating range around the loaded ratings before the tree is rebuilt
+	max_span = 1 << 14  # tree range limit, the ratings out of it around the median are kept as outliers
+
+	def __init__(self, channel_id):
+		self.channel_id = channel_id
+		self.ratings = dict()  # {user_id: rating} of all rated players
+		self.hidden = set()  # user_ids of the hidden players
+		self.tree = None
+		self.loaded = False
+		self.loads = 0
+		self.rebuilds = 0
+		self._loading = None  # load task in progress
+		self._pending = []  # [(user_id or None for all, fields)] written while loading
+		self._epoch = 0
+
+	def _counted(self, user_id):
+		""" Rating of the player if it is on the leaderboard, None otherwise """
+		return None if user_id in self.hidden else self.ratings.get(user_id)
+
+	def _build(self):
+		visible = sorted((r for user_id, r in self.ratings.items() if user_id not in self.hidden))
+		lo, hi = (visible[0] if visible else 0) - self.margin, (visible[-1] if visible else 0) + self.margin
+		if hi - lo + 1 > self.max_span:  # a few extreme ratings must not size the tree
+			lo = visible[len(visible) // 2] - self.max_span // 2
+			hi = lo + self.max_span - 1
+		self.tree = Fenwick(lo, hi - lo + 1)
+		for rating in visible:
+			self.tree.add(rating, 1)
+		self.rebuilds += 1
+
+	def _apply(self, user_id, fields):
+		old = self._counted(user_id)
+		if 'rating' in fields:
+			if fields['rating'] is None:
+				self.ratings.pop(user_id, None)
+			else:
+				self.ratings[user_id] = int(fields['rating'])
+		if 'is_hidden' in fields:
+			if fields['is_hidden']:
+				self.hidden.add(user_id)
+			else:
+				self.hidden.discard(user_id)
+
+		new = self._counted(user_id)
+		if old == new:
+			return
+		if new is not None and not self.tree.covers(new) and self.tree.size < self.max_span:
+			self._build()
+			return
+		if old is not None:
+			self.tree.add(old, -1)
+		if new is not None:
+			self.tree.add(new, 1)
+
+	async def _load(self):
+		epoch = self._epoch
+		ratings, hidden = dict(), set()
+		async for rows in db.stream_batches(
+			"SELECT `user_id`, `rating`, `is_hidden` FROM `qc_players` " +
+			"WHERE `channel_id`=%s AND (`rating` IS NOT NULL OR `is_hidden`=1)",
+			(self.channel_id, )
+		):
+			for row in rows:
+				if row['rating'] is not None:
+					ratings[row['user_id']] = int(row['rating'])
+				if row['is_hidden']:
+					hidden.add(row['user_id'])
+		if epoch != self._epoch:
+			return  # invalidated while loading
+
+		self.ratings, self.hidden = ratings, hidden
+		self._build()
+		for user_id, fields in self._pending:
+			if user_id is None:
+				for user_id in list(self.ratings.keys()):
+					self._apply(user_id, fields)
+			else:
+				self._apply(user_id, fields)
+		self._pending = []
+		self.loaded = True
+		self.loads += 1
+
+	async def ensure_loaded(self):
+		while not self.loaded:
+			if self._loading is None:
+				self._pending = []
+				self._loading = asyncio.ensure_future(self._load())
+			task = self._loading
+			try:
+				await asyncio.shield(task)
+			finally:
+				if self._loading is task and task.done():
+					self._loading = None
+
+	def update(self, user_id, **fields):
+		""" Write-through a qc_players row change """
+		fields = {k: v for k, v in fields.items() if k in ('rating', 'is_hidden')}
+		if not len(fields):
+			return
+		if self.loaded:
+			self._apply(user_id, fields)
+		elif self._loading is not None:
+			self._pending.append((user_id, fields))
+
+	def update_all(self, **fields):
+		""" Write-through a change applied to every row of the channel """
+		fields = {k: v for k, v in fields.items() if k in ('rating', 'is_hidden')}
+		if not len(fields):
+			return
+		if self.loaded:
+			for user_id in list(self.ratings.keys()):
+				self._apply(user_id, fields)
+		elif self._loading is not None:
+			self._pending.append((None, fields))
+
+	def invalidate(self):
+		""" Drop the index, it will be reloaded on next query """
+		self.loaded = False
+		self.ratings, self.hidden, self.tree = dict(), set(), None
+		self._epoch += 1
+
+	async def place(self, rating):
+		""" 1-based place the rating takes on the leaderboard, ties share the place """
+		await self.ensure_loaded()
+		return self.tree.total - self.tree.count_le(int(rating)) + 1
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from core.database import db
+from core.utils import iter_to_dict, BatchLoader
+from bot.stats.rating_index import RatingIndex
+from bot.stats.leaderboard import Leaderboard
+
+
+class RatingStore:
+	"""
+	In-memory write-through copy of the qc_players rating columns of a single rating channel.
+	Rows are loaded lazily on first request and kept up to date by the code that writes them,
+	players without a qc_players row are remembered as None. The writes are passed on to the
+	RatingIndex and the Leaderboard of the channel.
+	"""
+
+	table = "qc_players"
+	columns = ('user_id', 'channel_id', 'rating', 'deviation', 'wins', 'losses', 'draws', 'streak', 'is_hidden')
+	fetch_chunk_size = 500  # max user ids per "IN (...)" lookup
+	_blank = dict(rating=None, deviation=None, wins=0, losses=0, draws=0, streak=0, is_hidden=0)
+
+	def __init__(self, channel_id):
+		self.channel_id = channel_id
+		self.rows = dict()  # {user_id: row or None}
+		self.hits = 0
+		self.misses = 0
+		self._fetching = 0
+		self._stale = set()  # user_ids written while a fetch was in progress
+		self._epoch = 0
+		self.loader = BatchLoader(self._fetch, max_batch_size=self.fetch_chunk_size)
+		self.index = RatingIndex(channel_id)
+		self.leaderboard = Leaderboard(channel_id)
+
+	async def _fetch(self, user_ids):
+		data = {}
+		for i in range(0, len(user_ids), self.fetch_chunk_size):
+			chunk = user_ids[i:i+self.fetch_chunk_size]
+			rows = await db.fetchall(
+				"SELECT {} FROM `{}` WHERE `channel_id`=%s AND `user_id` IN ({})".format(
+					", ".join((f"`{c}`" for c in self.columns)), self.table, ", ".join(['%s'] * len(chunk))
+				),
+				(self.channel_id, *chunk)
+			)
+			data.update(iter_to_dict(rows, key='user_id'))
+		return data
+
+	async def get(self, user_ids):
+		""" Return {user_id: row copy} for given user ids, players without a row are omitted """
+		user_ids = list(user_ids)
+		missing = list({i for i in user_ids if i not in self.rows})
+		self.hits += len(user_ids) - len(missing)
+		self.misses += len(missing)
+
+		fetched = {}
+		if len(missing):
+			epoch = self._epoch
+			self._fetching += 1
+			try:
+				# concurrent misses within the same tick are fetched by a single query
+				fetched = await self.loader.load_many(missing)
+			finally:
+				self._fetching -= 1
+			if epoch == self._epoch:
+				for user_id in missing:
+					if user_id not in self._stale:
+						self.rows[user_id] = fetched.get(user_id)
+			if not self._fetching:
+				self._stale.clear()
+
+		results = {}
+		for user_id in user_ids:
+			row = self.rows[user_id] if user_id in self.rows else fetched.get(user_id)
+			if row is not None:
+				results[user_id] = row.copy()
+		return results
+
+	def update(self, user_id, **fields):
+		""" Write-through a qc_players row change, drop the entry if it can not be completed from memory """
+		self.index.update(user_id, **fields)
+		self.leaderboard.update(user_id, **fields)
+		row = self.rows.get(user_id)
+		if row is not None:
+			row.update({k: v for k, v in fields.items() if k in self.columns})
+		elif user_id in self.rows and all((c in fields for c in self.columns if c not in ('user_id', 'channel_id', 'is_hidden'))):
+			# the row has just been created, complete it with the table defaults
+			row = dict(self._blank, user_id=user_id, channel_id=self.channel_id)
+			row.update({k: v for k, v in fields.items() if k in self.columns})
+			self.rows[user_id] = row
+		else:
+			self._forget(user_id)
+			return
+		if self._fetching:
+			self._stale.add(user_id)
+
+	def created(self, *user_ids):
+		""" Write-through an INSERT IGNORE of blank rows for given players """
+		for user_id in user_ids:
+			if user_id in self.rows and self.rows[user_id] is None:
+				self.rows[user_id] = dict(self._blank, user_id=user_id, channel_id=self.channel_id)
+
+	def update_all(self, **fields):
+		""" Write-through a change applied to every row of the channel """
+		self.index.update_all(**fields)
+		self.leaderboard.update_all(**fields)
+		for row in self.rows.values():
+			if row is not None:
+				row.update({k: v for k, v in fields.items() if k in self.columns})
+		if self._fetching:
+			self._epoch += 1
+
+	def _forget(self, *user_ids):
+		for user_id in user_ids:
+			self.rows.pop(user_id, None)
+			if self._fetching:
+				self._stale.add(user_id)
+
+	def drop(self, *user_ids):
+		""" Forget given players changed outside of the store, they will be reloaded from the database on next request """
+		self._forget(*user_ids)
+		self.index.invalidate()
+		self.leaderboard.invalidate()
+
+	def clear(self):
+		self.rows.clear()
+		self._epoch += 1
+		self.index.invalidate()
+		self.leaderboard.invalidate()
+
+	async def check(self):
+		""" Compare cached rows with qc_players, returns a list of (user_id, cached, stored) mismatches """
+		# fetchall() is never served by the query cache, the rows must come from the table itself
+		data = iter_to_dict(
+			await db.fetchall(
+				"SELECT {} FROM `{}` WHERE `channel_id`=%s".format(", ".join((f"`{c}`" for c in self.columns)), self.table),
+				(self.channel_id, )
+			), key='user_id'
+		)
+		diff = []
+		for user_id, row in list(self.rows.items()):
+			stored = data.get(user_id)
+			if row is None and stored is None:
+				continue
+			if row is None or stored is None or any((row[c] != stored[c] for c in self.columns)):
+				diff.append((user_id, row, stored))
+		return diff
+
+
+stores = dict()  # {rating channel_id: RatingStore()}
+
+
+def get_store(channel_id):
+	if (store := stores.get(channel_id)) is None:
+		store = stores[channel_id] = RatingStore(channel_id)
+	return store
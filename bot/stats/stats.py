@@ -4,16 +4,21 @@ import datetime
 import asyncio
 import bot
 from core.console import log
-from core.database import db
-from core.utils import iter_to_dict, find, get_nick
+from core.config import cfg
+from core.database import db, writer as db_writer, journal as db_journal
+from core.utils import iter_to_dict, get_nick
+from bot.stats.rating_store import get_store
+from bot.stats.profiles import profiles
 
 # All database table definitions are deferred to initialization
 # to avoid blocking at module import time
 
-async def ensure_tables():
-	"""Initialize all database tables needed for stats module"""
-	
-	await db.ensure_table(dict(
+RATING_COLUMNS = ('rating', 'deviation', 'wins', 'losses', 'draws', 'streak')
+
+def register_tables():
+	"""Register all database tables needed for stats module, they are created by db.reconcile_tables()"""
+
+	db.register_table(dict(
 		tname="players",
 		columns=[
 			dict(cname="user_id", ctype=db.types.int),
@@ -24,7 +29,7 @@ async def ensure_tables():
 		primary_keys=["user_id"]
 	))
 
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="qc_players",
 		columns=[
 			dict(cname="channel_id", ctype=db.types.int),
@@ -42,7 +47,7 @@ async def ensure_tables():
 		primary_keys=["user_id", "channel_id"]
 	))
 
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="qc_rating_history",
 		columns=[
 			dict(cname="id", ctype=db.types.int, autoincrement=True),
@@ -56,10 +61,14 @@ async def ensure_tables():
 			dict(cname="match_id", ctype=db.types.int),
 			dict(cname="reason", ctype=db.types.str)
 		],
-		primary_keys=["id"]
+		primary_keys=["id"],
+		indexes=[
+			dict(iname="user_channel_id", columns=["user_id", "channel_id", "id"]),
+			dict(iname="match_id", columns=["match_id"])
+		]
 	))
 
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="qc_matches",
 		columns=[
 			dict(cname="match_id", ctype=db.types.int),
@@ -75,17 +84,44 @@ async def ensure_tables():
 			dict(cname="beta_score", ctype=db.types.int),
 			dict(cname="maps", ctype=db.types.str)
 		],
-		primary_keys=["match_id"]
+		primary_keys=["match_id"],
+		indexes=[
+			dict(iname="channel_queue", columns=["channel_id", "queue_id"]),
+			dict(iname="channel_at", columns=["channel_id", "at"])
+		]
+	))
+
+	# Daily match counts maintained on match registration and undo, see rollup_ops()
+	db.register_table(dict(
+		tname="qc_match_rollup",
+		columns=[
+			dict(cname="channel_id", ctype=db.types.int),
+			dict(cname="day", ctype=db.types.int),
+			dict(cname="queue_name", ctype=db.types.str),
+			dict(cname="matches", ctype=db.types.int, notnull=True, default=0)
+		],
+		primary_keys=["channel_id", "day", "queue_name"]
+	))
+
+	db.register_table(dict(
+		tname="qc_player_rollup",
+		columns=[
+			dict(cname="channel_id", ctype=db.types.int),
+			dict(cname="day", ctype=db.types.int),
+			dict(cname="user_id", ctype=db.types.int),
+			dict(cname="matches", ctype=db.types.int, notnull=True, default=0)
+		],
+		primary_keys=["channel_id", "day", "user_id"]
 	))
 
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="qc_match_id_counter",
 		columns=[
 			dict(cname="next_id", ctype=db.types.int)
 		]
 	))
 
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="qc_player_matches",
 		columns=[
 			dict(cname="match_id", ctype=db.types.int),
@@ -95,16 +131,14 @@ async def ensure_tables():
 			dict(cname="team", ctype=db.types.bool),
 			dict(cname="is_captain", ctype=db.types.bool, default=0)
 		],
-		primary_keys=["match_id", "user_id"]
+		primary_keys=["match_id", "user_id"],
+		indexes=[
+			dict(iname="channel_user", columns=["channel_id", "user_id"]),
+			dict(iname="channel_captain", columns=["channel_id", "is_captain"])
+		]
 	))
 
-	# Backfill any NULL is_captain values from before the column existed
-	try:
-		await db.execute("UPDATE `qc_player_matches` SET `is_captain` = 0 WHERE `is_captain` IS NULL")
-	except:
-		pass
-
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="disabled_guilds",
 		columns=[
 			dict(cname="guild_id", ctype=db.types.int)
@@ -112,7 +146,7 @@ async def ensure_tables():
 		primary_keys=["guild_id"]
 	))
 
-	await db.ensure_table(dict(
+	db.register_table(dict(
 		tname="season_archive",
 		columns=[
 			dict(cname="id", ctype=db.types.int, autoincrement=True),
@@ -132,6 +166,64 @@ async def ensure_tables():
 	))
 
 
+async def migrate_tables(changed):
+	"""Fix up existing data after db.reconcile_tables() changed given tables"""
+
+	if 'qc_player_matches' in changed:
+		# Backfill any NULL is_captain values from before the column existed
+		try:
+			await db.execute("UPDATE `qc_player_matches` SET `is_captain` = 0 WHERE `is_captain` IS NULL")
+		except:
+			pass
+
+	if 'qc_match_rollup' in changed or 'qc_player_rollup' in changed:
+		await backfill_rollups()
+
+
+DAY = 60 * 60 * 24
+
+
+def rollup_ops(channel_id, queue_name, at, user_ids, matches=1):
+	""" Write ops adding given matches count to the daily rollups of the channel, queue and players """
+	day = at // DAY
+	return [
+		('insert_many', 'qc_match_rollup', [
+			dict(channel_id=channel_id, day=day, queue_name=queue_name or '', matches=matches)
+		], 'add', ['matches']),
+		('insert_many', 'qc_player_rollup', [
+			dict(channel_id=channel_id, day=day, user_id=user_id, matches=matches) for user_id in user_ids
+		], 'add', ['matches'])
+	]
+
+
+async def backfill_rollups(channel_id=None):
+	""" Rebuild the daily rollups from the match history, of all channels by default """
+	log.info(f"Rebuilding daily match rollups for {channel_id or 'all channels'}...")
+	where, args = ("WHERE m.`channel_id`=%s ", (channel_id, )) if channel_id else ("", ())
+	async with db.transaction() as tx:
+		for table in ('qc_match_rollup', 'qc_player_rollup'):
+			if channel_id:
+				await tx.delete(table, where=dict(channel_id=channel_id))
+			else:
+				await tx.execute(f"DELETE FROM `{table}`")
+
+		# the history is aggregated on a separate connection and written in batches
+		async for rows in db.background.stream_batches(
+			f"SELECT m.`channel_id`, (m.`at` - m.`at` % {DAY}) / {DAY} AS `day`, " +
+			"COALESCE(m.`queue_name`, '') AS `queue_name`, COUNT(*) AS `matches` FROM `qc_matches` AS m " +
+			where + "GROUP BY m.`channel_id`, `day`, `queue_name`",
+			args
+		):
+			await tx.insert_many('qc_match_rollup', rows)
+		async for rows in db.background.stream_batches(
+			f"SELECT m.`channel_id`, (m.`at` - m.`at` % {DAY}) / {DAY} AS `day`, pm.`user_id`, COUNT(*) AS `matches` " +
+			"FROM `qc_player_matches` AS pm JOIN `qc_matches` AS m ON pm.`match_id`=m.`match_id` " +
+			where + "GROUP BY m.`channel_id`, `day`, pm.`user_id`",
+			args
+		):
+			await tx.insert_many('qc_player_rollup', rows)
+
+
 async def check_match_id_counter():
 	"""
 	Set to current max match_id+1 if not persist or less
@@ -143,36 +235,50 @@ async def check_match_id_counter():
 		await db.insert('qc_match_id_counter', dict(next_id=next_known_match))
 	elif next_known_match > counter['next_id']:
 		await db.update('qc_match_id_counter', dict(next_id=next_known_match))
+	await match_ids.reserve()
 
 
-async def next_match():
-	""" Increase match_id counter, return current match_id """
-	counter = await db.select_one(('next_id',), 'qc_match_id_counter')
-	await db.update('qc_match_id_counter', dict(next_id=counter['next_id']+1))
-	log.debug(f"Current match_id is {counter['next_id']}")
-	return counter['next_id']
+class MatchIds:
+	"""
+	Hi/lo match_id allocator: blocks of block_size ids are reserved with an atomic increment of
+	qc_match_id_counter, so ids are unique across processes and most matches start without a query.
+	Ids left in the block on exit are skipped.
+	"""
 
+	def __init__(self, block_size=10):
+		self.block_size = block_size
+		self.next_id = 0
+		self.block_end = 0  # first id after the reserved block
+		self.reservations = 0
+		self._lock = asyncio.Lock()
 
-async def register_match_unranked(ctx, m):
-	await db.insert('qc_matches', dict(
-		match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
-		alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
-		at=int(time.time()), ranked=0, winner=None, maps="\n".join(m.maps)
-	))
+	async def reserve(self):
+		async with db.transaction() as tx:
+			await tx.execute("UPDATE `qc_match_id_counter` SET `next_id`=`next_id`+%s", (self.block_size, ))
+			counter = await tx.fetchone("SELECT `next_id` FROM `qc_match_id_counter`")
+		self.next_id, self.block_end = counter['next_id'] - self.block_size, counter['next_id']
+		self.reservations += 1
+		log.debug(f"Reserved match_id block {self.next_id}-{self.block_end - 1}")
 
-	await db.insert_many('qc_players', (
-		dict(channel_id=m.qc.id, user_id=p.id)
-		for p in m.players
-	), on_dublicate="ignore")
+	async def next(self):
+		async with self._lock:
+			if self.next_id >= self.block_end:
+				await self.reserve()
+			self.next_id += 1
+			return self.next_id - 1
 
-	for p in m.players:
-		nick = get_nick(p)
-		await db.update(
-			"qc_players",
-			dict(nick=nick),
-			keys=dict(channel_id=m.qc.id, user_id=p.id)
-		)
 
+match_ids = MatchIds(cfg.MATCH_ID_BLOCK_SIZE)
+
+
+async def next_match():
+	""" Return a new unique match_id """
+	return await match_ids.next()
+
+
+async def register_match_unranked(ctx, m):
+	player_matches = []
+	for p in m.players:
 		if p in m.teams[0]:
 			team = 0
 		elif p in m.teams[1]:
@@ -181,55 +287,50 @@ async def register_match_unranked(ctx, m):
 			team = None
 
 		is_captain = 1 if p in m.captains else 0
-		await db.insert(
-			'qc_player_matches',
-			dict(match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=nick, team=team, is_captain=is_captain)
+		player_matches.append(
+			dict(match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=get_nick(p), team=team, is_captain=is_captain)
 		)
 
-
-async def register_match_ranked(ctx, m):
+	# Journaled if the database is unreachable
 	now = int(time.time())
+	await db_journal.apply(
+		('insert', 'qc_matches', dict(
+			match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
+			alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
+			at=now, ranked=0, winner=None, maps="\n".join(m.maps)
+		)),
+		('insert_many', 'qc_players', [dict(channel_id=m.qc.id, user_id=p.id) for p in m.players], "ignore"),
+		('insert_many', 'qc_player_matches', player_matches),
+		*rollup_ops(m.qc.id, m.queue.name, now, (p.id for p in m.players))
+	)
+	get_store(m.qc.id).created(*(p.id for p in m.players))
+	profiles.add_match(m.qc.id, m.queue.name, (p.id for p in m.players))
+	for pm in player_matches:
+		db_writer.update("qc_players", dict(nick=pm['nick']), keys=dict(channel_id=m.qc.id, user_id=pm['user_id']))
 
-	await db.insert('qc_matches', dict(
-		match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
-		alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
-		at=now, ranked=1, winner=m.winner,
-		alpha_score=m.scores[0], beta_score=m.scores[1], maps="\n".join(m.maps)
-	))
-
-	for channel_id in {m.qc.id, m.qc.rating.channel_id}:
-		await db.insert_many('qc_players', (
-			dict(channel_id=channel_id, user_id=p.id, nick=get_nick(p))
-			for p in m.players
-		), on_dublicate="ignore")
 
-	results = [[
-		await m.qc.rating.get_players((p.id for p in m.teams[0])),
-		await m.qc.rating.get_players((p.id for p in m.teams[1])),
-	]]
+async def register_match_ranked(ctx, m):
+	now = int(time.time())
 
 	# Handle "In Progress" substitutions for rating calculation
 	# For subs marked as "In Progress" who lose, the original player takes the MMR loss
 	alpha_ids = [p.id for p in m.teams[0]]
 	beta_ids = [p.id for p in m.teams[1]]
-	in_progress_subs_by_team = {0: {}, 1: {}}  # {team_idx: {current_player_id: original_player_id}}
-	
-	if m.id in bot.sub_tracking:
-		losing_team_idx = None if m.winner is None else (1 if m.winner == 0 else 0)
-		
-		if losing_team_idx is not None:
-			for sub_id, (original_id, status) in bot.sub_tracking[m.id].items():
-				if status == "In Progress":
-					# Find which team has this sub and if it's the losing team
-					if sub_id in alpha_ids and losing_team_idx == 0:
-						in_progress_subs_by_team[0][sub_id] = original_id
-						alpha_ids[alpha_ids.index(sub_id)] = original_id
-					elif sub_id in beta_ids and losing_team_idx == 1:
-						in_progress_subs_by_team[1][sub_id] = original_id
-						beta_ids[beta_ids.index(sub_id)] = original_id
+	losing_team_idx = None if m.winner is None else (1 if m.winner == 0 else 0)
+	in_progress_subs = {}  # {current_player_id: original_player_id}
+
+	if m.id in bot.sub_tracking and losing_team_idx is not None:
+		for sub_id, (original_id, status) in bot.sub_tracking[m.id].items():
+			if status == "In Progress":
+				# Find which team has this sub and if it's the losing team
+				if sub_id in alpha_ids and losing_team_idx == 0:
+					in_progress_subs[sub_id] = original_id
+					alpha_ids[alpha_ids.index(sub_id)] = original_id
+				elif sub_id in beta_ids and losing_team_idx == 1:
+					in_progress_subs[sub_id] = original_id
+					beta_ids[beta_ids.index(sub_id)] = original_id
 
 	# Build metadata for rating system
-	captains_set = {c.id for c in m.captains} if hasattr(m, 'captains') else set()
 	alpha_meta = {
 		'members': {p.id: p for p in m.teams[0]},
 		'draft_positions': m.draft_positions if hasattr(m, 'draft_positions') else {},
@@ -241,141 +342,66 @@ async def register_match_ranked(ctx, m):
 		'captains': {c.id for c in m.captains if c in m.teams[1]} if hasattr(m, 'captains') else set()
 	}
 
-	# Get ratings for the teams used in calculation (may include original players for In Progress subs)
-	alpha_ratings = await m.qc.rating.get_players(alpha_ids)
-	beta_ratings = await m.qc.rating.get_players(beta_ids)
+	# Fetch ratings for match players and the original players of In Progress subs at once
+	before = iter_to_dict(
+		await m.qc.rating.get_players({*(p.id for p in m.players), *alpha_ids, *beta_ids}), key='user_id'
+	)
+	alpha_ratings = [before[user_id] for user_id in alpha_ids]
+	beta_ratings = [before[user_id] for user_id in beta_ids]
 
 	if m.winner is None:  # draw
 		after = m.qc.rating.rate(winners=alpha_ratings, losers=beta_ratings, draw=True, winner_meta=alpha_meta, loser_meta=beta_meta)
-		results.append(after)
-	else:  # Determine winner based on final match outcome
-		if m.winner == 0:
-			# Team 0 (alpha) won
-			after = m.qc.rating.rate(winners=alpha_ratings, losers=beta_ratings, draw=False, winner_meta=alpha_meta, loser_meta=beta_meta)
-		else:
-			# Team 1 (beta) won  
-			after = m.qc.rating.rate(winners=beta_ratings, losers=alpha_ratings, draw=False, winner_meta=beta_meta, loser_meta=alpha_meta)
-			after = after[::-1]  # Swap back to standard team order
-		results.append(after)
-
-	after = iter_to_dict((*results[-1][0], *results[-1][1]), key='user_id')
-	before = iter_to_dict((*results[0][0], *results[0][1]), key='user_id')
-
-	# For In Progress subs on losing team, add their unchanged rating to the after dict for embed display
-	# Also ensure we have before data for all current match players
-	for p in m.players:
-		if p.id not in before:
-			# Get the before data for this player in case it's missing
-			player_ratings = await m.qc.rating.get_players((p.id,))
-			if player_ratings:
-				before[p.id] = player_ratings[0]
-		
-		# Check if this player is an In Progress sub on losing team
-		if m.id in bot.sub_tracking and p.id in bot.sub_tracking[m.id]:
-			original_id, status = bot.sub_tracking[m.id][p.id]
-			if status == "In Progress":
-				losing_team_idx = None if m.winner is None else (1 if m.winner == 0 else 0)
-				team_idx = 0 if p in m.teams[0] else 1
-				if team_idx == losing_team_idx:
-					# This is an In Progress sub on losing team - they keep their unchanged rating in the embed
-					if p.id not in after:
-						after[p.id] = before[p.id]
-
-	# Process all match players
+	elif m.winner == 0:
+		# Team 0 (alpha) won
+		after = m.qc.rating.rate(winners=alpha_ratings, losers=beta_ratings, draw=False, winner_meta=alpha_meta, loser_meta=beta_meta)
+	else:
+		# Team 1 (beta) won
+		after = m.qc.rating.rate(winners=beta_ratings, losers=alpha_ratings, draw=False, winner_meta=beta_meta, loser_meta=alpha_meta)
+		after = after[::-1]  # Swap back to standard team order
+	after = iter_to_dict((*after[0], *after[1]), key='user_id')
+
+	players, player_matches, history = [], [], []
 	for p in m.players:
 		nick = get_nick(p)
 		team = 0 if p in m.teams[0] else 1
 		is_captain = 1 if p in m.captains else 0
+		original_id = in_progress_subs.get(p.id)
 
-		# Check if this player was a sub with In Progress status on the losing team
-		is_in_progress_sub = False
-		original_id = None
-		if m.id in bot.sub_tracking and p.id in bot.sub_tracking[m.id]:
-			original_id, status = bot.sub_tracking[m.id][p.id]
-			if status == "In Progress":
-				# Determine if this was the losing team
-				losing_team_idx = None if m.winner is None else (1 if m.winner == 0 else 0)
-				if team == losing_team_idx:
-					is_in_progress_sub = True
-
-		# For In Progress subs on losing team: keep their rating unchanged
-		if is_in_progress_sub:
-			current_rating = before[p.id]['rating']
-			await db.update(
-				"qc_players",
-				dict(
-					nick=nick,
-					rating=current_rating,
-					deviation=before[p.id]['deviation'],
-					wins=before[p.id]['wins'],
-					losses=before[p.id]['losses'],
-					draws=before[p.id]['draws'],
-					streak=before[p.id]['streak'],
-					last_ranked_match_at=now,
-				),
-				keys=dict(channel_id=m.qc.rating.channel_id, user_id=p.id)
-			)
-			rating_change = 0
+		if original_id is not None:
+			# In Progress sub on losing team: keep their rating unchanged, also in the embed
+			rating_data = after[p.id] = before[p.id]
 		else:
 			# Normal flow: apply calculated rating change
 			rating_data = after.get(p.id, before[p.id])
-			await db.update(
-				"qc_players",
-				dict(
-					nick=nick,
-					rating=rating_data['rating'],
-					deviation=rating_data['deviation'],
-					wins=rating_data['wins'],
-					losses=rating_data['losses'],
-					draws=rating_data['draws'],
-					streak=rating_data['streak'],
-					last_ranked_match_at=now,
-				),
-				keys=dict(channel_id=m.qc.rating.channel_id, user_id=p.id)
-			)
-			rating_change = rating_data['rating'] - before[p.id]['rating']
 
-		try:
-			await db.insert(
-				'qc_player_matches',
-				dict(match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=nick, team=team, is_captain=is_captain)
-			)
-		except Exception:
-			pass
-		
-		await db.insert('qc_rating_history', dict(
+		players.append(dict(
+			channel_id=m.qc.rating.channel_id, user_id=p.id, nick=nick,
+			**{k: rating_data[k] for k in RATING_COLUMNS}, last_ranked_match_at=now
+		))
+		player_matches.append(dict(
+			match_id=m.id, channel_id=m.qc.id, user_id=p.id, nick=nick, team=team, is_captain=is_captain
+		))
+		history.append(dict(
 			channel_id=m.qc.rating.channel_id,
 			user_id=p.id,
 			at=now,
 			rating_before=before[p.id]['rating'],
-			rating_change=rating_change,
+			rating_change=rating_data['rating'] - before[p.id]['rating'],
 			deviation_before=before[p.id]['deviation'],
-			deviation_change=0 if is_in_progress_sub else (after.get(p.id, before[p.id])['deviation']-before[p.id]['deviation']),
+			deviation_change=rating_data['deviation'] - before[p.id]['deviation'],
 			match_id=m.id,
 			reason=m.queue.name
 		))
-		
+
 		# Also update the original player's rating if this was an In Progress sub applying loss to them
-		if is_in_progress_sub and original_id and original_id in after:
+		if original_id is not None and original_id in after:
 			original_before = before[original_id]
 			original_after = after[original_id]
-			
-			await db.update(
-				"qc_players",
-				dict(
-					nick=get_nick(p),
-					rating=original_after['rating'],
-					deviation=original_after['deviation'],
-					wins=original_after['wins'],
-					losses=original_after['losses'],
-					draws=original_after['draws'],
-					streak=original_after['streak'],
-					last_ranked_match_at=now,
-				),
-				keys=dict(channel_id=m.qc.rating.channel_id, user_id=original_id)
-			)
-			
-			await db.insert('qc_rating_history', dict(
+			players.append(dict(
+				channel_id=m.qc.rating.channel_id, user_id=original_id, nick=nick,
+				**{k: original_after[k] for k in RATING_COLUMNS}, last_ranked_match_at=now
+			))
+			history.append(dict(
 				channel_id=m.qc.rating.channel_id,
 				user_id=original_id,
 				at=now,
@@ -387,170 +413,230 @@ async def register_match_ranked(ctx, m):
 				reason=f"{m.queue.name} (substitute)"
 			))
 
+	# Written in a single transaction, journaled if the database is unreachable
+	ops = [('insert', 'qc_matches', dict(
+		match_id=m.id, channel_id=m.qc.id, queue_id=m.queue.cfg.p_key, queue_name=m.queue.name,
+		alpha_name=m.teams[0].name, beta_name=m.teams[1].name,
+		at=now, ranked=1, winner=m.winner,
+		alpha_score=m.scores[0], beta_score=m.scores[1], maps="\n".join(m.maps)
+	))]
+	if m.qc.id != m.qc.rating.channel_id:
+		ops.append(('insert_many', 'qc_players', [
+			dict(channel_id=m.qc.id, user_id=p.id, nick=get_nick(p))
+			for p in m.players
+		], "ignore"))
+	ops += [
+		('insert_many', 'qc_players', players, "update"),
+		('insert_many', 'qc_player_matches', player_matches, "ignore"),
+		('insert_many', 'qc_rating_history', history),
+		*rollup_ops(m.qc.id, m.queue.name, now, (p.id for p in m.players))
+	]
+	await db_journal.apply(*ops)
+
+	get_store(m.qc.id).created(*(p.id for p in m.players))
+	profiles.add_match(m.qc.id, m.queue.name, (p.id for p in m.players))
+	profiles.add_history(history)
+	for p in players:
+		m.qc.rating.store.update(
+			p['user_id'], **{k: p[k] for k in RATING_COLUMNS}, nick=p['nick'], last_ranked_match_at=now
+		)
+
 	await m.qc.update_rating_roles(*m.players)
 	await m.print_rating_results(ctx, before, after)
 
 
 async def undo_match(ctx, match_id):
-	match = await db.select_one(('ranked', 'winner'), 'qc_matches', where=dict(match_id=match_id, channel_id=ctx.qc.id))
-	if not match:
-		return False
-
-	if match['ranked']:
-		p_matches = await db.select(('user_id', 'team'), 'qc_player_matches', where=dict(match_id=match_id))
-		p_history = iter_to_dict(
-			await db.select(
-				('user_id', 'rating_change', 'deviation_change'), 'qc_rating_history', where=dict(match_id=match_id)
-			), key='user_id'
-		)
-		stats = iter_to_dict(
-			await ctx.qc.rating.get_players((p['user_id'] for p in p_matches)), key='user_id'
+	async with db.transaction() as tx:
+		match = await tx.select_one(
+			('ranked', 'winner', 'queue_name', 'at'), 'qc_matches', where=dict(match_id=match_id, channel_id=ctx.qc.id)
 		)
+		if not match:
+			return False
+
+		p_matches = await tx.select(('user_id', 'team'), 'qc_player_matches', where=dict(match_id=match_id))
+		if match['ranked']:
+			p_history = iter_to_dict(
+				await tx.select(
+					('user_id', 'rating_change', 'deviation_change'), 'qc_rating_history', where=dict(match_id=match_id)
+				), key='user_id'
+			)
+			stats = iter_to_dict(
+				await ctx.qc.rating.get_players((p['user_id'] for p in p_matches)), key='user_id'
+			)
 
-		for p in p_matches:
-			new = stats[p['user_id']]
-			changes = p_history[p['user_id']]
+			for p in p_matches:
+				new = stats[p['user_id']]
+				changes = p_history[p['user_id']]
 
-			print(match['winner'])
-			if match['winner'] is None:
-				new['draws'] = max((new['draws'] - 1, 0))
-			elif match['winner'] == p['team']:
-				new['wins'] = max((new['wins'] - 1, 0))
-			else:
-				new['losses'] = max((new['losses'] - 1, 0))
+				if match['winner'] is None:
+					new['draws'] = max((new['draws'] - 1, 0))
+				elif match['winner'] == p['team']:
+					new['wins'] = max((new['wins'] - 1, 0))
+				else:
+					new['losses'] = max((new['losses'] - 1, 0))
+
+				new['rating'] = max((new['rating']-changes['rating_change'], 0))
+				new['deviation'] = max((new['deviation']-changes['deviation_change'], 0))
 
-			new['rating'] = max((new['rating']-changes['rating_change'], 0))
-			new['deviation'] = max((new['deviation']-changes['deviation_change'], 0))
+				await tx.update("qc_players", new, keys=dict(channel_id=ctx.qc.rating.channel_id, user_id=p['user_id']))
+				tx.on_commit(ctx.qc.rating.store.update, p['user_id'], **{k: new[k] for k in RATING_COLUMNS})
+			await tx.delete("qc_rating_history", where=dict(match_id=match_id))
 
-			await db.update("qc_players", new, keys=dict(channel_id=ctx.qc.rating.channel_id, user_id=p['user_id']))
-		await db.delete("qc_rating_history", where=dict(match_id=match_id))
+		await tx.delete('qc_player_matches', where=dict(match_id=match_id))
+		await tx.delete('qc_matches', where=dict(match_id=match_id))
+		for method, table, *args in rollup_ops(
+			ctx.qc.id, match['queue_name'], match['at'], (p['user_id'] for p in p_matches), matches=-1
+		):
+			await getattr(tx, method)(table, *args)
+
+	profiles.drop(ctx.qc.id, *(p['user_id'] for p in p_matches))
+	if ctx.qc.rating.channel_id != ctx.qc.id:
+		profiles.drop(ctx.qc.rating.channel_id, *(p['user_id'] for p in p_matches))
+
+	if match['ranked']:
 		members = (ctx.channel.guild.get_member(p['user_id']) for p in p_matches)
 		await ctx.qc.update_rating_roles(*(m for m in members if m is not None))
-
-	await db.delete('qc_player_matches', where=dict(match_id=match_id))
-	await db.delete('qc_matches', where=dict(match_id=match_id))
 	return True
 
 
 async def reset_channel(channel_id):
 	where = {'channel_id': channel_id}
-	await db.delete("qc_players", where=where)
-	await db.delete("qc_rating_history", where=where)
-	await db.delete("qc_matches", where=where)
-	await db.delete("qc_player_matches", where=where)
+	async with db.transaction() as tx:
+		await tx.delete("qc_players", where=where)
+		await tx.delete("qc_rating_history", where=where)
+		await tx.delete("qc_matches", where=where)
+		await tx.delete("qc_player_matches", where=where)
+		await tx.delete("qc_match_rollup", where=where)
+		await tx.delete("qc_player_rollup", where=where)
+	get_store(channel_id).clear()
+	profiles.drop_channel(channel_id)
 
 
 async def reset_player(channel_id, user_id):
 	where = {'channel_id': channel_id, 'user_id': user_id}
-	await db.delete("qc_players", where=where)
-	await db.delete("qc_rating_history", where=where)
-	await db.delete("qc_player_matches", where=where)
+	async with db.transaction() as tx:
+		await tx.delete("qc_players", where=where)
+		await tx.delete("qc_rating_history", where=where)
+		await tx.delete("qc_player_matches", where=where)
+		await tx.delete("qc_player_rollup", where=where)
+	get_store(channel_id).drop(user_id)
+	profiles.drop(channel_id, user_id)
 
 
 async def replace_player(channel_id, user_id1, user_id2, new_nick):
-	await db.delete("qc_players", {'channel_id': channel_id, 'user_id': user_id2})
 	where = {'channel_id': channel_id, 'user_id': user_id1}
-	await db.update("qc_players", {'user_id': user_id2, 'nick': new_nick}, where)
-	await db.update("qc_rating_history", {'user_id': user_id2}, where)
-	await db.update("qc_player_matches", {'user_id': user_id2}, where)
-
-
-async def archive_season(channel_id):
+	async with db.transaction() as tx:
+		await tx.delete("qc_players", {'channel_id': channel_id, 'user_id': user_id2})
+		await tx.update("qc_players", {'user_id': user_id2, 'nick': new_nick}, where)
+		await tx.update("qc_rating_history", {'user_id': user_id2}, where)
+		await tx.update("qc_player_matches", {'user_id': user_id2}, where)
+		# the rollups are merged as the new player may have played matches already
+		rollups = await tx.select(('day', 'matches'), 'qc_player_rollup', where)
+		await tx.delete("qc_player_rollup", where)
+		await tx.insert_many("qc_player_rollup", (
+			dict(channel_id=channel_id, day=r['day'], user_id=user_id2, matches=r['matches']) for r in rollups
+		), 'add', ('matches', ))
+	get_store(channel_id).drop(user_id1, user_id2)
+	profiles.drop(channel_id, user_id1, user_id2)
+
+
+async def archive_season(channel_id, tx=None):
 	"""Archive current season data and return season summary."""
 	now = int(time.time())
 
-	# Determine season number
-	last_season = await db.fetchone(
-		"SELECT MAX(season_number) as num FROM `season_archive` WHERE `channel_id`=%s",
-		(channel_id,)
-	)
-	season_number = (last_season['num'] or 0) + 1 if last_season else 1
-
-	# Get all rated players sorted by rating
-	players = await db.select(
-		['user_id', 'nick', 'rating', 'deviation', 'wins', 'losses', 'draws', 'is_hidden'],
-		'qc_players',
-		where={'channel_id': channel_id}, order_by='rating'
-	)
-	rated = [p for p in players if p['rating'] is not None and not p['is_hidden']]
-
-	# Archive each player's final standings
-	archive_rows = []
-	for place, p in enumerate(rated, 1):
-		archive_rows.append(dict(
-			channel_id=channel_id,
-			season_number=season_number,
-			ended_at=now,
-			user_id=p['user_id'],
-			nick=p['nick'] or '?',
-			rating=p['rating'],
-			deviation=p['deviation'],
-			wins=p['wins'],
-			losses=p['losses'],
-			draws=p['draws'],
-			place=place
-		))
-	if archive_rows:
-		await db.insert_many('season_archive', archive_rows)
-
-	# Top 12 with minimum 20 games played
-	qualified = [p for p in rated if (p['wins'] + p['losses'] + p['draws']) >= 20]
+	async with (tx or db.background).transaction() as tx:
+		# Determine season number
+		last_season = await tx.fetchone(
+			"SELECT MAX(season_number) as num FROM `season_archive` WHERE `channel_id`=%s",
+			(channel_id,)
+		)
+		season_number = (last_season['num'] or 0) + 1 if last_season else 1
+
+		# Stream all rated players sorted by rating and archive their final standings in batches
+		place, games, qualified = 0, 0, []
+		async for rated in tx.stream_batches(
+			"SELECT `user_id`, `nick`, `rating`, `deviation`, `wins`, `losses`, `draws` FROM `qc_players` " +
+			"WHERE `channel_id`=%s AND `rating` IS NOT NULL AND NOT COALESCE(`is_hidden`, 0) ORDER BY `rating` DESC",
+			(channel_id, )
+		):
+			archive_rows = []
+			for p in rated:
+				place += 1
+				games += p['wins'] + p['losses'] + p['draws']
+				# Top 12 with minimum 20 games played
+				if len(qualified) < 12 and (p['wins'] + p['losses'] + p['draws']) >= 20:
+					qualified.append(p)
+				archive_rows.append(dict(
+					channel_id=channel_id,
+					season_number=season_number,
+					ended_at=now,
+					user_id=p['user_id'],
+					nick=p['nick'] or '?',
+					rating=p['rating'],
+					deviation=p['deviation'],
+					wins=p['wins'],
+					losses=p['losses'],
+					draws=p['draws'],
+					place=place
+				))
+			await tx.insert_many('season_archive', archive_rows)
 
 	return {
 		'season_number': season_number,
-		'total_players': len(rated),
-		'top_players': qualified[:12],
-		'total_matches': sum(p['wins'] + p['losses'] + p['draws'] for p in rated) // 2
+		'total_players': place,
+		'top_players': qualified,
+		'total_matches': games // 2
 	}
 
 
 async def qc_stats(channel_id):
-	data = await db.fetchall(
-		"SELECT `queue_name`, COUNT(*) as count FROM `qc_matches` WHERE `channel_id`=%s " +
-		"GROUP BY `queue_name` ORDER BY count DESC",
+	data = await db.read.fetchall(
+		"SELECT `queue_name`, SUM(`matches`) as count FROM `qc_match_rollup` WHERE `channel_id`=%s " +
+		"GROUP BY `queue_name` HAVING SUM(`matches`) > 0 ORDER BY count DESC",
 		(channel_id,)
 	)
+	data = [dict(queue_name=i['queue_name'], count=int(i['count'])) for i in data]
 	stats = dict(total=sum((i['count'] for i in data)))
 	stats['queues'] = data
 	return stats
 
 
 async def user_stats(channel_id, user_id):
-	data = await db.fetchall(
-		"SELECT `queue_name`, COUNT(*) as count FROM `qc_player_matches` AS pm " +
-		"JOIN `qc_matches` AS m ON pm.match_id=m.match_id " +
-		"WHERE pm.channel_id=%s AND user_id=%s " +
-		"GROUP BY m.queue_name ORDER BY count DESC",
-		(channel_id, user_id)
-	)
-	stats = dict(total=sum((i['count'] for i in data)))
-	stats['queues'] = data
-	return stats
+	return await profiles.match_counts(channel_id, user_id)
 
 
 async def top(channel_id, time_gap=None):
-	total = await db.fetchone(
-		"SELECT COUNT(*) as count FROM `qc_matches` WHERE channel_id=%s" + (f" AND at>{time_gap} " if time_gap else ""),
-		(channel_id, )
+	# whole days are summed from the rollups, the matches of the partial first day are counted from the history
+	first_day = time_gap // DAY + 1 if time_gap else 0
+	partial = (time_gap, first_day * DAY) if time_gap else (0, 0)
+
+	total = await db.read.fetchone(
+		"SELECT (SELECT COALESCE(SUM(`matches`), 0) FROM `qc_match_rollup` WHERE `channel_id`=%s AND `day`>=%s) + " +
+		"(SELECT COUNT(*) FROM `qc_matches` WHERE `channel_id`=%s AND `at`>%s AND `at`<%s) AS count",
+		(channel_id, first_day, channel_id, *partial)
 	)
 
-	data = await db.fetchall(
-		"SELECT p.nick as nick, COUNT(*) as count FROM `qc_player_matches` AS pm " +
-		"JOIN `qc_players` AS p ON pm.user_id=p.user_id AND pm.channel_id=p.channel_id " +
-		"JOIN `qc_matches` AS m ON pm.match_id=m.match_id " +
-		"WHERE pm.channel_id=%s " +
-		(f"AND m.at>{time_gap} " if time_gap else "") +
-		"GROUP BY p.user_id ORDER BY count DESC LIMIT 10",
-		(channel_id, )
+	data = await db.read.fetchall(
+		"SELECT p.nick as nick, SUM(t.matches) as count FROM (" +
+		"  SELECT `user_id`, `matches` FROM `qc_player_rollup` WHERE `channel_id`=%s AND `day`>=%s" +
+		"  UNION ALL" +
+		"  SELECT pm.user_id, 1 AS matches FROM `qc_matches` AS m" +
+		"  JOIN `qc_player_matches` AS pm ON pm.match_id=m.match_id" +
+		"  WHERE m.channel_id=%s AND m.at>%s AND m.at<%s" +
+		") AS t " +
+		"JOIN `qc_players` AS p ON t.user_id=p.user_id AND p.channel_id=%s " +
+		"GROUP BY p.user_id HAVING SUM(t.matches) > 0 ORDER BY count DESC LIMIT 10",
+		(channel_id, first_day, channel_id, *partial, channel_id)
 	)
-	stats = dict(total=total['count'])
-	stats['players'] = data
+	stats = dict(total=int(total['count']))
+	stats['players'] = [dict(nick=i['nick'], count=int(i['count'])) for i in data]
 	return stats
 
 
-async def last_games(channel_id):
-	#  get last played ranked match for all players
-	data = await db.fetchall(
+def last_games(channel_id, batch=None):
+	#  stream last played ranked match for all players in batches, a heavy query for the weekly decay job
+	#  the job writes the ratings back, so they are read from the primary and not from a lagging replica
+	return db.background.stream_batches(
 		"SELECT tmp.at, p.* " +
 		"FROM `qc_players` AS p " +
 		"LEFT JOIN (" +
@@ -559,9 +645,8 @@ async def last_games(channel_id):
 		"    GROUP BY h.user_id" +
 		") AS tmp ON p.user_id=tmp.user_id " +
 		"WHERE p.channel_id=%s",
-		(channel_id, channel_id)
+		(channel_id, channel_id), batch
 	)
-	return data
 
 
 class StatsJobs:
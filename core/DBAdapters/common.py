@@ -1,4 +1,10 @@
 # -*- coding: utf-8 -*-
+import re
+import os
+import sys
+import json
+import time
+from collections import deque
 from itertools import chain
 
 
@@ -44,3 +50,93 @@ class Errors:
 	OperationalError = OperationalError
 	IntegrityError = IntegrityError
 	ProgrammingError = ProgrammingError
+
+
+class QueryStats:
+	"""
+	Per SQL template call counts, rows and latencies of the adapter queries.
+	Queries slower than slow_query_ms are logged along with the bot function that issued them.
+	"""
+
+	samples_size = 1000  # latencies kept per template for the percentiles
+	_re_values = re.compile(r"(\((?:%s|\?)(?:, (?:%s|\?))*\))(?:, \1)+")
+	_re_in = re.compile(r"IN \((?:%s|\?)(?:, ?(?:%s|\?))*\)", re.IGNORECASE)
+	_re_literals = re.compile(r"(?<![\w`])(?:\d+(?:\.\d+)?|'[^']*')")
+	_re_spaces = re.compile(r"\s+")
+
+	def __init__(self, slow_query_ms=200):
+		self.slow_query_ms = slow_query_ms
+		self.templates = dict()  # {template: dict(calls, rows, errors, total, max, samples)}
+		self.since = time.time()
+		self._normalized = dict()  # {sql text: template}
+
+	def normalize(self, request):
+		""" Collapse whitespace, placeholder lists, multi-row values and inlined literals of a query """
+		if (template := self._normalized.get(request)) is None:
+			template = self._re_spaces.sub(" ", request).strip()
+			template = self._re_values.sub(r"\1, ...", template)
+			template = self._re_in.sub("IN (...)", template)
+			template = self._re_literals.sub("?", template)
+			if len(self._normalized) < 10000:
+				self._normalized[request] = template
+		return template
+
+	@staticmethod
+	def caller():
+		""" Return 'module.function:line' of the first frame outside the database code """
+		frame = sys._getframe(2)
+		while frame is not None:
+			path = frame.f_code.co_filename
+			if not (
+				os.path.join('core', 'DBAdapters') in path or path.endswith(os.path.join('core', 'database.py'))
+				or path.endswith('contextlib.py')
+			):
+				return "{}.{}:{}".format(frame.f_globals.get('__name__'), frame.f_code.co_name, frame.f_lineno)
+			frame = frame.f_back
+		return "unknown"
+
+	def record(self, request, duration, rows=0, error=False):
+		template = self.normalize(request)
+		if (t := self.templates.get(template)) is None:
+			t = self.templates[template] = dict(
+				calls=0, rows=0, errors=0, total=0.0, max=0.0, samples=deque(maxlen=self.samples_size)
+			)
+		t['calls'] += 1
+		t['rows'] += rows or 0
+		t['errors'] += error
+		t['total'] += duration
+		t['max'] = max(t['max'], duration)
+		t['samples'].append(duration)
+
+		if self.slow_query_ms and duration * 1000 >= self.slow_query_ms:
+			from core.console import log
+			log.warning("Slow query ({:.0f}ms) from {}: {}".format(duration * 1000, self.caller(), template[:300]))
+
+	@staticmethod
+	def _percentile(samples, p):
+		return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+	def summary(self, order_by='total', limit=None):
+		""" Return aggregates per template as a list of dicts, latencies in milliseconds """
+		results = []
+		for template, t in self.templates.items():
+			samples = sorted(t['samples'])
+			results.append(dict(
+				template=template, calls=t['calls'], rows=t['rows'], errors=t['errors'],
+				total=t['total'] * 1000, avg=t['total'] * 1000 / t['calls'], max=t['max'] * 1000,
+				p50=self._percentile(samples, 0.5) * 1000,
+				p95=self._percentile(samples, 0.95) * 1000,
+				p99=self._percentile(samples, 0.99) * 1000
+			))
+		results.sort(key=lambda i: i[order_by], reverse=True)
+		return results[:limit] if limit else results
+
+	def dump(self, path):
+		""" Write the aggregates to a json file for offline analysis """
+		with open(path, 'w') as f:
+			json.dump(dict(since=self.since, at=time.time(), templates=self.summary()), f, indent=2)
+		return path
+
+	def reset(self):
+		self.templates.clear()
+		self.since = time.time()
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
+import time
+import json
+import random
 import asyncio
+from collections import deque
+from hashlib import sha1
+from itertools import islice
+from functools import lru_cache
+from contextlib import asynccontextmanager, aclosing
 import aiomysql
 from pymysql import err as mysqlErr
 from .common import *
 
 from core.console import log
+from core.config import cfg
 
 
 class Types:
@@ -23,20 +32,200 @@ reference_options = dict(
 	SET_DEFAULT='SET DEFAULT'
 )
 
-table_blank = dict(tname=None, columns=[], primary_keys=[], foreign_keys=[])
+table_blank = dict(tname=None, columns=[], primary_keys=[], foreign_keys=[], indexes=[])
 column_blank = dict(cname=None, ctype=Types.str, notnull=False, unique=False, autoincrement=False, default=None)
 fkey_blank = dict(cname=None, refTable=None, refColumn=None, on_delete=None, on_update=None)
+index_blank = dict(iname=None, columns=[], unique=False)
 
 
-class Adapter:
+class Queries:
+	""" Query builders shared by the Adapter and its Transaction objects """
+
+	insert_chunk_size = 1000  # max rows per multi-row statement in insert_many()
+	sql_cache_size = 512  # max memoized SQL texts per query builder
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _mysql_insert(columns, table, on_dublicate, update_columns=None, rows=1):
+		return "{action}{ignore} INTO {table} ({columns}) VALUES{values}{update}".format(
+			action="REPLACE" if on_dublicate == 'replace' else "INSERT",
+			ignore=" IGNORE" if on_dublicate == 'ignore' else "",
+			table=table,
+			columns=", ".join((f"`{i}`" for i in columns)),
+			values=", ".join(["(" + ", ".join(('%s' for i in range(len(columns)))) + ")"] * rows),
+			update=" ON DUPLICATE KEY UPDATE " + ", ".join(
+				(f"`{i}`=VALUES(`{i}`)" for i in (update_columns or columns))
+			) if on_dublicate == 'update' else " ON DUPLICATE KEY UPDATE " + ", ".join(
+				(f"`{i}`=`{i}`+VALUES(`{i}`)" for i in update_columns)
+			) if on_dublicate == 'add' else ""
+		)
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _mysql_update(table, columns, keys):
+		where = " WHERE {}".format(" AND ".join(["`{}`=%s".format(i) for i in keys])) if len(keys) else ""
+		return "UPDATE {table} SET {columns}{where}".format(
+			table=table,
+			columns=",".join(["`{}`=%s".format(i) for i in columns]),
+			where=where
+		)
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _mysql_select(columns, table, keys, order_by, order_asc, limit):
+		# fix queries where there are some restricted words, for example in MySQL 8 'rank' is restricted
+		sql_restricted_words = [
+				'rank',
+				'role',
+				'data',
+		]
+		columns = [f"`{col}`" if col in sql_restricted_words else col for col in columns]
+
+		return "SELECT {columns} FROM `{table}`{where}{order}{limit}".format(
+			columns=', '.join(columns),
+			table=table,
+			where=" WHERE " + " AND ".join(("`{}`=%s".format(k) for k in keys)) if len(keys) else '',
+			order=" ORDER BY "+order_by+(" ASC" if order_asc else " DESC") if order_by else "",
+			limit=(" LIMIT " + str(limit)) if limit else ""
+		)
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _mysql_delete(table, keys):
+		where = " WHERE " + " AND ".join(("`{}`=%s".format(k) for k in keys)) if len(keys) else ''
+		return "DELETE FROM {}{}".format(table, where)
+
+	@classmethod
+	def sql_cache_info(cls):
+		""" Return {builder: (hits, misses, size)} of the memoized SQL texts """
+		return {
+			name: (info.hits, info.misses, info.currsize) for name, info in (
+				(f.__name__, f.cache_info()) for f in (
+					cls._mysql_select, cls._mysql_insert, cls._mysql_update, cls._mysql_delete
+				)
+			)
+		}
+
+	async def _query(self, cur, args, many=False, fetch=None):
+		""" Run a query on the cursor and record it in query_stats """
+		start = time.perf_counter()
+		try:
+			if many:
+				await cur.executemany(*args)
+			else:
+				await cur.execute(*args)
+			if fetch == 'one':
+				result = await cur.fetchone()
+				rows = int(result is not None)
+			elif fetch == 'all':
+				result = await cur.fetchall()
+				rows = len(result)
+			else:
+				result = cur.lastrowid
+				rows = cur.rowcount
+		except Exception as e:
+			self.query_stats.record(args[0], time.perf_counter() - start, error=True)
+			Adapter.wrap_exc(e)
+		self.query_stats.record(args[0], time.perf_counter() - start, rows)
+		return result
+
+	async def select(self, columns, table, where=None, order_by=None, order_asc=False, limit=None, one=False):
+		args = list(where.values()) if where else ()
+		request = self._mysql_select(
+			tuple(columns), table, tuple(where.keys()) if where else (), order_by, order_asc, limit
+		)
+
+		if one:
+			return await self.fetchone(request, args)
+		else:
+			return await self.fetchall(request, args)
+
+	async def select_one(self, *args, **kwargs):
+		return await self.select(*args, **kwargs, one=True)
+
+	async def delete(self, table, where=None):
+		args = list(where.values()) if where else ()
+		await self.execute(self._mysql_delete(table, tuple(where.keys()) if where else ()), args)
+
+	async def insert(self, table, d, on_dublicate=None):
+		request = self._mysql_insert(tuple(d.keys()), table, on_dublicate)
+		return await self.execute(request, list(d.values()))
+
+	async def update(self, table, d, keys=None):
+		keys = keys or {}
+		request = self._mysql_update(table, tuple(d.keys()), tuple(keys.keys()))
+		await self.execute(request, list(d.values()) + list(keys.values()))
+
+	async def insert_many(self, table, it, on_dublicate=None, update_columns=None, chunk_size=None):
+		"""
+		Insert rows with the same keys. With on_dublicate='update' rows are sent as chunked multi-row
+		INSERT ... ON DUPLICATE KEY UPDATE statements, updating only update_columns (all columns by default).
+		With on_dublicate='add' the values of update_columns are added to the existing ones instead.
+		"""
+		try:
+			first, it = peek(iter(it))
+		except StopIteration:
+			return
+
+		if on_dublicate not in ('update', 'add'):
+			request = self._mysql_insert(tuple(first.keys()), table, on_dublicate)
+			await self.executemany(request, (list(d.values()) for d in it))
+			return
+
+		columns = tuple(first.keys())
+		chunk_size = chunk_size or self.insert_chunk_size
+		while len(chunk := list(islice(it, chunk_size))):
+			request = self._mysql_insert(columns, table, on_dublicate, tuple(update_columns or ()), rows=len(chunk))
+			await self.execute(request, [d[c] for d in chunk for c in columns])
+
+
+class PoolStats:
+	""" Connection pool saturation counters: acquire latency, waiters, timeouts, reconnects and retries """
+
+	samples_size = 1000
+
+	def __init__(self):
+		self.acquires = 0
+		self.waiters = 0
+		self.max_waiters = 0
+		self.timeouts = 0
+		self.reconnects = 0
+		self.retries = 0
+		self.acquire_total = 0.0
+		self.acquire_samples = deque(maxlen=self.samples_size)
+
+	def summary(self):
+		samples = sorted(self.acquire_samples) or [0]
+		return dict(
+			acquires=self.acquires, waiters=self.waiters, max_waiters=self.max_waiters, timeouts=self.timeouts,
+			reconnects=self.reconnects, retries=self.retries,
+			acquire_avg=self.acquire_total * 1000 / max(1, self.acquires),
+			acquire_p95=samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+			acquire_max=samples[-1] * 1000
+		)
+
+
+class Adapter(Queries):
 	pool: aiomysql.Pool
 	loop: asyncio.AbstractEventLoop
 	types = Types
 	errors = Errors
 
-	def __init__(self, db_address):
+	schema_table = "db_schema"
+	stream_batch_size = 1000  # default rows per batch in stream()
+	# client connection errors (CR_CONNECTION_ERROR, CR_CONN_HOST_ERROR, CR_SERVER_GONE_ERROR, CR_SERVER_LOST),
+	# lock wait timeout and deadlock, the other OperationalError numbers are not fixed by a retry
+	transient_errnos = (2002, 2003, 2006, 2013, 1205, 1213)
+
+	def __init__(self, db_address, workload='interactive'):
 		self.pool = None
 		self.dbAddress = db_address
+		self.workload = workload
+		self.query_stats = QueryStats()
+		self.pool_stats = PoolStats()
+		self.tables = dict()  # {tname: table definition} to be ensured by reconcile_tables()
+		self._checksums = None  # {tname: (checksum, duration)} from the schema table
+		self._reconciled = dict()  # {tname: checksum} of the tables reconciled by this process
 		try:
 			self.dbUser, db_address = db_address.split(':', 1)
 			self.dbPassword, db_address = db_address.split('@', 1)
@@ -48,17 +237,28 @@ class Adapter:
 		except Exception:
 			raise(ValueError('Bad database address string: ' + self.dbAddress))
 
+		# Heavy jobs use db.background with its own smaller pool, so they do not stall the user commands
+		if workload == 'interactive':
+			self.background = Adapter(self.dbAddress, workload='background')
+			self.background.query_stats = self.query_stats
+		else:
+			self.background = self
+
 	async def connect(self):
 		self.loop = asyncio.get_running_loop()
 		try:
 			self.pool = await asyncio.wait_for(
 				aiomysql.create_pool(
 					host=self.dbHost,
+					port=int(self.dbPort),
 					user=self.dbUser,
 					password=self.dbPassword,
 					db=self.dbName,
 					charset='utf8mb4',
 					autocommit=True,
+					minsize=cfg.DB_POOL_MIN if self.workload != 'background' else 0,
+					maxsize=cfg.DB_POOL_MAX if self.workload != 'background' else cfg.DB_BG_POOL_MAX,
+					pool_recycle=cfg.DB_POOL_RECYCLE,
 					cursorclass=aiomysql.cursors.DictCursor),
 				timeout=10)
 
@@ -66,41 +266,139 @@ class Adapter:
 			raise Exception(f"Database connection timeout after 10 seconds. Check DATABASE_URL and network connectivity.")
 		except mysqlErr.Error as e:
 			self.wrap_exc(e)
+		if self.background is not self:
+			await self.background.connect()
+
+	@asynccontextmanager
+	async def acquire(self):
+		""" Acquire a pool connection with a timeout, ping it first if it has been idle for a while """
+		stats = self.pool_stats
+		waiting = not self.pool.freesize and self.pool.size >= self.pool.maxsize
+		if waiting:
+			stats.waiters += 1
+			stats.max_waiters = max(stats.max_waiters, stats.waiters)
+		start = time.perf_counter()
+		try:
+			conn = await asyncio.wait_for(self.pool.acquire(), timeout=cfg.DB_ACQUIRE_TIMEOUT)
+		except asyncio.TimeoutError:
+			stats.timeouts += 1
+			raise OperationalError(
+				f"Timed out waiting for a free database connection (pool size {self.pool.size}/{self.pool.maxsize})."
+			)
+		finally:
+			if waiting:
+				stats.waiters -= 1
+		stats.acquires += 1
+		stats.acquire_total += time.perf_counter() - start
+		stats.acquire_samples.append(time.perf_counter() - start)
+
+		try:
+			if cfg.DB_POOL_PRE_PING >= 0 and self.loop.time() - conn.last_usage > cfg.DB_POOL_PRE_PING:
+				try:
+					await conn.ping(reconnect=False)
+				except Exception:
+					stats.reconnects += 1
+					try:
+						await conn.ping(reconnect=True)
+					except Exception as e:
+						self.wrap_exc(e)
+			yield conn
+		finally:
+			await self.pool.release(conn)
+
+	@classmethod
+	def is_transient(cls, e):
+		""" True if the wrapped error is a connectivity, lock or timeout failure rather than a bad query """
+		if not isinstance(e, OperationalError):
+			return False
+		cause = e.__cause__
+		if cause is None or isinstance(cause, (asyncio.TimeoutError, OSError)):
+			return True  # pool acquire timeouts are raised by the adapter itself
+		return isinstance(cause, mysqlErr.Error) and len(cause.args) > 0 and cause.args[0] in cls.transient_errnos
+
+	async def _retry_read(self, f, *args):
+		""" Retry an idempotent read on transient errors with a jittered exponential backoff """
+		for attempt in range(cfg.DB_READ_RETRIES + 1):
+			try:
+				return await f(*args)
+			except OperationalError as e:
+				if attempt == cfg.DB_READ_RETRIES or not self.is_transient(e):
+					raise
+				self.pool_stats.retries += 1
+				await asyncio.sleep(0.1 * 2 ** attempt * random.uniform(0.5, 1.5))
 
 	async def execute(self, *args):
-		async with self.pool.acquire() as conn:
+		async with self.acquire() as conn:
 			async with conn.cursor() as cur:
-				try:
-					await cur.execute(*args)
-					return cur.lastrowid
-				except Exception as e:
-					self.wrap_exc(e)
+				return await self._query(cur, args)
 
 	async def executemany(self, *args):
-		async with self.pool.acquire() as conn:
+		async with self.acquire() as conn:
 			async with conn.cursor() as cur:
-				try:
-					await cur.executemany(*args)
-				except mysqlErr.Error as e:
-					self.wrap_exc(e)
+				await self._query(cur, args, many=True)
 
-	async def fetchone(self, *args):
-		async with self.pool.acquire() as conn:
+	async def _fetch(self, args, fetch):
+		async with self.acquire() as conn:
 			async with conn.cursor() as cur:
-				try:
-					await cur.execute(*args)
-					return await cur.fetchone()
-				except mysqlErr.Error as e:
-					self.wrap_exc(e)
+				return await self._query(cur, args, fetch=fetch)
+
+	async def fetchone(self, *args):
+		return await self._retry_read(self._fetch, args, 'one')
 
 	async def fetchall(self, *args):
-		async with self.pool.acquire() as conn:
-			async with conn.cursor() as cur:
+		return await self._retry_read(self._fetch, args, 'all')
+
+	async def stream_batches(self, request, args=None, batch=None):
+		"""
+		Yield the rows of a query in lists of up to batch rows from an unbuffered server-side cursor,
+		so the result set is never held in memory at once. The pool connection stays busy until the iteration ends.
+		"""
+		batch = batch or self.stream_batch_size
+		spent, rows = 0.0, 0
+		async with self.acquire() as conn:
+			cur = await conn.cursor(aiomysql.SSDictCursor)
+			try:
+				start = time.perf_counter()
 				try:
-					await cur.execute(*args)
-					return await cur.fetchall()
-				except mysqlErr.Error as e:
+					await cur.execute(request, args)
+				except Exception as e:
+					self.query_stats.record(request, time.perf_counter() - start, error=True)
 					self.wrap_exc(e)
+				spent += time.perf_counter() - start
+				while True:
+					start = time.perf_counter()
+					chunk = await cur.fetchmany(batch)
+					spent += time.perf_counter() - start
+					if not len(chunk):
+						break
+					rows += len(chunk)
+					yield chunk
+			finally:
+				await cur.close()
+		self.query_stats.record(request, spent, rows)
+
+	async def stream(self, request, args=None, batch=None):
+		""" async for row in db.stream(...), see stream_batches() """
+		async with aclosing(self.stream_batches(request, args, batch)) as chunks:
+			async for chunk in chunks:
+				for row in chunk:
+					yield row
+
+	async def replication_lag(self):
+		""" Return seconds the server is behind its replication source, 0 if it is not a replica, None if replication is stopped """
+		try:
+			status = await self.fetchone("SHOW REPLICA STATUS")
+			return 0 if status is None else status['Seconds_Behind_Source']
+		except ProgrammingError:  # before MySQL 8.0.22
+			status = await self.fetchone("SHOW SLAVE STATUS")
+			return 0 if status is None else status['Seconds_Behind_Master']
+
+	def pool_info(self):
+		""" Return the pool size and saturation counters """
+		return dict(
+			workload=self.workload, size=self.pool.size, free=self.pool.freesize, maxsize=self.pool.maxsize,
+			**self.pool_stats.summary()
+		)
 
 	@staticmethod
 	def _mysql_column(kwargs):
@@ -124,22 +422,11 @@ class Adapter:
 		)
 
 	@staticmethod
-	def _mysql_insert(columns, table, on_dublicate):
-		return "{action}{ignore} INTO {table} ({columns}) VALUES({values})".format(
-			action="REPLACE" if on_dublicate == 'replace' else "INSERT",
-			ignore=" IGNORE" if on_dublicate == 'ignore' else "",
-			table=table,
-			columns=", ".join((f"`{i}`" for i in columns)),
-			values=", ".join(('%s' for i in range(len(columns))))
-		)
-
-	@staticmethod
-	def _mysql_update(table, columns, keys):
-		where = " WHERE {}".format(" AND ".join(["`{}`=%s".format(i) for i in keys])) if len(keys) else ""
-		return "UPDATE {table} SET {columns}{where}".format(
-			table=table,
-			columns=",".join(["`{}`=%s".format(i) for i in columns]),
-			where=where
+	def _mysql_index(kwargs):
+		return "{unique}INDEX `{iname}` ({columns})".format(
+			unique="UNIQUE " if kwargs['unique'] else "",
+			iname=kwargs['iname'],
+			columns=", ".join((f"`{i}`" for i in kwargs['columns']))
 		)
 
 	async def create_table(self, table):
@@ -147,11 +434,12 @@ class Adapter:
 
 		columns = [self._mysql_column({**column_blank, **col}) for col in table['columns']]
 		fkeys = ["FOREIGN KEY " + self._mysql_fkey({**fkey_blank, **fkey}) for fkey in table['foreign_keys']]
+		indexes = [self._mysql_index({**index_blank, **index}) for index in table['indexes']]
 		pkeys = ", PRIMARY KEY(" + ", ".join(table['primary_keys']) + ')' if len(table['primary_keys']) else ''
 
 		request = "CREATE TABLE {tname} ({tdeskr})".format(
 			tname=table['tname'],
-			tdeskr=", ".join((columns + fkeys)) + pkeys
+			tdeskr=", ".join((columns + fkeys + indexes)) + pkeys
 		)
 
 		await self.execute(request)
@@ -205,60 +493,146 @@ class Adapter:
 					"Column '{}' types are mismatching, {} and {}".format(col['cname'], col['ctype'], columns[col['cname']])
 				))
 
-	async def select(self, columns, table, where=None, order_by=None, order_asc=False, limit=None, one=False):
-		conditions = " WHERE " + " AND ".join(("`{}`=%s".format(k) for k in where.keys())) if where else ''
-		args = list(where.values()) if where else ()
-
-		# fix queries where there are some restricted words, for example in MySQL 8 'rank' is restricted
-		sql_restricted_words = [
-				'rank',
-				'role',
-				'data',
-		]
-		columns = [f"`{col}`" if col in sql_restricted_words else col for col in columns]
-
-		request = "SELECT {columns} FROM `{table}`{where}{order}{limit}".format(
-			columns=', '.join(columns),
-			table=table,
-			where=conditions,
-			order=" ORDER BY "+order_by+(" ASC" if order_asc else " DESC") if order_by else "",
-			limit=(" LIMIT " + str(limit)) if limit else ""
-		)
-
-		if one:
-			return await self.fetchone(request, args)
-		else:
-			return await self.fetchall(request, args)
-
-	async def select_one(self, *args, **kwargs):
-		return await self.select(*args, **kwargs, one=True)
-
-	async def delete(self, table, where=None):
-		conditions = " WHERE " + " AND ".join(("`{}`=%s".format(k) for k in where.keys())) if where else ''
-		args = list(where.values()) if where else ()
-		await self.execute("DELETE FROM {}{}".format(table, conditions), args)
-
-	async def insert(self, table, d, on_dublicate=None):
-		request = self._mysql_insert(d.keys(), table, on_dublicate)
-		return await self.execute(request, list(d.values()))
-
-	async def update(self, table, d, keys=None):
-		keys = keys or {}
-		request = self._mysql_update(table, d.keys(), keys.keys())
-		await self.execute(request, list(d.values()) + list(keys.values()))
+		# Create secondary indexes if not exist
+		if len(table['indexes']):
+			indexes = await self.fetchall("\n".join((
+				"SELECT DISTINCT INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS",
+				"WHERE TABLE_NAME = '{}' AND TABLE_SCHEMA = '{}'".format(table['tname'], self.dbName)
+			)))
+			indexes = {i['INDEX_NAME'] for i in indexes}
+			for index in table['indexes']:
+				index = {**index_blank, **index}
+				if index['iname'] not in indexes:
+					await self.execute("ALTER TABLE {tname} ADD {index_sql}".format(
+						tname=table['tname'],
+						index_sql=self._mysql_index(index)
+					))
 
-	async def insert_many(self, table, it, on_dublicate=None):
-		try:
-			first, it = peek(iter(it))
-		except StopIteration:
-			return
+	def register_table(self, table):
+		""" Add a table definition to be created or altered on the next reconcile_tables() call """
+		self.tables[table['tname']] = {**table_blank, **table}
 
-		request = self._mysql_insert(first.keys(), table, on_dublicate)
-		await self.executemany(request, (list(d.values()) for d in it))
+	@staticmethod
+	def _table_checksum(table):
+		return sha1(json.dumps(table, sort_keys=True, default=str).encode()).hexdigest()
+
+	async def reconcile_tables(self):
+		"""
+		Ensure all registered tables in a single pass. Tables with a definition checksum matching the one stored
+		in the schema table are skipped, others are diffed against one INFORMATION_SCHEMA read and altered in batch.
+		Returns a list of the changed table names.
+		"""
+		checksums = {tname: self._table_checksum(table) for tname, table in self.tables.items()}
+		checksums = {tname: checksum for tname, checksum in checksums.items() if self._reconciled.get(tname) != checksum}
+		if not len(checksums):
+			return []
+
+		if self._checksums is None:
+			await self.execute(
+				f"CREATE TABLE IF NOT EXISTS `{self.schema_table}` (" +
+				"`tname` VARCHAR(191) NOT NULL, `checksum` VARCHAR(40), `duration` FLOAT, `at` BIGINT, PRIMARY KEY(`tname`))"
+			)
+			self._checksums = {
+				row['tname']: (row['checksum'], row['duration'])
+				for row in await self.fetchall(f"SELECT `tname`, `checksum`, `duration` FROM `{self.schema_table}`")
+			}
+		pending = [tname for tname, checksum in checksums.items() if self._checksums.get(tname, (None, ))[0] != checksum]
+		skipped = [tname for tname in checksums.keys() if tname not in pending]
+		saved = sum((self._checksums[tname][1] or 0 for tname in skipped))
+		if not len(pending):
+			self._reconciled.update(checksums)
+			log.info("Schema is up to date, skipped {} tables (~{:.3f}s saved).".format(len(skipped), saved))
+			return []
+
+		start = time.time()
+		schema = await self.fetchall("\n".join((
+			"SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, NULL AS INDEX_NAME FROM INFORMATION_SCHEMA.COLUMNS",
+			"WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ({names})",
+			"UNION ALL",
+			"SELECT DISTINCT TABLE_NAME, NULL, NULL, INDEX_NAME FROM INFORMATION_SCHEMA.STATISTICS",
+			"WHERE TABLE_SCHEMA = %s AND TABLE_NAME IN ({names})"
+		)).format(names=", ".join(['%s'] * len(pending))), (self.dbName, *pending, self.dbName, *pending))
+		columns, indexes = {}, {}
+		for row in schema:
+			if row['COLUMN_NAME'] is not None:
+				columns.setdefault(row['TABLE_NAME'], {})[row['COLUMN_NAME']] = row['DATA_TYPE']
+			else:
+				indexes.setdefault(row['TABLE_NAME'], set()).add(row['INDEX_NAME'])
+
+		# Compute the diff for all the tables before applying anything
+		to_create, to_alter = [], {}
+		for tname in pending:
+			table = self.tables[tname]
+			if tname not in columns:
+				to_create.append(table)
+				continue
+			clauses = []
+			for col in table['columns']:
+				col = {**column_blank, **col}
+				if col['cname'] not in columns[tname]:
+					clauses.append("ADD COLUMN " + self._mysql_column(col))
+					clauses.extend((
+						"ADD FOREIGN KEY " + self._mysql_fkey({**fkey_blank, **fkey})
+						for fkey in table['foreign_keys'] if fkey['cname'] == col['cname']
+					))
+				elif not col['ctype'].lower().startswith(columns[tname][col['cname']]):
+					raise(TypeError("Column '{}.{}' types are mismatching, {} and {}".format(
+						tname, col['cname'], col['ctype'], columns[tname][col['cname']]
+					)))
+			clauses.extend((
+				"ADD " + self._mysql_index({**index_blank, **index})
+				for index in table['indexes'] if index['iname'] not in indexes.get(tname, ())
+			))
+			if len(clauses):
+				to_alter[tname] = clauses
+
+		for table in to_create:
+			await self.create_table(table)
+		for tname, clauses in to_alter.items():
+			await self.execute("ALTER TABLE {} {}".format(tname, ", ".join(clauses)))
+
+		duration = time.time() - start
+		now = int(time.time())
+		await self.insert_many(self.schema_table, (
+			dict(tname=tname, checksum=checksums[tname], duration=duration/len(pending), at=now) for tname in pending
+		), on_dublicate='update')
+		self._checksums.update({tname: (checksums[tname], duration/len(pending)) for tname in pending})
+		self._reconciled.update(checksums)
+
+		log.info("Schema reconciled in {:.3f}s: {} created, {} altered, {} up to date (~{:.3f}s saved).".format(
+			duration, len(to_create), len(to_alter), len(skipped), saved
+		))
+		return [table['tname'] for table in to_create] + list(to_alter.keys())
+
+	@asynccontextmanager
+	async def transaction(self):
+		"""
+		Run queries on a single connection, commit on exit or rollback on exception.
+		Use tx.transaction() for a nested savepoint and tx.on_commit() for actions to run after the commit.
+		"""
+		async with self.acquire() as conn:
+			try:
+				await conn.begin()
+			except mysqlErr.Error as e:
+				self.wrap_exc(e)
+			tx = Transaction(conn, self.query_stats)
+			try:
+				yield tx
+			except BaseException:
+				await conn.rollback()
+				raise
+			try:
+				await conn.commit()
+			except mysqlErr.Error as e:
+				self.wrap_exc(e)
+		for f, args, kwargs in tx.commit_hooks:
+			f(*args, **kwargs)
 
 	async def close(self):
 		self.pool.close()
 		await self.pool.wait_closed()
+		if self.background is not self:
+			await self.background.close()
 
 	@staticmethod
 	def wrap_exc(e):
@@ -276,3 +650,61 @@ class Adapter:
 
 		else:
 			raise DatabaseError() from e
+
+
+class Transaction(Queries):
+	""" Query helpers bound to a single connection with an open transaction, see Adapter.transaction() """
+
+	def __init__(self, conn, query_stats):
+		self.conn = conn
+		self.query_stats = query_stats
+		self.commit_hooks = []
+		self._savepoints = 0
+
+	def on_commit(self, f, *args, **kwargs):
+		""" Call f(*args, **kwargs) once the outermost transaction is committed """
+		self.commit_hooks.append((f, args, kwargs))
+
+	@asynccontextmanager
+	async def savepoint(self):
+		""" Nested transaction, rolls back to the savepoint on exception """
+		self._savepoints += 1
+		name = f"sp_{self._savepoints}"
+		hooks = len(self.commit_hooks)
+		await self.execute(f"SAVEPOINT {name}")
+		try:
+			yield self
+		except BaseException:
+			await self.execute(f"ROLLBACK TO SAVEPOINT {name}")
+			del self.commit_hooks[hooks:]
+			raise
+		await self.execute(f"RELEASE SAVEPOINT {name}")
+
+	# allows `async with (tx or db).transaction() as tx:` in functions that may run inside a transaction
+	transaction = savepoint
+
+	async def execute(self, *args):
+		async with self.conn.cursor() as cur:
+			return await self._query(cur, args)
+
+	async def executemany(self, *args):
+		async with self.conn.cursor() as cur:
+			await self._query(cur, args, many=True)
+
+	async def fetchone(self, *args):
+		async with self.conn.cursor() as cur:
+			return await self._query(cur, args, fetch='one')
+
+	async def fetchall(self, *args):
+		async with self.conn.cursor() as cur:
+			return await self._query(cur, args, fetch='all')
+
+	async def stream_batches(self, request, args=None, batch=None):
+		"""
+		Yield the rows of a query in lists of up to batch rows. The result is buffered, so the connection of the
+		transaction stays free for its writes between the batches and no second connection is acquired.
+		"""
+		rows = await self.fetchall(request, args)
+		batch = batch or Adapter.stream_batch_size
+		for i in range(0, len(rows), batch):
+			yield rows[i:i + batch]
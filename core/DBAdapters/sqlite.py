@@ -0,0 +1,603 @@
+# -*- coding: utf-8 -*-
+import time
+import json
+import asyncio
+import sqlite3
+from hashlib import sha1
+from itertools import islice
+from functools import lru_cache
+from contextlib import asynccontextmanager, aclosing
+from concurrent.futures import ThreadPoolExecutor
+from .common import *
+
+from core.console import log
+
+
+class Types:
+	bool = "TINYINT(1)"
+	int = "BIGINT"
+	float = "FLOAT"
+	str = "VARCHAR(191)"
+	text = "VARCHAR(2000)"
+	dict = "MEDIUMTEXT"
+
+
+reference_options = dict(
+	RESTRICT='RESTRICT',
+	CASCADE='CASCADE',
+	SET_NULL='SET NULL',
+	SET_DEFAULT='SET DEFAULT'
+)
+
+table_blank = dict(tname=None, columns=[], primary_keys=[], foreign_keys=[], indexes=[])
+column_blank = dict(cname=None, ctype=Types.str, notnull=False, unique=False, autoincrement=False, default=None)
+fkey_blank = dict(cname=None, refTable=None, refColumn=None, on_delete=None, on_update=None)
+index_blank = dict(iname=None, columns=[], unique=False)
+
+
+def _translate(request):
+	""" Rewrite the MySQL dialect bits used by raw queries in the bot into SQLite """
+	return request.replace("%s", "?").replace("INSERT IGNORE", "INSERT OR IGNORE").replace(
+		" ON UPDATE CURRENT_TIMESTAMP", ""
+	)
+
+
+def _dict_factory(cur, row):
+	return {d[0]: v for d, v in zip(cur.description, row)}
+
+
+class Connection:
+	""" A sqlite3 connection with its own worker thread, so queries do not block the event loop """
+
+	def __init__(self, path, uri=False, query_stats=None):
+		self.path = path
+		self.uri = uri
+		self.query_stats = query_stats or QueryStats()
+		self.conn = None
+		self.executor = ThreadPoolExecutor(max_workers=1)
+
+	def _connect(self):
+		self.conn = sqlite3.connect(self.path, uri=self.uri, timeout=30, isolation_level=None, check_same_thread=False)
+		self.conn.row_factory = _dict_factory
+		self.conn.execute("PRAGMA foreign_keys=ON")
+		self.conn.execute("PRAGMA synchronous=NORMAL")
+
+	def _execute(self, request, args, many=False, fetch=None):
+		cur = self.conn.cursor()
+		try:
+			if many:
+				cur.executemany(_translate(request), args)
+			else:
+				cur.execute(_translate(request), args or ())
+			if fetch == 'one':
+				result = cur.fetchone()
+				return result, int(result is not None)
+			elif fetch == 'all':
+				result = cur.fetchall()
+				return result, len(result)
+			return cur.lastrowid, cur.rowcount
+		finally:
+			cur.close()
+
+	async def run(self, f, *args):
+		return await asyncio.get_running_loop().run_in_executor(self.executor, f, *args)
+
+	async def connect(self):
+		await self.run(self._connect)
+
+	async def execute(self, request, args=None, many=False, fetch=None):
+		start = time.perf_counter()
+		try:
+			result, rows = await self.run(self._execute, request, args, many, fetch)
+		except sqlite3.Error as e:
+			self.query_stats.record(request, time.perf_counter() - start, error=True)
+			Adapter.wrap_exc(e)
+		self.query_stats.record(request, time.perf_counter() - start, rows)
+		return result
+
+	def _cursor(self, request, args):
+		cur = self.conn.cursor()
+		cur.execute(_translate(request), args or ())
+		return cur
+
+	async def stream(self, request, args=None, batch=1000):
+		""" Yield the rows in lists of up to batch rows, fetched from the cursor as they are consumed """
+		spent, rows = 0.0, 0
+		start = time.perf_counter()
+		try:
+			cur = await self.run(self._cursor, request, args)
+		except sqlite3.Error as e:
+			self.query_stats.record(request, time.perf_counter() - start, error=True)
+			Adapter.wrap_exc(e)
+		spent += time.perf_counter() - start
+		try:
+			while True:
+				start = time.perf_counter()
+				chunk = await self.run(cur.fetchmany, batch)
+				spent += time.perf_counter() - start
+				if not len(chunk):
+					break
+				rows += len(chunk)
+				yield chunk
+		finally:
+			await self.run(cur.close)
+		self.query_stats.record(request, spent, rows)
+
+	async def close(self):
+		if self.conn is not None:
+			await self.run(self.conn.close)
+		self.executor.shutdown(wait=False)
+
+
+class Queries:
+	""" Query builders and schema helpers shared by the Adapter and its Transaction objects """
+
+	insert_chunk_size = 1000  # max rows per multi-row statement in insert_many()
+	sql_cache_size = 512  # max memoized SQL texts per query builder
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _sqlite_insert(columns, table, on_dublicate, update_columns=None, rows=1):
+		return "{action} INTO {table} ({columns}) VALUES{values}{update}".format(
+			action={'replace': "REPLACE", 'ignore': "INSERT OR IGNORE"}.get(on_dublicate, "INSERT"),
+			table=table,
+			columns=", ".join((f"`{i}`" for i in columns)),
+			values=", ".join(["(" + ", ".join(('?' for i in range(len(columns)))) + ")"] * rows),
+			update=" ON CONFLICT DO UPDATE SET " + ", ".join(
+				(f"`{i}`=excluded.`{i}`" for i in (update_columns or columns))
+			) if on_dublicate == 'update' else " ON CONFLICT DO UPDATE SET " + ", ".join(
+				(f"`{i}`=`{i}`+excluded.`{i}`" for i in update_columns)
+			) if on_dublicate == 'add' else ""
+		)
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _sqlite_update(table, columns, keys):
+		where = " WHERE {}".format(" AND ".join(["`{}`=?".format(i) for i in keys])) if len(keys) else ""
+		return "UPDATE {table} SET {columns}{where}".format(
+			table=table,
+			columns=",".join(["`{}`=?".format(i) for i in columns]),
+			where=where
+		)
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _sqlite_select(columns, table, keys, order_by, order_asc, limit):
+		# same restricted words quoting as the MySQL adapter, so the column lists stay portable
+		sql_restricted_words = [
+				'rank',
+				'role',
+				'data',
+		]
+		columns = [f"`{col}`" if col in sql_restricted_words else col for col in columns]
+
+		return "SELECT {columns} FROM `{table}`{where}{order}{limit}".format(
+			columns=', '.join(columns),
+			table=table,
+			where=" WHERE " + " AND ".join(("`{}`=?".format(k) for k in keys)) if len(keys) else '',
+			order=" ORDER BY "+order_by+(" ASC" if order_asc else " DESC") if order_by else "",
+			limit=(" LIMIT " + str(limit)) if limit else ""
+		)
+
+	@staticmethod
+	@lru_cache(maxsize=sql_cache_size)
+	def _sqlite_delete(table, keys):
+		where = " WHERE " + " AND ".join(("`{}`=?".format(k) for k in keys)) if len(keys) else ''
+		return "DELETE FROM {}{}".format(table, where)
+
+	@classmethod
+	def sql_cache_info(cls):
+		""" Return {builder: (hits, misses, size)} of the memoized SQL texts """
+		return {
+			name: (info.hits, info.misses, info.currsize) for name, info in (
+				(f.__name__, f.cache_info()) for f in (
+					cls._sqlite_select, cls._sqlite_insert, cls._sqlite_update, cls._sqlite_delete
+				)
+			)
+		}
+
+	async def select(self, columns, table, where=None, order_by=None, order_asc=False, limit=None, one=False):
+		args = list(where.values()) if where else ()
+		request = self._sqlite_select(
+			tuple(columns), table, tuple(where.keys()) if where else (), order_by, order_asc, limit
+		)
+
+		if one:
+			return await self.fetchone(request, args)
+		else:
+			return await self.fetchall(request, args)
+
+	async def select_one(self, *args, **kwargs):
+		return await self.select(*args, **kwargs, one=True)
+
+	async def delete(self, table, where=None):
+		args = list(where.values()) if where else ()
+		await self.execute(self._sqlite_delete(table, tuple(where.keys()) if where else ()), args)
+
+	async def insert(self, table, d, on_dublicate=None):
+		request = self._sqlite_insert(tuple(d.keys()), table, on_dublicate)
+		return await self.execute(request, list(d.values()))
+
+	async def update(self, table, d, keys=None):
+		keys = keys or {}
+		request = self._sqlite_update(table, tuple(d.keys()), tuple(keys.keys()))
+		await self.execute(request, list(d.values()) + list(keys.values()))
+
+	async def insert_many(self, table, it, on_dublicate=None, update_columns=None, chunk_size=None):
+		"""
+		Insert rows with the same keys. With on_dublicate='update' rows are sent as chunked multi-row
+		INSERT ... ON CONFLICT DO UPDATE statements, updating only update_columns (all columns by default).
+		With on_dublicate='add' the values of update_columns are added to the existing ones instead.
+		"""
+		try:
+			first, it = peek(iter(it))
+		except StopIteration:
+			return
+
+		if on_dublicate not in ('update', 'add'):
+			request = self._sqlite_insert(tuple(first.keys()), table, on_dublicate)
+			await self.executemany(request, [list(d.values()) for d in it])
+			return
+
+		columns = tuple(first.keys())
+		chunk_size = chunk_size or self.insert_chunk_size
+		while len(chunk := list(islice(it, chunk_size))):
+			request = self._sqlite_insert(columns, table, on_dublicate, tuple(update_columns or ()), rows=len(chunk))
+			await self.execute(request, [d[c] for d in chunk for c in columns])
+
+	@staticmethod
+	def _sqlite_column(kwargs, inline_pkey=False):
+		return "`{cname}` {ctype}{notnull}{unique}{autoincrement}{default}".format(
+			cname=kwargs['cname'],
+			# only INTEGER PRIMARY KEY columns are rowid aliases and can autoincrement in SQLite
+			ctype="INTEGER" if inline_pkey else kwargs['ctype'],
+			notnull=" NOT NULL" if kwargs['notnull'] else "",
+			unique=" UNIQUE" if kwargs['unique'] else "",
+			autoincrement=" PRIMARY KEY AUTOINCREMENT" if inline_pkey else "",
+			default=" DEFAULT '{}'".format(kwargs['default']) if kwargs['default'] is not None else ""
+		)
+
+	@staticmethod
+	def _sqlite_fkey(kwargs):
+		return "REFERENCES {refTable}({refColumn}){on_delete}{on_update}".format(
+			refTable=kwargs['refTable'],
+			refColumn=kwargs['refColumn'],
+			on_delete=" ON DELETE " + reference_options[kwargs['on_delete']] if kwargs['on_delete'] else '',
+			on_update=" ON UPDATE " + reference_options[kwargs['on_update']] if kwargs['on_update'] else ''
+		)
+
+	@staticmethod
+	def _sqlite_index(tname, kwargs):
+		# index names are global in SQLite, prefix them with the table name
+		return "CREATE {unique}INDEX IF NOT EXISTS `{tname}_{iname}` ON `{tname}` ({columns})".format(
+			unique="UNIQUE " if kwargs['unique'] else "",
+			tname=tname,
+			iname=kwargs['iname'],
+			columns=", ".join((f"`{i}`" for i in kwargs['columns']))
+		)
+
+	@staticmethod
+	def _type_matches(ctype, declared):
+		declared = declared.lower()
+		return ctype.lower() == declared or (declared == 'integer' and ctype == Types.int)
+
+	async def create_table(self, table):
+		table = {**table_blank, **table}
+
+		columns = []
+		for col in table['columns']:
+			col = {**column_blank, **col}
+			inline_pkey = col['autoincrement'] and table['primary_keys'] == [col['cname']]
+			columns.append(self._sqlite_column(col, inline_pkey))
+			if inline_pkey:
+				table['primary_keys'] = []
+		fkeys = [
+			"FOREIGN KEY (`{}`) ".format(fkey['cname']) + self._sqlite_fkey({**fkey_blank, **fkey})
+			for fkey in table['foreign_keys']
+		]
+		pkeys = ", PRIMARY KEY(" + ", ".join(table['primary_keys']) + ')' if len(table['primary_keys']) else ''
+
+		request = "CREATE TABLE {tname} ({tdeskr})".format(
+			tname=table['tname'],
+			tdeskr=", ".join((columns + fkeys)) + pkeys
+		)
+
+		await self.execute(request)
+		for index in table['indexes']:
+			await self.execute(self._sqlite_index(table['tname'], {**index_blank, **index}))
+
+	async def _ensure_table(self, table):
+		""" Create the table or its missing columns and indexes, returns True if anything has changed """
+		table = {**table_blank, **table}
+		columns = await self.fetchall("PRAGMA table_info(`{}`)".format(table['tname']))
+		columns = {i['name']: i['type'] for i in columns}
+
+		# Create table if not exist
+		if not len(columns):
+			await self.create_table(table)
+			return True
+
+		changed = False
+		for col in table['columns']:
+			col = {**column_blank, **col}
+			if col['cname'] not in columns.keys():
+				fkey = next((f for f in table['foreign_keys'] if f['cname'] == col['cname']), None)
+				await self.execute("ALTER TABLE {tname} ADD COLUMN {column_sql}{fkey_sql}".format(
+					tname=table['tname'],
+					column_sql=self._sqlite_column(col),
+					fkey_sql=" " + self._sqlite_fkey({**fkey_blank, **fkey}) if fkey else ""
+				))
+				changed = True
+			elif not self._type_matches(col['ctype'], columns[col['cname']]):
+				raise(TypeError(
+					"Column '{}' types are mismatching, {} and {}".format(col['cname'], col['ctype'], columns[col['cname']])
+				))
+
+		indexes = {i['name'] for i in await self.fetchall("PRAGMA index_list(`{}`)".format(table['tname']))}
+		for index in table['indexes']:
+			index = {**index_blank, **index}
+			if "{}_{}".format(table['tname'], index['iname']) not in indexes:
+				await self.execute(self._sqlite_index(table['tname'], index))
+				changed = True
+		return changed
+
+
+class Adapter(Queries):
+	loop: asyncio.AbstractEventLoop
+	types = Types
+	errors = Errors
+	schema_table = "db_schema"
+	stream_batch_size = 1000  # default rows per batch in stream()
+
+	def __init__(self, db_address, workload='interactive'):
+		# sqlite://path/to/file.db, sqlite:///absolute/path.db or sqlite://:memory:
+		if not db_address:
+			raise(ValueError('Bad database address string: ' + db_address))
+		self.dbAddress = db_address
+		if db_address == ':memory:':
+			# transactions use their own connections, so they must see the same in-memory database
+			self.dbPath, self.uri = "file:pubobot?mode=memory&cache=shared", True
+		else:
+			self.dbPath, self.uri = db_address, False
+		self.conn = None
+		self.workload = workload
+		self.query_stats = QueryStats()
+		self.transactions = 0  # currently open transaction connections
+		self.tables = dict()  # {tname: table definition} to be ensured by reconcile_tables()
+		self._checksums = None  # {tname: (checksum, duration)} from the schema table
+		self._reconciled = dict()  # {tname: checksum} of the tables reconciled by this process
+
+		# Heavy jobs use db.background with its own connection and worker thread
+		if workload == 'interactive':
+			self.background = Adapter(self.dbAddress, workload='background')
+			self.background.query_stats = self.query_stats
+		else:
+			self.background = self
+
+	async def connect(self):
+		self.loop = asyncio.get_running_loop()
+		self.conn = Connection(self.dbPath, self.uri, self.query_stats)
+		try:
+			await self.conn.connect()
+			if not self.uri:
+				await self.conn.execute("PRAGMA journal_mode=WAL", fetch='one')
+		except sqlite3.Error as e:
+			self.wrap_exc(e)
+		if self.background is not self:
+			await self.background.connect()
+
+	async def execute(self, *args):
+		return await self.conn.execute(*args)
+
+	async def executemany(self, *args):
+		await self.conn.execute(*args, many=True)
+
+	async def fetchone(self, *args):
+		return await self.conn.execute(*args, fetch='one')
+
+	async def fetchall(self, *args):
+		return await self.conn.execute(*args, fetch='all')
+
+	def ensure_table(self, table):
+		return self._ensure_table(table)
+
+	def register_table(self, table):
+		""" Add a table definition to be created or altered on the next reconcile_tables() call """
+		self.tables[table['tname']] = {**table_blank, **table}
+
+	@staticmethod
+	def _table_checksum(table):
+		return sha1(json.dumps(table, sort_keys=True, default=str).encode()).hexdigest()
+
+	async def reconcile_tables(self):
+		"""
+		Ensure all registered tables. Tables with a definition checksum matching the one stored in the schema
+		table are skipped. Returns a list of the changed table names.
+		"""
+		checksums = {tname: self._table_checksum(table) for tname, table in self.tables.items()}
+		checksums = {tname: checksum for tname, checksum in checksums.items() if self._reconciled.get(tname) != checksum}
+		if not len(checksums):
+			return []
+
+		if self._checksums is None:
+			await self.execute(
+				f"CREATE TABLE IF NOT EXISTS `{self.schema_table}` (" +
+				"`tname` VARCHAR(191) NOT NULL, `checksum` VARCHAR(40), `duration` FLOAT, `at` BIGINT, PRIMARY KEY(`tname`))"
+			)
+			self._checksums = {
+				row['tname']: (row['checksum'], row['duration'])
+				for row in await self.fetchall(f"SELECT `tname`, `checksum`, `duration` FROM `{self.schema_table}`")
+			}
+		pending = [tname for tname, checksum in checksums.items() if self._checksums.get(tname, (None, ))[0] != checksum]
+		skipped = [tname for tname in checksums.keys() if tname not in pending]
+		saved = sum((self._checksums[tname][1] or 0 for tname in skipped))
+		if not len(pending):
+			self._reconciled.update(checksums)
+			log.info("Schema is up to date, skipped {} tables (~{:.3f}s saved).".format(len(skipped), saved))
+			return []
+
+		start = time.time()
+		changed = []
+		async with self.transaction() as tx:
+			for tname in pending:
+				if await tx._ensure_table(self.tables[tname]):
+					changed.append(tname)
+
+			duration = time.time() - start
+			now = int(time.time())
+			await tx.insert_many(self.schema_table, (
+				dict(tname=tname, checksum=checksums[tname], duration=duration/len(pending), at=now) for tname in pending
+			), on_dublicate='update')
+		self._checksums.update({tname: (checksums[tname], duration/len(pending)) for tname in pending})
+		self._reconciled.update(checksums)
+
+		log.info("Schema reconciled in {:.3f}s: {} changed, {} up to date (~{:.3f}s saved).".format(
+			duration, len(changed), len(skipped), saved
+		))
+		return changed
+
+	@asynccontextmanager
+	async def transaction(self):
+		"""
+		Run queries on a dedicated connection, commit on exit or rollback on exception.
+		Use tx.transaction() for a nested savepoint and tx.on_commit() for actions to run after the commit.
+		"""
+		conn = Connection(self.dbPath, self.uri, self.query_stats)
+		self.transactions += 1
+		try:
+			try:
+				await conn.connect()
+			except sqlite3.Error as e:
+				self.wrap_exc(e)
+			await conn.execute("BEGIN IMMEDIATE")
+			tx = Transaction(conn)
+			try:
+				yield tx
+			except BaseException:
+				await conn.execute("ROLLBACK")
+				raise
+			await conn.execute("COMMIT")
+		finally:
+			self.transactions -= 1
+			await conn.close()
+		for f, args, kwargs in tx.commit_hooks:
+			f(*args, **kwargs)
+
+	async def stream_batches(self, request, args=None, batch=None):
+		""" Yield the rows of a query in lists of up to batch rows, read by a cursor on a dedicated connection """
+		conn = Connection(self.dbPath, self.uri, self.query_stats)
+		try:
+			try:
+				await conn.connect()
+			except sqlite3.Error as e:
+				self.wrap_exc(e)
+			async with aclosing(conn.stream(request, args, batch or self.stream_batch_size)) as chunks:
+				async for chunk in chunks:
+					yield chunk
+		finally:
+			await conn.close()
+
+	async def stream(self, request, args=None, batch=None):
+		""" async for row in db.stream(...), see stream_batches() """
+		async with aclosing(self.stream_batches(request, args, batch)) as chunks:
+			async for chunk in chunks:
+				for row in chunk:
+					yield row
+
+	async def replication_lag(self):
+		""" SQLite has no replication, a read-only copy is never behind """
+		return 0
+
+	def pool_info(self):
+		""" Return the number of open connections, one shared plus one per open transaction """
+		return dict(workload=self.workload, size=1 + self.transactions, transactions=self.transactions)
+
+	async def close(self):
+		await self.conn.close()
+		if self.background is not self:
+			await self.background.close()
+
+	@staticmethod
+	def is_transient(e):
+		""" True if the wrapped error is a busy, locked or can not open failure rather than a bad query """
+		return isinstance(e, OperationalError)
+
+	@staticmethod
+	def _transient(e):
+		""" True if the sqlite3.OperationalError is a busy, locked or can not open failure worth a retry """
+		if (code := getattr(e, 'sqlite_errorcode', None)) is not None:
+			return code & 0xff in (5, 6, 14)  # SQLITE_BUSY, SQLITE_LOCKED, SQLITE_CANTOPEN
+		return str(e).startswith(('database is locked', 'database table is locked', 'unable to open database'))
+
+	@staticmethod
+	def wrap_exc(e):
+		if isinstance(e, sqlite3.OperationalError):
+			# sqlite reports syntax errors and missing tables or columns as OperationalError too
+			if Adapter._transient(e):
+				raise OperationalError() from e
+			raise ProgrammingError() from e
+
+		elif isinstance(e, sqlite3.DataError):
+			raise DataError() from e
+
+		elif isinstance(e, sqlite3.IntegrityError):
+			raise IntegrityError() from e
+
+		elif isinstance(e, sqlite3.ProgrammingError):
+			raise ProgrammingError() from e
+
+		else:
+			raise DatabaseError() from e
+
+
+class Transaction(Queries):
+	""" Query helpers bound to a connection with an open transaction, see Adapter.transaction() """
+
+	def __init__(self, conn):
+		self.conn = conn
+		self.commit_hooks = []
+		self._savepoints = 0
+
+	def on_commit(self, f, *args, **kwargs):
+		""" Call f(*args, **kwargs) once the outermost transaction is committed """
+		self.commit_hooks.append((f, args, kwargs))
+
+	@asynccontextmanager
+	async def savepoint(self):
+		""" Nested transaction, rolls back to the savepoint on exception """
+		self._savepoints += 1
+		name = f"sp_{self._savepoints}"
+		hooks = len(self.commit_hooks)
+		await self.execute(f"SAVEPOINT {name}")
+		try:
+			yield self
+		except BaseException:
+			await self.execute(f"ROLLBACK TO SAVEPOINT {name}")
+			del self.commit_hooks[hooks:]
+			raise
+		await self.execute(f"RELEASE SAVEPOINT {name}")
+
+	# allows `async with (tx or db).transaction() as tx:` in functions that may run inside a transaction
+	transaction = savepoint
+
+	async def execute(self, *args):
+		return await self.conn.execute(*args)
+
+	async def executemany(self, *args):
+		await self.conn.execute(*args, many=True)
+
+	async def fetchone(self, *args):
+		return await self.conn.execute(*args, fetch='one')
+
+	async def fetchall(self, *args):
+		return await self.conn.execute(*args, fetch='all')
+
+	async def stream_batches(self, request, args=None, batch=None):
+		"""
+		Yield the rows of a query in lists of up to batch rows. The result is buffered, so the connection of the
+		transaction stays free for its writes between the batches and no second connection is acquired.
+		"""
+		rows = await self.fetchall(request, args)
+		batch = batch or Adapter.stream_batch_size
+		for i in range(0, len(rows), batch):
+			yield rows[i:i + batch]
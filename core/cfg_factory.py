@@ -5,7 +5,7 @@ import emoji
 import json
 from nextcord import Guild
 
-from core.database import db
+from core.database import db, writer as db_writer
 from core.client import dc
 from core.utils import format_emoji, parse_duration, seconds_to_str
 from core.console import log
@@ -99,26 +99,29 @@ class FactoryTable:
 			primary_keys=[p_key]
 		)
 
+	def register(self) -> None:
+		""" Register the table definition to be created by db.reconcile_tables() """
+		# Build table definition now that database is ready
+		self._build_table_def()
+		db.register_table(self.table_def)
+
 	async def initialize(self) -> None:
 		""" Initialize the database table - call this after database connection """
 		if self._initialized:
 			return
-		
-		# Build table definition now that database is ready
-		self._build_table_def()
-		
-		# Call the async _ensure_table directly instead of ensure_table 
-		# to avoid run_until_complete issues when called from async context
-		await db._ensure_table(self.table_def)
+
+		# No-op if the table has already been reconciled along with the others
+		self.register()
+		await db.reconcile_tables()
 		await self.ensure_versions()
 		self._initialized = True
 
 	async def ensure_versions(self) -> None:
 		""" Ensure all rows in the table have correct FACTORY_VERSION """
-		if any((
-			row['factory_version'] != FACTORY_VERSION
-			for row in await db.select(['factory_version'], self.name)
-		)):
+		if await db.fetchone(
+			f"SELECT 1 FROM `{self.name}` WHERE `factory_version` IS NULL OR `factory_version`!=%s LIMIT 1",
+			(FACTORY_VERSION, )
+		):
 			raise ValueError("Not all the existing table rows have the correct factory_version, please run `update_db.py` script.")
 
 	async def get_next_p_key(self) -> int:
@@ -243,7 +246,7 @@ class Config:
 
 	async def set_info(self, d: dict):
 		self.cfg_info = d
-		await db.update(self._factory.table.name, {'cfg_info': json.dumps(d)}, {self._factory.table.p_key: self.p_key})
+		db_writer.update(self._factory.table.name, {'cfg_info': json.dumps(d)}, {self._factory.table.p_key: self.p_key})
 
 	async def delete(self):
 		await db.delete(self._factory.table.name, {self._factory.table.p_key: self.p_key})
@@ -31,6 +31,41 @@ class Config:
 		
 		# Database Configuration
 		self.DB_URI = os.getenv('DATABASE_URL') or (cfg_file.DB_URI if cfg_file else None)
+		# Optional read replica for the heavy stats reads (db.read), used while its lag is under DB_READ_MAX_LAG seconds
+		self.DB_READ_URI = os.getenv('DATABASE_READ_URL') or getattr(cfg_file, 'DB_READ_URI', None)
+		self.DB_READ_MAX_LAG = int(os.getenv('DB_READ_MAX_LAG', getattr(cfg_file, 'DB_READ_MAX_LAG', 30)))
+		self.DB_READ_CHECK_INTERVAL = int(os.getenv('DB_READ_CHECK_INTERVAL', getattr(cfg_file, 'DB_READ_CHECK_INTERVAL', 10)))
+		# Queries slower than this are logged with their caller, 0 to disable
+		self.DB_SLOW_QUERY_MS = int(os.getenv('DB_SLOW_QUERY_MS', getattr(cfg_file, 'DB_SLOW_QUERY_MS', 200)))
+		# MySQL connection pool, recycle and pre-ping idle times are in seconds (-1 to disable)
+		self.DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', getattr(cfg_file, 'DB_POOL_MIN', 1)))
+		self.DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', getattr(cfg_file, 'DB_POOL_MAX', 10)))
+		# Worst case of concurrent background connections: a decay or ratings snap streams on one connection
+		# while writing with a second, the noadds sweep, the journal prune and the state save take one each
+		self.DB_BG_POOL_MAX = int(os.getenv('DB_BG_POOL_MAX', getattr(cfg_file, 'DB_BG_POOL_MAX', 5)))
+		self.DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', getattr(cfg_file, 'DB_POOL_RECYCLE', 3600)))
+		self.DB_POOL_PRE_PING = int(os.getenv('DB_POOL_PRE_PING', getattr(cfg_file, 'DB_POOL_PRE_PING', 30)))
+		self.DB_ACQUIRE_TIMEOUT = float(os.getenv('DB_ACQUIRE_TIMEOUT', getattr(cfg_file, 'DB_ACQUIRE_TIMEOUT', 10)))
+		self.DB_READ_RETRIES = int(os.getenv('DB_READ_RETRIES', getattr(cfg_file, 'DB_READ_RETRIES', 2)))
+		# Tables to cache select() results of (comma separated, empty to disable), max cached results and ttl seconds
+		# Only writes of this process invalidate the cache, list read-mostly tables no other process writes to
+		self.DB_CACHE_TABLES = [t.strip() for t in os.getenv(
+			'DB_CACHE_TABLES', getattr(cfg_file, 'DB_CACHE_TABLES', 'players,qc_phrases')
+		).split(',') if t.strip()]
+		self.DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', getattr(cfg_file, 'DB_CACHE_SIZE', 1000)))
+		self.DB_CACHE_TTL = int(os.getenv('DB_CACHE_TTL', getattr(cfg_file, 'DB_CACHE_TTL', 60)))
+		# Write-behind queue for bookkeeping writes: flush interval seconds and pending rows forcing an early flush
+		self.DB_WRITE_BEHIND_INTERVAL = int(os.getenv('DB_WRITE_BEHIND_INTERVAL', getattr(cfg_file, 'DB_WRITE_BEHIND_INTERVAL', 5)))
+		self.DB_WRITE_BEHIND_MAX = int(os.getenv('DB_WRITE_BEHIND_MAX', getattr(cfg_file, 'DB_WRITE_BEHIND_MAX', 500)))
+		# Match ids reserved per counter update, unused ids of the block are skipped on restart
+		self.MATCH_ID_BLOCK_SIZE = int(os.getenv('MATCH_ID_BLOCK_SIZE', getattr(cfg_file, 'MATCH_ID_BLOCK_SIZE', 10)))
+		# Leaderboard snapshots are reloaded after this many seconds to pick up the changes made outside of the bot
+		self.LB_SNAPSHOT_MAX_AGE = int(os.getenv('LB_SNAPSHOT_MAX_AGE', getattr(cfg_file, 'LB_SNAPSHOT_MAX_AGE', 600)))
+		# Player profiles (recent rating changes and match counts) kept in memory for !rank and !stats
+		self.PROFILES_CACHE_SIZE = int(os.getenv('PROFILES_CACHE_SIZE', getattr(cfg_file, 'PROFILES_CACHE_SIZE', 5000)))
+		# Journal file for match results and noadds written while the database is unreachable, replay retry seconds
+		self.DB_JOURNAL_PATH = os.getenv('DB_JOURNAL_PATH', getattr(cfg_file, 'DB_JOURNAL_PATH', 'db_journal.jsonl'))
+		self.DB_JOURNAL_RETRY = int(os.getenv('DB_JOURNAL_RETRY', getattr(cfg_file, 'DB_JOURNAL_RETRY', 10)))
 		
 		# Logging Configuration
 		self.LOG_LEVEL = os.getenv('LOG_LEVEL', cfg_file.LOG_LEVEL if cfg_file else 'INFO')
@@ -17,8 +17,9 @@ LogLevelToInt = {
 	'DEBUG': 1,
 	'COMMANDS': 2,
 	'INFO': 3,
-	'ERRORS': 4,
-	'NOTHING': 5
+	'WARNINGS': 4,
+	'ERRORS': 5,
+	'NOTHING': 6
 }
 
 
@@ -69,8 +70,12 @@ class Log:
 		if self.loglevel <= 3:
 			self.log(data, 'INFO')
 
-	def error(self, data):
+	def warning(self, data):
 		if self.loglevel <= 4:
+			self.log(data, 'WARNING')
+
+	def error(self, data):
+		if self.loglevel <= 5:
 			self.log(data, 'ERROR')
 		
 
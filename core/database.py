@@ -1,6 +1,17 @@
 # -*- coding: utf-8 -*-
+import os
+import re
+import json
+import time
+import asyncio
+from uuid import uuid4
+from collections import OrderedDict, deque
+from itertools import islice
+from contextlib import asynccontextmanager, aclosing
 from importlib import import_module
 from core.config import cfg
+from core.console import log
+from core.DBAdapters.common import OperationalError, IntegrityError
 
 _db = None
 
@@ -13,13 +24,601 @@ def get_db():
 		db_type, db_address = cfg.DB_URI.split("://", 1)
 		adapter = import_module('core.DBAdapters.' + db_type)
 		_db = adapter.Adapter(db_address)
+		_db.query_stats.slow_query_ms = cfg.DB_SLOW_QUERY_MS
 	return _db
 
+
+class QueryCache:
+	""" LRU + TTL cache of select() results for the opted-in tables, invalidated by writes to the same table """
+
+	_re_tables = re.compile(r"\b(?:UPDATE|INTO|FROM|JOIN|TABLE)\s+`?(\w+)`?", re.IGNORECASE)
+
+	def __init__(self, tables, size=1000, ttl=60):
+		self.tables = set(tables)
+		self.size = size
+		self.ttl = ttl
+		self.entries = OrderedDict()  # {(table, columns, where, order_by, order_asc, limit, one): (expire_at, result)}
+		self.versions = dict()  # {table: number of invalidations}
+		self.hits = 0
+		self.misses = 0
+		self.invalidations = 0
+
+	@staticmethod
+	def _copy(result):
+		if result is None:
+			return None
+		elif isinstance(result, dict):
+			return dict(result)
+		return [dict(row) for row in result]
+
+	def get(self, key):
+		""" Return (True, result copy) if the key is cached and not expired, (False, None) otherwise """
+		if (entry := self.entries.get(key)) is None or entry[0] < time.monotonic():
+			self.entries.pop(key, None)
+			self.misses += 1
+			return False, None
+		self.entries.move_to_end(key)
+		self.hits += 1
+		return True, self._copy(entry[1])
+
+	def put(self, key, result, version):
+		""" Cache the result unless its table has been written since the read started """
+		if self.versions.get(key[0], 0) != version:
+			return
+		self.entries[key] = (time.monotonic() + self.ttl, self._copy(result))
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+
+	def invalidate(self, *tables):
+		for table in (t for t in tables if t in self.tables):
+			self.versions[table] = self.versions.get(table, 0) + 1
+			self.invalidations += 1
+			for key in [k for k in self.entries.keys() if k[0] == table]:
+				del self.entries[key]
+
+	def invalidate_sql(self, request):
+		""" Invalidate the tables a raw query may write to """
+		self.invalidate(*set(self._re_tables.findall(request)))
+
+	def summary(self):
+		return dict(
+			tables=sorted(self.tables), entries=len(self.entries), hits=self.hits, misses=self.misses,
+			hit_rate=self.hits / max(1, self.hits + self.misses), invalidations=self.invalidations
+		)
+
+
+cache = QueryCache(cfg.DB_CACHE_TABLES, cfg.DB_CACHE_SIZE, cfg.DB_CACHE_TTL)
+
+
+class WriteBehind:
+	"""
+	Queue of bookkeeping writes the command path does not need to wait on. Writes to the same row
+	are coalesced and flushed in a single transaction every interval seconds, or on the next frame
+	once max_pending rows are queued. Unflushed writes are overlaid by get() for read-your-writes.
+	"""
+
+	samples_size = 1000
+
+	def __init__(self, interval=5, max_pending=500):
+		self.interval = interval
+		self.max_pending = max_pending
+		self.pending = OrderedDict()  # {(table, ((key, value), ...)): [upsert, {column: value}]}
+		self.inflight = dict()  # rows of the flush in progress
+		self.next_flush_at = 0
+		self.queued = 0
+		self.coalesced = 0
+		self.flushes = 0
+		self.written = 0
+		self.failures = 0
+		self.dropped = 0
+		self.flush_samples = deque(maxlen=self.samples_size)
+		self._lock = asyncio.Lock()
+		self._task = None  # flush started by think()
+
+	def _put(self, table, values, keys, upsert):
+		key = (table, tuple(keys.items()))
+		self.queued += 1
+		if (row := self.pending.get(key)) is not None:
+			self.coalesced += 1
+			row[0] = row[0] or upsert
+			row[1].update(values)
+		else:
+			self.pending[key] = [upsert, dict(values)]
+		if len(self.pending) >= self.max_pending:
+			self.next_flush_at = 0
+
+	def update(self, table, values, keys):
+		""" Queue UPDATE table SET values WHERE keys """
+		self._put(table, values, keys, False)
+
+	def upsert(self, table, values, keys):
+		""" Queue an insert of keys + values, updating values if the row exists """
+		self._put(table, values, keys, True)
+
+	def get(self, table, keys):
+		""" Return the queued and not yet written values of the row or None """
+		key = (table, tuple(keys.items()))
+		found = [row[1] for row in (self.inflight.get(key), self.pending.get(key)) if row is not None]
+		return {k: v for values in found for k, v in values.items()} if found else None
+
+	async def _write(self, rows):
+		groups = dict()  # {(table, upsert, key columns, value columns): [(keys, values), ...]}
+		for (table, keys), (upsert, values) in rows.items():
+			groups.setdefault(
+				(table, upsert, tuple(k for k, v in keys), tuple(values.keys())), []
+			).append((dict(keys), values))
+
+		try:
+			async with get_db().transaction() as tx:
+				for (table, upsert, _, columns), group in groups.items():
+					if upsert:
+						await tx.insert_many(
+							table, (dict(keys, **values) for keys, values in group),
+							on_dublicate='update', update_columns=columns
+						)
+					else:
+						for keys, values in group:
+							await tx.update(table, values, keys)
+		finally:
+			cache.invalidate(*set((table for table, *_ in groups.keys())))
+
+	def _requeue(self, rows):
+		""" Put the rows back under the writes queued since """
+		for key, (upsert, values) in rows.items():
+			if (row := self.pending.get(key)) is not None:
+				row[0] = row[0] or upsert
+				row[1] = dict(values, **row[1])
+			else:
+				self.pending[key] = [upsert, values]
+
+	async def _write_each(self, rows):
+		""" Write the rows of a refused flush one by one, dropping only the rows the database refuses """
+		for i, (key, row) in enumerate(rows.items()):
+			try:
+				await self._write({key: row})
+			except Exception as e:
+				if get_db().is_transient(e):
+					self._requeue(dict(islice(rows.items(), i, None)))
+					return
+				self.dropped += 1
+				log.error(f"Write-behind dropped {key[0]} row {dict(key[1])} {row[1]}: {repr(e.__cause__ or e)}")
+			else:
+				self.written += 1
+
+	async def flush(self):
+		"""
+		Write all the queued rows. Requeue them under the newer writes if the database is unreachable,
+		otherwise retry them one by one so a bad row does not block the rest of the queue.
+		"""
+		async with self._lock:
+			if not len(self.pending):
+				return
+			self.inflight, self.pending = self.pending, OrderedDict()
+			started = time.monotonic()
+			try:
+				await self._write(self.inflight)
+			except Exception as e:
+				self.failures += 1
+				if get_db().is_transient(e):
+					log.error(f"Write-behind flush of {len(self.inflight)} rows failed, requeued: {repr(e.__cause__ or e)}")
+					self._requeue(self.inflight)
+				else:
+					log.error(f"Write-behind flush of {len(self.inflight)} rows refused: {repr(e.__cause__ or e)}")
+					await self._write_each(self.inflight)
+			else:
+				self.flushes += 1
+				self.written += len(self.inflight)
+				self.flush_samples.append(time.monotonic() - started)
+			finally:
+				self.inflight = dict()
+
+	async def think(self, frame_time):
+		""" Start a flush in the background, on_think must not wait on the database """
+		if len(self.pending) and frame_time >= self.next_flush_at and (self._task is None or self._task.done()):
+			self.next_flush_at = frame_time + self.interval
+			self._task = asyncio.create_task(self.flush())
+
+	def summary(self):
+		samples = sorted(self.flush_samples) or [0]
+		return dict(
+			depth=len(self.pending), queued=self.queued, coalesced=self.coalesced, flushes=self.flushes,
+			written=self.written, failures=self.failures, dropped=self.dropped,
+			flush_avg=sum(samples) * 1000 / len(samples),
+			flush_p95=samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000
+		)
+
+
+writer = WriteBehind(cfg.DB_WRITE_BEHIND_INTERVAL, cfg.DB_WRITE_BEHIND_MAX)
+
+
+class Journal:
+	"""
+	Append-only on-disk journal of write batches that could not be written because the database
+	was unreachable (see Adapter.is_transient()). Batches are replayed in order once it recovers, each one along with
+	its id in the db_journal table, so a batch is never applied twice. While the journal is not empty
+	new batches are journaled as well to keep the write order.
+	"""
+
+	def __init__(self, path, retry_interval=10, keep_days=7):
+		self.path = path
+		self.retry_interval = retry_interval
+		self.keep_days = keep_days
+		self.entries = deque()  # [{id, at, ops: [[method, table, *args], ...]}, ...]
+		self.file = None
+		self.dirty = False
+		self.replaying = False
+		self.next_replay_at = 0
+		self.next_prune_at = 0
+		self._task = None  # replay or prune started by think()
+		self.appended = 0
+		self.replayed = 0
+		self.skipped = 0
+		self.rejected = 0
+		self.fsyncs = 0
+		self.load()
+
+	@staticmethod
+	def register_table():
+		db.register_table(dict(
+			tname="db_journal",
+			columns=[
+				dict(cname="entry_id", ctype=db.types.str),
+				dict(cname="at", ctype=db.types.int)
+			],
+			primary_keys=["entry_id"]
+		))
+
+	def load(self):
+		""" Read the batches left unreplayed by the previous run """
+		if not os.path.exists(self.path):
+			return
+		with open(self.path, 'r') as f:
+			for line in f:
+				try:
+					self.entries.append(json.loads(line))
+				except ValueError:
+					log.error(f"Skipping a corrupted line of the db journal: {line[:100]}")
+		if len(self.entries):
+			log.info(f"Loaded {len(self.entries)} unreplayed write batches from {self.path}.")
+
+	def _append(self, entry):
+		if self.file is None:
+			os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+			self.file = open(self.path, 'a')
+		self.file.write(json.dumps(entry) + "\n")
+		self.file.flush()
+		self.entries.append(entry)
+		self.appended += 1
+		self.dirty = True
+
+	def sync(self):
+		""" fsync the batches appended since the last call """
+		if self.dirty:
+			os.fsync(self.file.fileno())
+			self.dirty = False
+			self.fsyncs += 1
+
+	def _rewrite(self):
+		""" Atomically replace the journal file with the entries left """
+		if self.file is not None:
+			self.file.close()
+			self.file = None
+			self.dirty = False
+		if not len(self.entries):
+			if os.path.exists(self.path):
+				os.remove(self.path)
+			return
+		with open(self.path + '.tmp', 'w') as f:
+			f.writelines((json.dumps(entry) + "\n" for entry in self.entries))
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(self.path + '.tmp', self.path)
+
+	@staticmethod
+	async def _run(entry):
+		async with db.transaction() as tx:
+			await tx.insert('db_journal', dict(entry_id=entry['id'], at=entry['at']))
+			for method, table, *args in entry['ops']:
+				await getattr(tx, method)(table, *args)
+
+	async def apply(self, *ops):
+		"""
+		Run the write ops [method, table, *args] (insert, insert_many, update, delete) in a single transaction,
+		arguments must be json serializable. Return True if written, False if journaled for a later replay.
+		Batches refused by the database are moved to the .rejected file and the error is raised.
+		"""
+		entry = dict(id=uuid4().hex, at=int(time.time()), ops=[list(op) for op in ops])
+		if not len(self.entries) and not self.replaying:
+			try:
+				await self._run(entry)
+				return True
+			except Exception as e:
+				if not get_db().is_transient(e):
+					self._reject(entry)
+					raise
+				log.error(f"Database is unreachable, journaling the writes: {repr(e.__cause__ or e)}")
+		self._append(entry)
+		return False
+
+	async def _is_applied(self, entry):
+		return await db.select_one(['entry_id'], 'db_journal', where=dict(entry_id=entry['id'])) is not None
+
+	async def replay(self):
+		""" Replay the journaled batches in order until the journal is empty or the database fails again """
+		self.replaying = True
+		done = 0
+		try:
+			while len(self.entries):
+				entry = self.entries[0]
+				try:
+					await self._run(entry)
+					self.replayed += 1
+				except IntegrityError:
+					if await self._is_applied(entry):
+						self.skipped += 1
+					else:
+						self._reject(entry)
+				except Exception as e:
+					if get_db().is_transient(e):
+						return False
+					log.error(f"Failed to replay a journaled write batch: {repr(e.__cause__ or e)}")
+					self._reject(entry)
+				self.entries.popleft()
+				done += 1
+			log.info("The db journal is replayed.")
+			return True
+		finally:
+			self.replaying = False
+			if done:
+				self._rewrite()
+
+	def _reject(self, entry):
+		""" Move a batch the database refuses to the .rejected file for manual inspection """
+		self.rejected += 1
+		with open(self.path + '.rejected', 'a') as f:
+			f.write(json.dumps(entry) + "\n")
+
+	async def prune(self, frame_time):
+		""" Delete the ids of the batches written more than keep_days ago """
+		try:
+			await db.background.execute(
+				"DELETE FROM `db_journal` WHERE `at`<%s", (int(frame_time) - self.keep_days * 86400, )
+			)
+		except Exception as e:
+			log.error(f"Failed to prune the db_journal table: {repr(e.__cause__ or e)}")
+
+	async def think(self, frame_time):
+		""" Start the replay or the hourly prune in the background, on_think must not wait on the database """
+		self.sync()
+		if self.replaying or (self._task is not None and not self._task.done()):
+			return
+		if len(self.entries):  # the database is down, no prune until the journal is replayed
+			if frame_time >= self.next_replay_at:
+				self.next_replay_at = frame_time + self.retry_interval
+				self._task = asyncio.create_task(self.replay())
+		elif frame_time >= self.next_prune_at:
+			self.next_prune_at = frame_time + 3600
+			self._task = asyncio.create_task(self.prune(frame_time))
+
+	def close(self):
+		if self.file is not None:
+			self.sync()
+			self.file.close()
+			self.file = None
+
+	def summary(self):
+		return dict(
+			entries=len(self.entries), bytes=os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+			age=int(time.time()) - self.entries[0]['at'] if len(self.entries) else 0,
+			appended=self.appended, replayed=self.replayed, skipped=self.skipped, rejected=self.rejected,
+			fsyncs=self.fsyncs
+		)
+
+
+journal = Journal(cfg.DB_JOURNAL_PATH, cfg.DB_JOURNAL_RETRY)
+
+
+class ReadRouter:
+	"""
+	Read-only helpers for the heavy stats queries (db.read). They run on the DB_READ_URI replica
+	while it is reachable and no more than max_lag seconds behind, on the primary otherwise.
+	"""
+
+	def __init__(self, address, max_lag=30, check_interval=10):
+		self.address = address
+		self.max_lag = max_lag
+		self.check_interval = check_interval
+		self.replica = None
+		self.connected = False
+		self.healthy = False
+		self.lag = None
+		self.checked = False
+		self.next_check_at = 0
+		self._task = None  # check started by think()
+		self.replica_reads = 0
+		self.primary_reads = 0
+		self.fallbacks = 0
+
+	async def check(self):
+		""" Connect to the replica if needed and update its health from the replication lag """
+		was_healthy = self.healthy
+		try:
+			if self.replica is None:
+				db_type, db_address = self.address.split("://", 1)
+				self.replica = import_module('core.DBAdapters.' + db_type).Adapter(db_address, workload='read')
+				self.replica.query_stats = get_db().query_stats
+			if not self.connected:
+				await self.replica.connect()
+				self.connected = True
+			self.lag = await self.replica.replication_lag()
+		except Exception as e:
+			self.lag = None
+			if was_healthy or not self.checked:
+				log.error(f"Read replica is unavailable, reading from the primary: {repr(e.__cause__ or e)}")
+		self.checked = True
+		self.healthy = self.lag is not None and self.lag <= self.max_lag
+		if was_healthy != self.healthy and self.lag is not None:
+			if self.healthy:
+				log.info(f"Reading from the replica, lag {self.lag}s.")
+			else:
+				log.error(f"Read replica lag {self.lag}s is over {self.max_lag}s, reading from the primary.")
+
+	async def think(self, frame_time):
+		""" Start the replica check in the background, on_think must not wait on the connect timeout """
+		if self.address and frame_time >= self.next_check_at and (self._task is None or self._task.done()):
+			self.next_check_at = frame_time + self.check_interval
+			self._task = asyncio.create_task(self.check())
+
+	async def _read(self, method, *args, **kwargs):
+		if self.healthy:
+			try:
+				result = await getattr(self.replica, method)(*args, **kwargs)
+				self.replica_reads += 1
+				return result
+			except OperationalError as e:
+				self.healthy = False
+				self.fallbacks += 1
+				log.error(f"Read replica query failed, reading from the primary: {repr(e.__cause__ or e)}")
+		self.primary_reads += 1
+		return await getattr(get_db(), method)(*args, **kwargs)
+
+	async def select(self, *args, **kwargs):
+		return await self._read('select', *args, **kwargs)
+
+	async def select_one(self, *args, **kwargs):
+		return await self._read('select_one', *args, **kwargs)
+
+	async def fetchone(self, *args):
+		return await self._read('fetchone', *args)
+
+	async def fetchall(self, *args):
+		return await self._read('fetchall', *args)
+
+	async def stream_batches(self, request, args=None, batch=None):
+		""" Falls back to the primary only if the replica fails before the first batch """
+		if self.healthy:
+			started = False
+			try:
+				async with aclosing(self.replica.stream_batches(request, args, batch)) as chunks:
+					async for chunk in chunks:
+						started = True
+						yield chunk
+				self.replica_reads += 1
+				return
+			except OperationalError as e:
+				if started:
+					raise
+				self.healthy = False
+				self.fallbacks += 1
+				log.error(f"Read replica query failed, reading from the primary: {repr(e.__cause__ or e)}")
+		self.primary_reads += 1
+		async with aclosing(get_db().stream_batches(request, args, batch)) as chunks:
+			async for chunk in chunks:
+				yield chunk
+
+	async def stream(self, request, args=None, batch=None):
+		async with aclosing(self.stream_batches(request, args, batch)) as chunks:
+			async for chunk in chunks:
+				for row in chunk:
+					yield row
+
+	async def close(self):
+		if self.connected:
+			self.connected = self.healthy = False
+			await self.replica.close()
+
+	def summary(self):
+		return dict(
+			configured=bool(self.address), healthy=self.healthy, lag=self.lag, replica_reads=self.replica_reads,
+			primary_reads=self.primary_reads, fallbacks=self.fallbacks
+		)
+
+
+reads = ReadRouter(cfg.DB_READ_URI, cfg.DB_READ_MAX_LAG, cfg.DB_READ_CHECK_INTERVAL)
+
+
 # For compatibility with existing code
 class DatabaseProxy:
+	""" Forwards to the adapter, caching select() results of the tables listed in DB_CACHE_TABLES """
+
+	def __init__(self, getter=get_db):
+		self._get = getter
+
 	def __getattr__(self, name):
-		return getattr(get_db(), name)
+		return getattr(self._get(), name)
 	def __await__(self):
-		return get_db().__await__()
+		return self._get().__await__()
+
+	@property
+	def background(self):
+		return DatabaseProxy(lambda: get_db().background)
+
+	@property
+	def read(self):
+		return reads
+
+	async def select(self, columns, table, where=None, order_by=None, order_asc=False, limit=None, one=False):
+		if table not in cache.tables:
+			return await self._get().select(columns, table, where, order_by, order_asc, limit, one)
+
+		key = (table, tuple(columns), tuple(where.items()) if where else (), order_by, order_asc, limit, one)
+		try:
+			found, result = cache.get(key)
+		except TypeError:  # unhashable where values
+			return await self._get().select(columns, table, where, order_by, order_asc, limit, one)
+		if not found:
+			version = cache.versions.get(table, 0)
+			result = await self._get().select(columns, table, where, order_by, order_asc, limit, one)
+			cache.put(key, result, version)
+		return result
+
+	async def select_one(self, *args, **kwargs):
+		return await self.select(*args, **kwargs, one=True)
+
+	async def insert(self, table, *args, **kwargs):
+		try:
+			return await self._get().insert(table, *args, **kwargs)
+		finally:
+			cache.invalidate(table)
+
+	async def update(self, table, *args, **kwargs):
+		try:
+			return await self._get().update(table, *args, **kwargs)
+		finally:
+			cache.invalidate(table)
+
+	async def delete(self, table, *args, **kwargs):
+		try:
+			return await self._get().delete(table, *args, **kwargs)
+		finally:
+			cache.invalidate(table)
+
+	async def insert_many(self, table, *args, **kwargs):
+		try:
+			return await self._get().insert_many(table, *args, **kwargs)
+		finally:
+			cache.invalidate(table)
+
+	async def execute(self, request, *args):
+		try:
+			return await self._get().execute(request, *args)
+		finally:
+			cache.invalidate_sql(request)
+
+	async def executemany(self, request, *args):
+		try:
+			return await self._get().executemany(request, *args)
+		finally:
+			cache.invalidate_sql(request)
+
+	@asynccontextmanager
+	async def transaction(self):
+		""" Writes made through the transaction object are not tracked, drop all the cached tables afterwards """
+		try:
+			async with self._get().transaction() as tx:
+				yield tx
+		finally:
+			cache.invalidate(*cache.tables)
 
 db = DatabaseProxy()
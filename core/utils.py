@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import random
+import asyncio
 import re
 from prettytable import PrettyTable, MARKDOWN
 from nextcord import Embed
@@ -170,3 +171,73 @@ class SafeTemplateDict(dict):
 	""" returns {key} for missing keys, useful for string.format_map() """
 	def __missing__(self, key):
 		return '{'+key+'}'
+
+
+class BatchLoader:
+	"""
+	Coalesces keys requested within the same event loop tick (or window seconds) into a single
+	batch_f(keys) call, which must return a {key: value} dict. Missing keys resolve to None.
+	"""
+
+	def __init__(self, batch_f, window=0, max_batch_size=500):
+		self.batch_f = batch_f
+		self.window = window
+		self.max_batch_size = max_batch_size
+		self.requests = 0  # keys requested
+		self.batches = 0  # batch_f calls
+		self._pending = dict()  # {key: future} waiting for the next dispatch
+		self._handle = None
+		self._tasks = set()  # running _load() tasks, the event loop keeps only weak references to them
+
+	@property
+	def saved(self):
+		""" Number of single key queries saved by the batching """
+		return self.requests - self.batches
+
+	def _schedule(self):
+		if self._handle is None:
+			loop = asyncio.get_running_loop()
+			if self.window:
+				self._handle = loop.call_later(self.window, self._dispatch)
+			else:
+				self._handle = loop.call_soon(self._dispatch)
+
+	def _dispatch(self):
+		self._handle = None
+		pending, self._pending = self._pending, dict()
+		keys = list(pending.keys())
+		for i in range(0, len(keys), self.max_batch_size):
+			chunk = {k: pending[k] for k in keys[i:i+self.max_batch_size]}
+			task = asyncio.create_task(self._load(chunk))
+			self._tasks.add(task)
+			task.add_done_callback(self._tasks.discard)
+
+	async def _load(self, futures):
+		self.batches += 1
+		try:
+			data = await self.batch_f(list(futures.keys()))
+		except Exception as e:
+			for fut in futures.values():
+				if not fut.done():
+					fut.set_exception(e)
+			return
+		for key, fut in futures.items():
+			if not fut.done():
+				fut.set_result(data.get(key))
+
+	async def load_many(self, keys):
+		""" Return {key: value or None} for given keys """
+		keys = list(dict.fromkeys(keys))
+		self.requests += len(keys)
+		futures = []
+		for key in keys:
+			if (fut := self._pending.get(key)) is None:
+				fut = self._pending[key] = asyncio.get_running_loop().create_future()
+			futures.append(fut)
+		if len(keys):
+			self._schedule()
+		# the futures are shared with the other callers, a cancelled caller must not cancel them
+		return dict(zip(keys, await asyncio.gather(*(asyncio.shield(fut) for fut in futures))))
+
+	async def load(self, key):
+		return (await self.load_many((key, )))[key]
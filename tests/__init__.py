@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# Run from the repository root: python -m unittest discover -s tests -t .
+import os
+
+os.environ.setdefault('DC_BOT_TOKEN', 'test')  # the tests never connect to discord
+os.environ.setdefault('DATABASE_URL', 'sqlite://:memory:')
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+""" Shared setup of the database tests, each test runs on a fresh in-memory SQLite database """
+import unittest
+
+from core import database
+from core.database import db, cache, Journal
+
+ROWS_TABLE = dict(
+	tname="test_rows",
+	columns=[
+		dict(cname="id", ctype=db.types.int),
+		dict(cname="value", ctype=db.types.str)
+	]
+)  # no primary key, a row written twice shows up twice
+KEYED_TABLE = dict(
+	tname="test_keyed",
+	columns=[
+		dict(cname="id", ctype=db.types.int, notnull=True),
+		dict(cname="value", ctype=db.types.int)
+	],
+	primary_keys=["id"]
+)
+
+
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+	""" Connects a new adapter to an empty database and creates db_journal and the tables before each test """
+
+	tables = (ROWS_TABLE, KEYED_TABLE)
+
+	async def asyncSetUp(self):
+		database._db = None
+		cache.entries.clear()
+		await db.connect()
+		Journal.register_table()
+		for table in self.tables:
+			db.register_table(table)
+		await db.reconcile_tables()
+
+	async def asyncTearDown(self):
+		await db.close()  # the in-memory database is dropped with its last connection
+		database._db = None
+		cache.entries.clear()
+
+	async def rows(self, table='test_rows'):
+		return await database.get_db().fetchall(f"SELECT * FROM `{table}` ORDER BY `id`")
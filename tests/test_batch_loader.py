@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import gc
+import asyncio
+import unittest
+
+from core.utils import BatchLoader
+
+
+class BatchLoaderTest(unittest.IsolatedAsyncioTestCase):
+
+	def loader(self, **kwargs):
+		self.calls = []
+
+		async def batch_f(keys):
+			self.calls.append(keys)
+			await asyncio.sleep(0)
+			return {key: key * 10 for key in keys if key >= 0}  # negative keys are missing
+
+		return BatchLoader(batch_f, **kwargs)
+
+	async def test_coalescing(self):
+		loader = self.loader()
+		results = await asyncio.gather(loader.load_many([1, 2, 3]), loader.load_many([3, 4]), loader.load(1))
+		self.assertEqual(results, [{1: 10, 2: 20, 3: 30}, {3: 30, 4: 40}, 10])
+		self.assertEqual(self.calls, [[1, 2, 3, 4]])
+		self.assertEqual((loader.requests, loader.batches, loader.saved), (6, 1, 5))
+
+	async def test_separate_ticks(self):
+		loader = self.loader()
+		self.assertEqual(await loader.load(1), 10)
+		self.assertEqual(await loader.load(1), 10)
+		self.assertEqual(self.calls, [[1], [1]])
+
+	async def test_window(self):
+		loader = self.loader(window=0.01)
+
+		async def late():
+			await asyncio.sleep(0.001)
+			return await loader.load(2)
+
+		self.assertEqual(await asyncio.gather(loader.load(1), late()), [10, 20])
+		self.assertEqual(self.calls, [[1, 2]])
+
+	async def test_chunking(self):
+		loader = self.loader(max_batch_size=3)
+		results = await asyncio.gather(*(loader.load(i) for i in range(8)))
+		self.assertEqual(results, [i * 10 for i in range(8)])
+		self.assertEqual(self.calls, [[0, 1, 2], [3, 4, 5], [6, 7]])
+
+	async def test_missing_and_duplicate_keys(self):
+		loader = self.loader()
+		self.assertEqual(await loader.load_many([-1, 2, 2, -1]), {-1: None, 2: 20})
+		self.assertEqual(await loader.load_many([]), {})
+		self.assertEqual(self.calls, [[-1, 2]])
+
+	async def test_error(self):
+		async def batch_f(keys):
+			raise ValueError(keys)
+
+		loader = BatchLoader(batch_f)
+		results = await asyncio.gather(loader.load(1), loader.load(2), return_exceptions=True)
+		self.assertEqual([type(r) for r in results], [ValueError, ValueError])
+		self.assertIs(results[0], results[1])
+
+	async def test_cancelled_caller(self):
+		loader = self.loader()
+		first = asyncio.ensure_future(loader.load_many([1, 2]))
+		second = asyncio.ensure_future(loader.load_many([2, 3]))
+		await asyncio.sleep(0)
+		first.cancel()
+		self.assertEqual(await second, {2: 20, 3: 30})
+		self.assertTrue(first.cancelled())
+
+	async def test_tasks_are_referenced(self):
+		release, started = asyncio.Event(), asyncio.Event()
+
+		async def batch_f(keys):
+			started.set()
+			await release.wait()
+			return {key: key for key in keys}
+
+		loader = BatchLoader(batch_f)
+		pending = asyncio.ensure_future(loader.load_many(range(5)))
+		await started.wait()
+		gc.collect()  # only the loader references the running load task
+		self.assertEqual(len(loader._tasks), 1)
+		release.set()
+		self.assertEqual(await pending, {i: i for i in range(5)})
+		self.assertEqual(len(loader._tasks), 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+from core.database import db, Journal
+from core.DBAdapters.common import OperationalError, ProgrammingError
+from tests.common import DatabaseTestCase
+
+
+class JournalTest(DatabaseTestCase):
+
+	async def asyncSetUp(self):
+		await super().asyncSetUp()
+		self.dir = tempfile.mkdtemp(prefix='pubobot-test-')
+		self.path = os.path.join(self.dir, 'db_journal.jsonl')
+
+	async def asyncTearDown(self):
+		await super().asyncTearDown()
+		shutil.rmtree(self.dir)
+
+	async def journal_batches(self, count=3):
+		""" Journal count batches as if the database was unreachable, return the journal file copy """
+		journal = Journal(self.path)
+		with mock.patch.object(Journal, '_run', side_effect=OperationalError()):
+			for i in range(count):
+				written = await journal.apply(
+					('insert', 'test_rows', dict(id=i, value=f"row{i}")),
+					('insert_many', 'test_rows', [dict(id=100 + i, value="many")])
+				)
+				self.assertFalse(written)
+		journal.close()
+		shutil.copy(self.path, self.path + '.copy')
+		return self.path + '.copy'
+
+	def assertAppliedOnce(self, rows, count=3):
+		self.assertEqual(sorted((r['id'] for r in rows)), [*range(count), *range(100, 100 + count)])
+
+	async def test_apply(self):
+		journal = Journal(self.path)
+		self.assertTrue(await journal.apply(('insert', 'test_rows', dict(id=1, value="a"))))
+		self.assertEqual(len(journal.entries), 0)
+		self.assertFalse(os.path.exists(self.path))
+		self.assertEqual(await self.rows(), [dict(id=1, value="a")])
+
+	async def test_replay(self):
+		await self.journal_batches()
+		self.assertEqual(await self.rows(), [])
+
+		journal = Journal(self.path)
+		self.assertEqual(len(journal.entries), 3)
+		self.assertTrue(await journal.replay())
+		self.assertEqual((journal.replayed, journal.skipped, journal.rejected), (3, 0, 0))
+		self.assertFalse(os.path.exists(self.path))
+		self.assertAppliedOnce(await self.rows())
+
+	async def test_replay_same_file_twice(self):
+		copy = await self.journal_batches()
+		first = Journal(self.path)
+		self.assertTrue(await first.replay())
+
+		shutil.copy(copy, self.path)  # e.g. the journal file restored from a backup
+		second = Journal(self.path)
+		self.assertTrue(await second.replay())
+		self.assertEqual((second.replayed, second.skipped, second.rejected), (0, 3, 0))
+		self.assertAppliedOnce(await self.rows())
+
+	async def test_concurrent_replay(self):
+		# two bot processes sharing the journal file and the database
+		await self.journal_batches()
+		first, second = Journal(self.path), Journal(self.path)
+		await asyncio.gather(first.replay(), second.replay())
+		for journal in (first, second):
+			for attempt in range(10):  # a replay stopped by a locked database is retried, as think() does
+				if not len(journal.entries):
+					break
+				await journal.replay()
+			self.assertEqual(len(journal.entries), 0)
+		self.assertEqual(first.replayed + second.replayed, 3)
+		self.assertEqual(first.skipped + second.skipped, 3)
+		self.assertEqual(first.rejected + second.rejected, 0)
+		self.assertAppliedOnce(await self.rows())
+
+	async def test_new_batches_wait_for_replay(self):
+		await self.journal_batches(count=1)
+		journal = Journal(self.path)
+		self.assertFalse(await journal.apply(('insert', 'test_rows', dict(id=1, value="after"))))
+		self.assertEqual(await self.rows(), [])
+		self.assertTrue(await journal.replay())
+		self.assertEqual([r['value'] for r in await self.rows()], ["row0", "after", "many"])
+
+	async def test_refused_batch(self):
+		journal = Journal(self.path)
+		with self.assertRaises(ProgrammingError):
+			await journal.apply(('insert', 'test_missing', dict(id=1)))
+		self.assertEqual(len(journal.entries), 0)
+		self.assertEqual(journal.rejected, 1)
+		with open(self.path + '.rejected') as f:
+			self.assertEqual(json.loads(f.readline())['ops'], [['insert', 'test_missing', dict(id=1)]])
+
+	async def test_refused_batch_on_replay(self):
+		# the first batch conflicts with a row written meanwhile, the replay moves on to the next one
+		await self.journal_batches(count=1)
+		journal = Journal(self.path)
+		journal._append(dict(id='conflict', at=0, ops=[['insert', 'test_keyed', dict(id=1, value=1)]]))
+		journal._append(dict(id='next', at=0, ops=[['insert', 'test_keyed', dict(id=2, value=2)]]))
+		journal.close()
+		await db.insert('test_keyed', dict(id=1, value=0))
+
+		journal = Journal(self.path)
+		self.assertTrue(await journal.replay())
+		self.assertEqual((journal.replayed, journal.skipped, journal.rejected), (2, 0, 1))
+		self.assertEqual(await self.rows('test_keyed'), [dict(id=1, value=0), dict(id=2, value=2)])
+
+	async def test_think_replays_in_background(self):
+		await self.journal_batches()
+		journal = Journal(self.path, retry_interval=10)
+		await journal.think(100)
+		self.assertEqual(len(journal.entries), 3, "think() must not wait on the replay")
+		task = journal._task
+		await journal.think(200)
+		self.assertIs(journal._task, task, "one replay at a time")
+		await task
+		self.assertEqual(len(journal.entries), 0)
+		self.assertAppliedOnce(await self.rows())
+
+	async def test_think_retries(self):
+		await self.journal_batches(count=1)
+		journal = Journal(self.path, retry_interval=10)
+		with mock.patch.object(Journal, '_run', side_effect=OperationalError()):
+			await journal.think(100)
+			self.assertFalse(await journal._task)
+		await journal.think(105)  # not due yet
+		self.assertEqual(len(journal.entries), 1)
+		await journal.think(110)
+		await journal._task
+		self.assertEqual(len(journal.entries), 0)
+
+	async def test_prune(self):
+		await db.insert_many('db_journal', [dict(entry_id='old', at=0), dict(entry_id='new', at=8 * 86400)])
+
+		await self.journal_batches(count=1)
+		journal = Journal(self.path, keep_days=7)
+		with mock.patch.object(Journal, 'replay', return_value=False):
+			await journal.think(9 * 86400)
+			await journal._task
+		ids = [r['entry_id'] for r in await db.fetchall("SELECT `entry_id` FROM `db_journal`")]
+		self.assertIn('old', ids, "no prune while batches wait for the replay")
+
+		await journal.replay()
+		await journal.think(9 * 86400 + 1)
+		await journal._task
+		ids = [r['entry_id'] for r in await db.fetchall("SELECT `entry_id` FROM `db_journal`")]
+		self.assertNotIn('old', ids)
+		self.assertIn('new', ids)
+		task = journal._task
+		await journal.think(9 * 86400 + 60)
+		self.assertIs(journal._task, task, "hourly prune")
+
+
+if __name__ == '__main__':
+	unittest.main()
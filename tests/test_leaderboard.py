@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+from time import time
+from unittest import mock
+
+from core.database import db
+from bot.stats import stats
+from bot.stats.leaderboard import Leaderboard, LeaderboardView
+from tests.common import DatabaseTestCase
+
+
+def player(user_id, rating, is_hidden=0, wins=10, last_ranked_match_at=None, **kwargs):
+	return dict(
+		channel_id=1, user_id=user_id, nick=f"player{user_id}", rating=rating, deviation=100,
+		wins=wins, losses=0, draws=0, streak=0, is_hidden=is_hidden, last_ranked_match_at=last_ranked_match_at
+	) | kwargs
+
+
+class LeaderboardTest(DatabaseTestCase):
+
+	async def asyncSetUp(self):
+		await super().asyncSetUp()
+		stats.register_tables()
+		await db.reconcile_tables()
+		await db.insert_many('qc_players', [
+			player(1, 1500), player(2, 1700), player(3, 1600, is_hidden=1), player(4, None), player(5, 1400)
+		])
+		await db.insert('qc_players', dict(player(1, 2000), channel_id=2))
+		self.lb = Leaderboard(channel_id=1)
+
+	async def user_ids(self):
+		rows, version = await self.lb.get()
+		return [row['user_id'] for row in rows]
+
+	async def test_snapshot(self):
+		rows, version = await self.lb.get()
+		self.assertEqual([(r['user_id'], r['rating']) for r in rows], [(2, 1700), (1, 1500), (5, 1400)])
+		self.assertEqual(set(self.lb.players.keys()), {1, 2, 3, 5}, "rated and hidden players are loaded")
+		self.assertEqual(await self.lb.get(), (rows, version))
+		self.assertEqual(self.lb.loads, 1)
+
+	async def test_write_through(self):
+		rows, version = await self.lb.get()
+		self.lb.update(5, rating=1800)
+		self.lb.update(2, is_hidden=1)
+		self.lb.update(3, is_hidden=0)
+		rows, new_version = await self.lb.get()
+		self.assertEqual([(r['user_id'], r['rating']) for r in rows], [(5, 1800), (3, 1600), (1, 1500)])
+		self.assertGreater(new_version, version)
+		self.assertEqual(self.lb.loads, 1)
+
+		self.lb.update(1, streak=2, wins=11)
+		self.lb.update(1, not_a_column=1)  # ignored
+		rows, version = await self.lb.get()
+		self.assertEqual(rows[2], {c: v for c, v in player(1, 1500, wins=11, streak=2).items() if c in Leaderboard.columns})
+		self.assertEqual(self.lb.loads, 1)
+
+	async def test_new_players(self):
+		await self.lb.get()
+		# a complete row of a player who was not rated yet is added in place
+		self.lb.update(6, **{c: v for c, v in player(6, 1650).items() if c in Leaderboard.columns and c != 'user_id'})
+		self.assertEqual(await self.user_ids(), [2, 6, 1, 5])
+		self.assertEqual(self.lb.loads, 1)
+
+		# a rating alone can not complete the row, the snapshot is reloaded
+		await db.update('qc_players', dict(rating=1550), keys=dict(channel_id=1, user_id=4))
+		self.lb.update(4, rating=1550)
+		self.assertIsNone(self.lb.players)
+		self.assertEqual(await self.user_ids(), [2, 4, 1, 5])
+		self.assertEqual(self.lb.loads, 2)
+
+	async def test_update_all(self):
+		rows, version = await self.lb.get()
+		self.lb.update_all(rating=None, deviation=None)
+		rows, new_version = await self.lb.get()
+		self.assertEqual(rows, [])
+		self.assertGreater(new_version, version)
+
+	async def test_write_while_loading(self):
+		# a write during the load makes the loaded rows stale, they are served once but not cached
+		task = asyncio.ensure_future(self.lb.get())
+		await asyncio.sleep(0)
+		self.assertIsNotNone(self.lb._loading)
+		await db.update('qc_players', dict(rating=1900), keys=dict(channel_id=1, user_id=5))
+		self.lb.update(5, rating=1900)
+		rows, version = await task
+		self.assertIsNone(version)
+		self.assertIsNone(self.lb.players)
+		self.assertEqual(await self.user_ids(), [5, 2, 1])
+		self.assertEqual(self.lb.loads, 2)
+
+	async def test_concurrent_loads(self):
+		results = await asyncio.gather(*(self.lb.get() for i in range(5)))
+		self.assertEqual(self.lb.loads, 1)
+		self.assertEqual(len({version for rows, version in results}), 1)
+
+	async def test_max_age(self):
+		await self.lb.get()
+		with mock.patch('bot.stats.leaderboard.cfg.LB_SNAPSHOT_MAX_AGE', 0):
+			await self.lb.get()
+		self.assertEqual(self.lb.loads, 2)
+
+	async def test_invalidate(self):
+		rows, version = await self.lb.get()
+		self.lb.invalidate()
+		self.assertIsNone(self.lb.age)
+		rows, new_version = await self.lb.get()
+		self.assertGreater(new_version, version)
+		self.assertEqual(self.lb.loads, 2)
+
+
+class LeaderboardViewTest(unittest.TestCase):
+
+	def test_filters(self):
+		now = int(time())
+		rows = [
+			player(1, 1800, wins=30, last_ranked_match_at=now - 100),
+			player(2, 1700, wins=5, last_ranked_match_at=now - 100),
+			player(3, 1600, wins=30, last_ranked_match_at=now - 5000),
+			player(4, 1500, wins=30, last_ranked_match_at=now - 500),
+		]
+		view = LeaderboardView(rows, 1, min_matches=20, last_match_limit=1000)
+		self.assertEqual([r['user_id'] for r in view.rows], [1, 4])
+		self.assertEqual(view.expires_at, now + 500)
+		self.assertTrue(view.valid(1))
+		self.assertFalse(view.valid(2))
+		with mock.patch('bot.stats.leaderboard.time', return_value=now + 500):
+			self.assertFalse(view.valid(1), "player 4 falls out of the last match limit")
+
+	def test_uncached_snapshot(self):
+		self.assertFalse(LeaderboardView([], None).valid(None))
+
+	def test_pages(self):
+		view = LeaderboardView([player(i, 2000 - i) for i in range(25)], 1)
+		self.assertEqual(view.pages(10), 3)
+		calls = []
+
+		def render(position, row):
+			calls.append(position)
+			return f"{position + 1}. {row['nick']}"
+
+		page = view.page(2, 10, render)
+		self.assertEqual([(position, line) for position, row, line in page], [
+			(20, "21. player20"), (21, "22. player21"), (22, "23. player22"), (23, "24. player23"), (24, "25. player24")
+		])
+		view.page(2, 10, render)
+		self.assertEqual(len(calls), 5, "rendered rows are reused")
+		view.page(2, 10, render, style='compact')
+		self.assertEqual(len(calls), 10, "each style is rendered on its own")
+		self.assertEqual(view.page(3, 10, render), [])
+		self.assertEqual(view.page(-1, 10, render), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
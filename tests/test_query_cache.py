@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import unittest
+from unittest import mock
+
+from core.database import db, get_db, cache, QueryCache
+from tests.common import DatabaseTestCase
+
+
+class QueryCacheTest(unittest.TestCase):
+
+	def test_lru(self):
+		c = QueryCache(('a', ), size=2)
+		for i in range(3):
+			c.put(('a', i), [dict(i=i)], 0)
+		self.assertEqual(c.get(('a', 0)), (False, None))
+		self.assertEqual(c.get(('a', 1)), (True, [dict(i=1)]))
+		c.put(('a', 3), [dict(i=3)], 0)  # ('a', 2) is the least recently used now
+		self.assertEqual(c.get(('a', 2)), (False, None))
+		self.assertEqual(c.get(('a', 1)), (True, [dict(i=1)]))
+
+	def test_ttl(self):
+		c = QueryCache(('a', ), ttl=60)
+		c.put(('a', 1), dict(i=1), 0)
+		self.assertTrue(c.get(('a', 1))[0])
+		with mock.patch('core.database.time.monotonic', return_value=10**12):
+			self.assertEqual(c.get(('a', 1)), (False, None))
+
+	def test_copies(self):
+		c = QueryCache(('a', ))
+		result = [dict(i=1)]
+		c.put(('a', 1), result, 0)
+		result[0]['i'] = 2
+		c.get(('a', 1))[1][0]['i'] = 3
+		self.assertEqual(c.get(('a', 1)), (True, [dict(i=1)]))
+
+	def test_stale_put(self):
+		c = QueryCache(('a', ))
+		version = c.versions.get('a', 0)
+		c.invalidate('a')  # written while the select was running
+		c.put(('a', 1), dict(i=1), version)
+		self.assertEqual(c.get(('a', 1)), (False, None))
+
+	def test_invalidate_sql(self):
+		c = QueryCache(('a', 'b', 'c', 'd'))
+		for table in c.tables:
+			c.put((table, 1), dict(i=1), 0)
+		c.invalidate_sql("UPDATE `a` SET x=1")
+		c.invalidate_sql("INSERT INTO b (x) SELECT y FROM `e` JOIN c ON 1")
+		self.assertEqual(sorted((k[0] for k in c.entries.keys())), ['d'])
+		c.invalidate_sql("DELETE FROM d WHERE 1")
+		self.assertEqual(len(c.entries), 0)
+
+
+class DatabaseProxyCacheTest(DatabaseTestCase):
+
+	async def asyncSetUp(self):
+		await super().asyncSetUp()
+		patcher = mock.patch.object(cache, 'tables', {'test_rows'})
+		patcher.start()
+		self.addCleanup(patcher.stop)
+		await get_db().insert('test_rows', dict(id=1, value="a"))
+
+	async def select(self):
+		return await db.select(('id', 'value'), 'test_rows', where=dict(id=1))
+
+	async def assertCached(self, expected):
+		hits = cache.hits
+		self.assertEqual(await self.select(), expected)
+		self.assertEqual(cache.hits, hits + 1, "select() was not served by the cache")
+
+	async def test_hit(self):
+		self.assertEqual(await self.select(), [dict(id=1, value="a")])
+		await self.assertCached([dict(id=1, value="a")])
+
+	async def test_not_cached_tables(self):
+		await db.select(('id', ), 'test_keyed')
+		misses = cache.misses
+		await db.select(('id', ), 'test_keyed')
+		self.assertEqual(cache.misses, misses)
+		self.assertFalse(any((k[0] == 'test_keyed' for k in cache.entries.keys())))
+
+	async def test_other_writers(self):
+		# writes that do not go through the proxy are only seen once the entry expires
+		await self.select()
+		await get_db().update('test_rows', dict(value="b"), keys=dict(id=1))
+		await self.assertCached([dict(id=1, value="a")])
+
+	async def test_invalidation(self):
+		writes = (
+			lambda: db.update('test_rows', dict(value="b"), keys=dict(id=1)),
+			lambda: db.insert('test_rows', dict(id=1, value="c")),
+			lambda: db.insert_many('test_rows', [dict(id=1, value="d")]),
+			lambda: db.delete('test_rows', where=dict(value="b")),
+			lambda: db.execute("UPDATE `test_rows` SET `value`=%s WHERE `value`=%s", ("e", "c")),
+			lambda: db.executemany("INSERT INTO `test_rows` (`id`, `value`) VALUES (%s, %s)", [(1, "f")]),
+		)
+		for write in writes:
+			before = await self.select()
+			await self.assertCached(before)
+			await write()
+			self.assertNotEqual(await self.select(), before)
+
+	async def test_transaction(self):
+		await self.select()
+		async with db.transaction() as tx:
+			await tx.update('test_rows', dict(value="b"), keys=dict(id=1))
+		self.assertEqual(await self.select(), [dict(id=1, value="b")])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import io
+import random
+import unittest
+from contextlib import redirect_stdout
+
+from bot.stats.rating import FlatRating, Glicko2Rating, TrueSkillRating, Quidditch6v6Rating
+
+SYSTEMS = (
+	(FlatRating, dict()),
+	(FlatRating, dict(draw_bonus=50, ws_boost=True, ls_boost=True, scale=150)),
+	(Glicko2Rating, dict()),
+	(Glicko2Rating, dict(min_deviation=60, ws_boost=True, ls_boost=True, loss_scale=80, draw_bonus=20)),
+	(TrueSkillRating, dict()),
+	(TrueSkillRating, dict(init_rp=1200, init_deviation=200, ws_boost=True, min_deviation=50)),
+	(Quidditch6v6Rating, dict()),
+	(Quidditch6v6Rating, dict(ls_boost=True, ws_boost=True, win_scale=120, draw_bonus=30)),
+)
+TOLERANCE = 1  # rating points, the float rounding of the kernels may flip a .5
+
+
+def player(rnd, user_id, **kwargs):
+	return dict(dict(
+		user_id=user_id, channel_id=1, rating=rnd.randint(500, 2800), deviation=rnd.randint(40, 350),
+		wins=rnd.randint(0, 50), losses=rnd.randint(0, 50), draws=rnd.randint(0, 5), streak=rnd.randint(-8, 8)
+	), **kwargs)
+
+
+def random_match(rnd, draw=None):
+	size = rnd.randint(1, 6)
+	losers_size = size if rnd.random() < 0.8 else rnd.randint(1, 6)
+	players = [player(rnd, user_id) for user_id in rnd.sample(range(10**6), size + losers_size)]
+	match = dict(winners=players[:size], losers=players[size:], draw=rnd.random() < 0.1 if draw is None else draw)
+	if rnd.random() < 0.8:
+		for key, team in (('winner_meta', match['winners']), ('loser_meta', match['losers'])):
+			match[key] = dict(
+				members={}, captains={team[0]['user_id']},
+				draft_positions={p['user_id']: rnd.randint(-1, 11) for p in team if rnd.random() < 0.8}
+			)
+	return match
+
+
+class RateManyTest(unittest.TestCase):
+
+	def rate(self, system, matches):
+		with redirect_stdout(io.StringIO()):  # Glicko2Rating.rate() prints the scores
+			return [system.rate(**m) for m in matches]
+
+	def assertResultsEqual(self, expected, results):
+		self.assertEqual(len(expected), len(results))
+		for expected_match, match in zip(expected, results):
+			for expected_team, team in zip(expected_match, match):
+				self.assertEqual(len(expected_team), len(team))
+				for expected_player, p in zip(expected_team, team):
+					self.assertEqual(expected_player.keys(), p.keys())
+					for key in expected_player.keys():
+						if key in ('rating', 'deviation'):
+							self.assertIsInstance(p[key], int)
+							self.assertLessEqual(abs(expected_player[key] - p[key]), TOLERANCE, key)
+						else:
+							self.assertEqual(expected_player[key], p[key], key)
+
+	def test_random_matches(self):
+		rnd = random.Random(1)
+		for cls, kwargs in SYSTEMS:
+			with self.subTest(system=cls.__name__, **kwargs):
+				system = cls(channel_id=1, **kwargs)
+				matches = [random_match(rnd) for i in range(500)]
+				before = repr(matches)
+				results = system.rate_many(matches)
+				self.assertEqual(before, repr(matches), "rate_many() must not modify the matches")
+				self.assertResultsEqual(self.rate(system, matches), results)
+
+	def test_draws(self):
+		rnd = random.Random(2)
+		for cls, kwargs in SYSTEMS:
+			with self.subTest(system=cls.__name__, **kwargs):
+				system = cls(channel_id=1, **kwargs)
+				matches = [random_match(rnd, draw=True) for i in range(100)]
+				self.assertResultsEqual(self.rate(system, matches), system.rate_many(matches))
+
+	def test_empty_batch(self):
+		for cls, kwargs in SYSTEMS:
+			self.assertEqual(cls(channel_id=1, **kwargs).rate_many([]), [])
+
+	def test_empty_teams(self):
+		rnd = random.Random(3)
+		for cls, kwargs in SYSTEMS:
+			with self.subTest(system=cls.__name__, **kwargs):
+				system = cls(channel_id=1, **kwargs)
+				matches = [random_match(rnd), dict(winners=[player(rnd, 1)], losers=[]), random_match(rnd)]
+				try:
+					expected = self.rate(system, matches)
+				except Exception as e:
+					with self.assertRaises(type(e)), redirect_stdout(io.StringIO()):
+						system.rate_many(matches)
+				else:
+					self.assertResultsEqual(expected, system.rate_many(matches))
+
+	def test_floating_point_error(self):
+		rnd = random.Random(4)
+		system = TrueSkillRating(channel_id=1)
+		hopeless = dict(
+			winners=[player(rnd, 1, rating=0, deviation=1)], losers=[player(rnd, 2, rating=100000, deviation=1)]
+		)
+		with self.assertRaises(FloatingPointError):
+			system.rate(**hopeless)
+		with self.assertRaises(FloatingPointError):
+			system.rate_many([random_match(rnd), hopeless])
+
+
+if __name__ == '__main__':
+	unittest.main()
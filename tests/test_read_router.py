@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from contextlib import aclosing
+
+from core.database import db, ReadRouter
+from core.DBAdapters import sqlite
+from core.DBAdapters.common import OperationalError
+from tests.common import DatabaseTestCase, ROWS_TABLE
+
+
+class ReadRouterTest(DatabaseTestCase):
+	""" The primary is the in-memory database, the replica stand-in a database file with different rows """
+
+	async def asyncSetUp(self):
+		await super().asyncSetUp()
+		await db.insert('test_rows', dict(id=1, value="primary"))
+		self.dir = tempfile.mkdtemp(prefix='pubobot-test-')
+		self.path = os.path.join(self.dir, 'replica.db')
+		replica = sqlite.Adapter(self.path, workload='read')
+		await replica.connect()
+		replica.register_table(ROWS_TABLE)
+		await replica.reconcile_tables()
+		await replica.insert('test_rows', dict(id=1, value="replica"))
+		await replica.close()
+		self.reads = ReadRouter('sqlite://' + self.path, max_lag=30)
+
+	async def asyncTearDown(self):
+		await self.reads.close()
+		await super().asyncTearDown()
+		shutil.rmtree(self.dir)
+
+	async def value(self):
+		return (await self.reads.fetchone("SELECT `value` FROM `test_rows` WHERE `id`=%s", (1, )))['value']
+
+	async def test_unchecked(self):
+		self.assertEqual(await self.value(), "primary")
+		self.assertEqual((self.reads.replica_reads, self.reads.primary_reads), (0, 1))
+
+	async def test_replica(self):
+		await self.reads.check()
+		self.assertTrue(self.reads.healthy)
+		self.assertEqual(await self.value(), "replica")
+		self.assertEqual((await self.reads.select_one(('value', ), 'test_rows'))['value'], "replica")
+		async with aclosing(self.reads.stream_batches("SELECT `value` FROM `test_rows`")) as chunks:
+			self.assertEqual([chunk async for chunk in chunks], [[dict(value="replica")]])
+		self.assertEqual((self.reads.replica_reads, self.reads.primary_reads), (3, 0))
+
+	async def test_unreachable(self):
+		reads = ReadRouter('sqlite://' + os.path.join(self.dir, 'missing', 'replica.db'))
+		await reads.check()
+		self.assertFalse(reads.healthy)
+		self.assertIsNone(reads.lag)
+		self.assertEqual((await reads.fetchone("SELECT `value` FROM `test_rows`"))['value'], "primary")
+
+	async def test_lag(self):
+		await self.reads.check()
+		with mock.patch.object(self.reads.replica, 'replication_lag', return_value=31):
+			await self.reads.check()
+		self.assertFalse(self.reads.healthy)
+		self.assertEqual(await self.value(), "primary")
+		await self.reads.check()
+		self.assertTrue(self.reads.healthy)
+		self.assertEqual(await self.value(), "replica")
+
+	async def test_fallback(self):
+		await self.reads.check()
+		with mock.patch.object(self.reads.replica, 'fetchone', side_effect=OperationalError()):
+			self.assertEqual(await self.value(), "primary")
+		self.assertFalse(self.reads.healthy)
+		self.assertEqual(self.reads.fallbacks, 1)
+		self.assertEqual(await self.value(), "primary")  # until the next check
+		await self.reads.check()
+		self.assertEqual(await self.value(), "replica")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import unittest
+from contextlib import aclosing
+
+from core.database import db
+from core.DBAdapters.common import IntegrityError
+from tests.common import DatabaseTestCase
+
+
+class TransactionTest(DatabaseTestCase):
+
+	async def test_commit(self):
+		async with db.transaction() as tx:
+			await tx.insert('test_rows', dict(id=1, value="a"))
+			await tx.insert_many('test_rows', [dict(id=2, value="b"), dict(id=3, value="c")])
+			await tx.update('test_rows', dict(value="B"), keys=dict(id=2))
+			await tx.delete('test_rows', where=dict(id=3))
+			self.assertEqual(await tx.select(('id', 'value'), 'test_rows', order_by='id', order_asc=True), [
+				dict(id=1, value="a"), dict(id=2, value="B")
+			])
+		self.assertEqual(await self.rows(), [dict(id=1, value="a"), dict(id=2, value="B")])
+
+	async def test_rollback(self):
+		with self.assertRaises(IntegrityError):
+			async with db.transaction() as tx:
+				await tx.insert('test_rows', dict(id=1, value="a"))
+				await tx.insert('test_keyed', dict(id=1, value=1))
+				await tx.insert('test_keyed', dict(id=1, value=2))
+		self.assertEqual(await self.rows(), [])
+		self.assertEqual(await self.rows('test_keyed'), [])
+
+	async def test_savepoint_rollback(self):
+		async with db.transaction() as tx:
+			await tx.insert('test_rows', dict(id=1, value="outer"))
+			with self.assertRaises(IntegrityError):
+				async with tx.transaction() as sp:
+					await sp.insert('test_rows', dict(id=2, value="inner"))
+					await sp.insert('test_keyed', dict(id=1, value=1))
+					await sp.insert('test_keyed', dict(id=1, value=1))
+			async with tx.savepoint():
+				await tx.insert('test_rows', dict(id=3, value="second inner"))
+		self.assertEqual([r['value'] for r in await self.rows()], ["outer", "second inner"])
+		self.assertEqual(await self.rows('test_keyed'), [])
+
+	async def test_nested_savepoints(self):
+		async with db.transaction() as tx:
+			async with tx.transaction():
+				await tx.insert('test_rows', dict(id=1, value="kept"))
+				with self.assertRaises(ValueError):
+					async with tx.transaction():
+						await tx.insert('test_rows', dict(id=2, value="dropped"))
+						raise ValueError()
+		self.assertEqual([r['value'] for r in await self.rows()], ["kept"])
+
+	async def test_commit_hooks(self):
+		called = []
+		async with db.transaction() as tx:
+			tx.on_commit(called.append, 1)
+			async with tx.transaction():
+				tx.on_commit(called.append, 2)
+			with self.assertRaises(ValueError):
+				async with tx.transaction():
+					tx.on_commit(called.append, 'rolled back')
+					raise ValueError()
+			tx.on_commit(lambda **kwargs: called.append(kwargs), value=3)
+			self.assertEqual(called, [], "hooks must wait for the commit")
+		self.assertEqual(called, [1, 2, dict(value=3)])
+
+	async def test_no_commit_hooks_on_rollback(self):
+		called = []
+		with self.assertRaises(ValueError):
+			async with db.transaction() as tx:
+				tx.on_commit(called.append, 1)
+				raise ValueError()
+		self.assertEqual(called, [])
+
+	async def test_optional_transaction(self):
+		# `async with (tx or db).transaction() as tx:` joins the caller's transaction if there is one
+		async def write(value, tx=None):
+			async with (tx or db).transaction() as tx:
+				await tx.insert('test_rows', dict(id=len(await tx.select(('id', ), 'test_rows')) + 1, value=value))
+
+		await write("own")
+		with self.assertRaises(ValueError):
+			async with db.transaction() as tx:
+				await write("joined", tx=tx)
+				raise ValueError()
+		self.assertEqual([r['value'] for r in await self.rows()], ["own"])
+
+	async def test_stream_batches(self):
+		await db.insert_many('test_rows', [dict(id=i, value=str(i)) for i in range(25)])
+		async with db.transaction() as tx:
+			batches = []
+			async with aclosing(tx.stream_batches("SELECT `id` FROM `test_rows` ORDER BY `id`", batch=10)) as chunks:
+				async for chunk in chunks:
+					batches.append(len(chunk))
+					# the connection is free for the writes of the transaction between the batches
+					await tx.update('test_rows', dict(value="seen"), keys=dict(id=chunk[0]['id']))
+		self.assertEqual(batches, [10, 10, 5])
+		self.assertEqual([r['id'] for r in await self.rows() if r['value'] == "seen"], [0, 10, 20])
+
+
+if __name__ == '__main__':
+	unittest.main()
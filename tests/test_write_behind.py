@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import unittest
+from unittest import mock
+
+from core.database import db, WriteBehind
+from core.DBAdapters.common import OperationalError
+from tests.common import DatabaseTestCase
+
+
+class WriteBehindTest(DatabaseTestCase):
+
+	async def asyncSetUp(self):
+		await super().asyncSetUp()
+		await db.insert_many('test_keyed', [dict(id=i, value=0) for i in range(1, 4)])
+		self.writer = WriteBehind(interval=5, max_pending=10)
+
+	async def test_coalescing(self):
+		w = self.writer
+		w.update('test_keyed', dict(value=1), dict(id=1))
+		w.update('test_keyed', dict(value=2), dict(id=1))
+		w.upsert('test_keyed', dict(value=7), dict(id=9))
+		self.assertEqual(len(w.pending), 2)
+		self.assertEqual((w.queued, w.coalesced), (3, 1))
+		self.assertEqual(w.get('test_keyed', dict(id=1)), dict(value=2))
+		self.assertIsNone(w.get('test_keyed', dict(id=2)))
+		self.assertEqual(await self.rows('test_keyed'), [dict(id=i, value=0) for i in range(1, 4)])
+
+		await w.flush()
+		self.assertEqual(len(w.pending), 0)
+		self.assertEqual((w.flushes, w.written, w.failures), (1, 2, 0))
+		self.assertEqual(await self.rows('test_keyed'), [
+			dict(id=1, value=2), dict(id=2, value=0), dict(id=3, value=0), dict(id=9, value=7)
+		])
+
+	async def test_read_your_writes_while_flushing(self):
+		w = self.writer
+		w.update('test_keyed', dict(value=1), dict(id=1))
+		write, started = w._write, asyncio.Event()
+
+		async def slow_write(rows):
+			started.set()
+			await asyncio.sleep(0.01)
+			await write(rows)
+
+		with mock.patch.object(w, '_write', slow_write):
+			flush = asyncio.ensure_future(w.flush())
+			await started.wait()
+			self.assertEqual(w.get('test_keyed', dict(id=1)), dict(value=1))
+			await flush
+		self.assertIsNone(w.get('test_keyed', dict(id=1)))
+
+	async def test_unreachable(self):
+		# the rows are requeued under the writes queued during the failed flush
+		w = self.writer
+		w.update('test_keyed', dict(value=1), dict(id=1))
+		w.update('test_keyed', dict(value=1), dict(id=2))
+
+		async def failed_write(rows):
+			w.update('test_keyed', dict(value=5), dict(id=2))
+			raise OperationalError()
+
+		with mock.patch.object(w, '_write', failed_write):
+			await w.flush()
+		self.assertEqual(w.failures, 1)
+		self.assertEqual(w.get('test_keyed', dict(id=1)), dict(value=1))
+		self.assertEqual(w.get('test_keyed', dict(id=2)), dict(value=5))
+		self.assertEqual(await self.rows('test_keyed'), [dict(id=i, value=0) for i in range(1, 4)])
+
+		await w.flush()
+		self.assertEqual(len(w.pending), 0)
+		self.assertEqual((await self.rows('test_keyed'))[:2], [dict(id=1, value=1), dict(id=2, value=5)])
+
+	async def test_refused_row(self):
+		w = self.writer
+		w.update('test_keyed', dict(value=1), dict(id=1))
+		w.update('test_keyed', dict(missing=1), dict(id=2))
+		w.upsert('test_keyed', dict(value=3), dict(id=3))
+		await w.flush()
+		self.assertEqual((w.failures, w.dropped, w.written), (1, 1, 2))
+		self.assertEqual(len(w.pending), 0)
+		self.assertEqual(await self.rows('test_keyed'), [dict(id=1, value=1), dict(id=2, value=0), dict(id=3, value=3)])
+
+	async def test_unreachable_while_isolating(self):
+		# the database goes away while the rows of a refused flush are written one by one
+		w = self.writer
+		w.update('test_keyed', dict(missing=1), dict(id=1))
+		w.update('test_keyed', dict(value=2), dict(id=2))
+		w.update('test_keyed', dict(value=3), dict(id=3))
+		write, calls = w._write, []
+
+		async def flaky_write(rows):
+			calls.append(len(rows))
+			if len(calls) == 3:
+				raise OperationalError()
+			await write(rows)
+
+		with mock.patch.object(w, '_write', flaky_write):
+			await w.flush()
+		self.assertEqual(calls, [3, 1, 1])
+		self.assertEqual(w.dropped, 1)
+		self.assertEqual([dict(k[1]) for k in w.pending.keys()], [dict(id=2), dict(id=3)])
+
+	async def test_think(self):
+		w = self.writer
+		await w.think(0)
+		self.assertIsNone(w._task)  # nothing queued
+
+		w.update('test_keyed', dict(value=1), dict(id=1))
+		await w.think(100)
+		self.assertIsNotNone(w._task)
+		self.assertEqual(w.next_flush_at, 105)
+		await w._task
+		self.assertEqual(w.written, 1)
+
+		w.update('test_keyed', dict(value=2), dict(id=1))
+		task = w._task
+		await w.think(101)  # not due yet
+		self.assertIs(w._task, task)
+		for i in range(10):
+			w.update('test_keyed', dict(value=i), dict(id=10 + i))
+		await w.think(101)  # max_pending rows are queued
+		self.assertIsNot(w._task, task)
+		await w._task
+		self.assertEqual(w.written, 12)
+
+
+if __name__ == '__main__':
+	unittest.main()